@@ -0,0 +1 @@
+# Benchmarks for the server's hot paths, run them with ``python -m benchmarks.<name>``.
@@ -0,0 +1,74 @@
+"""
+Compare the orjson serialization layer with the json.dumps/jsonable_encoder path it replaces.
+
+    python -m benchmarks.serialization --scorecards 200 --page 100 --repeat 200
+"""
+import argparse
+import json
+
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+
+from benchmarks.stats_kernel import best_of, make_scorecards
+from database.base_models import RiderStatsBase, ScorecardBase
+from database.stats_kernel import calculate_stats_from_scorecards
+from database.utils import replace_nan
+from webserver.serialization import FastJSONResponse, encode_message
+
+
+def legacy_broadcast(type, data):
+    # ConnectionManager.broadcast before the serialization layer
+    serialized_data = json.dumps(data) if isinstance(data, dict) else data
+    return json.dumps({"type": type, "data": serialized_data})
+
+
+def make_stats(scorecards):
+    stats = calculate_stats_from_scorecards(scorecards)
+    return RiderStatsBase(id=str(scorecards[0]['_id']), rider=str(scorecards[0]['rider']), year=2024, **stats)
+
+
+def make_page(scorecards):
+    page = []
+    for scorecard in scorecards:
+        scorecard = dict(scorecard, id=str(scorecard['_id']), rider=str(scorecard['rider']), modifiers=[],
+                         approach='toeside', trick_type='grab', spin='360', spin_direction='fs', session='s')
+        page.append(ScorecardBase(**scorecard))
+    return page
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--scorecards', type=int, default=200, help='scorecards behind the stats payload')
+    parser.add_argument('--page', type=int, default=100, help='scorecards in the HTTP page')
+    parser.add_argument('--repeat', type=int, default=200)
+    args = parser.parse_args()
+
+    scorecards = make_scorecards(args.scorecards)
+    stats = make_stats(scorecards)
+    page = make_page(scorecards[:args.page])
+
+    cases = [
+        ('stats broadcast',
+         lambda: legacy_broadcast('stats', replace_nan(stats.dict())),
+         lambda: encode_message('stats', stats, 'json')),
+        ('stats broadcast (legacy format)',
+         lambda: legacy_broadcast('stats', replace_nan(stats.dict())),
+         lambda: encode_message('stats', stats, 'legacy')),
+        ('scorecard broadcast',
+         lambda: legacy_broadcast('scorecard', page[0].json()),
+         lambda: encode_message('scorecard', page[0], 'json')),
+        (f'GET {args.page} scorecards',
+         lambda: JSONResponse(jsonable_encoder({'data': page})).body,
+         lambda: FastJSONResponse({'data': page}).body),
+    ]
+
+    print(f"{'payload':<32} {'old us':>10} {'new us':>10} {'speedup':>8} {'old B':>8} {'new B':>8}")
+    for name, old, new in cases:
+        old_time = best_of(old, args.repeat)
+        new_time = best_of(new, args.repeat)
+        print(f"{name:<32} {old_time * 1e6:>10.1f} {new_time * 1e6:>10.1f} {old_time / new_time:>7.1f}x "
+              f"{len(old()):>8} {len(new()):>8}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,294 @@
+"""
+Time ServerMemory, the stats and the rankings on synthetic data in an in-memory Mongo.
+
+    pip install -r benchmarks/requirements.txt
+    python -m benchmarks.server_memory --sizes 20:500 100:2500 400:10000 --output results.json
+    python -m benchmarks.server_memory --output new.json --compare results.json
+
+Each size is ``riders:scorecards``. The data comes from Faker with a fixed
+seed, so two commits benchmarked with the same arguments see the same
+riders and scorecards; ``--compare`` prints the ratio of every timing to
+an earlier results file.
+"""
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import tempfile
+import time
+from datetime import datetime, timedelta
+from urllib.parse import urlencode
+
+import mongoengine
+import mongomock
+from bson import ObjectId
+from faker import Faker
+
+# (database, alias) as connected by database.DataBase
+DATABASES = (('main', 'default'), ('Cable', 'cable'), ('NoteBot', 'notebot'))
+DEFAULT_SIZES = ('20:500', '100:2500', '400:10000')
+CARRIERS = 8
+# Riders the per-rider benchmarks run for
+RIDER_SAMPLE = 20
+
+SECTIONS = ('Kicker', 'Rail', 'Air Trick')
+APPROACHES = ('toeside', 'heelside')
+TRICK_TYPES = ('grab', 'spin', 'invert')
+SPINS = ('0', '180', '360', '540')
+SPIN_DIRECTIONS = ('fs', 'bs')
+
+
+def connect():
+    for name, alias in DATABASES:
+        mongoengine.connect(name, alias=alias, mongo_client_class=mongomock.MongoClient)
+
+
+def reset():
+    for name, alias in DATABASES:
+        mongoengine.get_connection(alias).drop_database(name)
+
+
+def scorecard_fields(rng: random.Random, fake: Faker) -> dict:
+    metrics = [rng.uniform(0, 100) for _ in range(4)]
+    return dict(section=rng.choice(SECTIONS), approach=rng.choice(APPROACHES), trick_type=rng.choice(TRICK_TYPES),
+                spin=rng.choice(SPINS), spin_direction=rng.choice(SPIN_DIRECTIONS), modifiers=[],
+                division=metrics[0], execution=metrics[1], creativity=metrics[2], difficulty=metrics[3],
+                score=sum(metrics) / 4, landed=rng.random() > 0.2, session=fake.uuid4())
+
+
+def generate(riders: int, scorecards: int, seed: int = 0) -> dict:
+    """Write ``riders`` riders, their scorecards and stats, parks and carriers; returns the counts."""
+    from database.CableOps.park import Park
+    from database.CWA_Events import ContestCarrier, Rider, RiderCompStats, Scorecard
+    from database.stats_engine import StatsEngine
+
+    fake = Faker()
+    fake.seed_instance(seed)
+    rng = random.Random(seed)
+
+    parks = [Park(id=ObjectId(), name=f"{fake.city()} Cable Park", abbreviation=fake.lexify('???').upper())
+             for _ in range(max(1, riders // 50))]
+    Park._get_collection().insert_many([park.to_mongo() for park in parks])
+
+    rider_documents = [Rider(id=ObjectId(), first_name=fake.first_name(), last_name=fake.last_name(),
+                             email=fake.email(), gender=rng.choice(('male', 'female')),
+                             date_of_birth=datetime.combine(fake.date_of_birth(minimum_age=8, maximum_age=70),
+                                                            datetime.min.time()),
+                             stance=rng.choice(('regular', 'goofy')), year_started=rng.randint(1995, 2024),
+                             home_park=rng.choice(parks))
+                       for _ in range(riders)]
+    Rider._get_collection().insert_many([rider.to_mongo() for rider in rider_documents])
+
+    ContestCarrier._get_collection().insert_many(
+        [ContestCarrier(number=number, bib_color=fake.color_name()).to_mongo() for number in range(1, CARRIERS + 1)])
+
+    start = datetime(2024, 5, 1)
+    documents = []
+    for index in range(scorecards):
+        rider = rng.choice(rider_documents)
+        documents.append(Scorecard(id=ObjectId(), date=start + timedelta(minutes=index), rider=rider,
+                                   park=rider.home_park, **scorecard_fields(rng, fake)).to_mongo())
+    if documents:
+        Scorecard._get_collection().insert_many(documents)
+
+    engine = StatsEngine()
+    for rider in rider_documents:
+        stats = engine.rebuild(rider.id)
+        if stats:
+            RiderCompStats(rider=rider, **stats).save()
+
+    return {'riders': riders, 'scorecards': scorecards, 'parks': len(parks), 'carriers': CARRIERS}
+
+
+def measure(function, repeat: int) -> dict:
+    """Run ``function`` ``repeat`` times; its prints are dropped, they would dominate the small cases."""
+    timings = []
+    for _ in range(repeat):
+        with contextlib.redirect_stdout(io.StringIO()):
+            start = time.perf_counter()
+            function()
+            timings.append(time.perf_counter() - start)
+    return {
+        'min_ms': round(min(timings) * 1000, 3),
+        'median_ms': round(statistics.median(timings) * 1000, 3),
+        'max_ms': round(max(timings) * 1000, 3),
+        'runs': len(timings),
+    }
+
+
+def per_rider(function, items, repeat: int, run=None) -> dict:
+    # One run covers the sampled riders, the figures are per rider
+    def run_items():
+        for item in items:
+            function(item)
+    result = measure(run or run_items, repeat)
+    for key in ('min_ms', 'median_ms', 'max_ms'):
+        result[key] = round(result[key] / max(1, len(items)), 3)
+    result['riders'] = len(items)
+    return result
+
+
+def fold_benchmarks(rider_ids, repeat: int, seed: int) -> dict:
+    """Time the live stats path: seeding a rider from its history, then folding one new scorecard."""
+    from database.CWA_Events import Scorecard
+    from database.stats_engine import StatsEngine
+
+    histories = {rider_id: list(Scorecard.get_scorecards_by_rider(rider_id)) for rider_id in rider_ids}
+    engine = StatsEngine(loader=lambda rider_id: histories[rider_id])
+    results = {'stats_seed': per_rider(lambda rider_id: engine.seed(rider_id, histories[rider_id]),
+                                       rider_ids, repeat)}
+
+    # Folds skip scorecards the rider already holds, so every run folds fresh ones
+    fake = Faker()
+    fake.seed_instance(seed)
+    rng = random.Random(seed)
+    date = datetime(2025, 1, 1)
+    batches = iter([[dict(scorecard_fields(rng, fake), _id=ObjectId(), rider=rider_id, date=date)
+                     for rider_id in rider_ids] for _ in range(repeat)])
+    results['stats_fold'] = per_rider(None, rider_ids, repeat, run=lambda: [engine.fold(scorecard)
+                                                                            for scorecard in next(batches)])
+    return results
+
+
+def load_memory(snapshot_path: str):
+    from database.server_memory import ServerMemory
+
+    memory = ServerMemory(snapshot_path=snapshot_path)
+    asyncio.run(memory.load_data())
+    return memory
+
+
+def benchmark_size(riders: int, scorecards: int, repeat: int, seed: int) -> dict:
+    from fastapi.testclient import TestClient
+
+    from database.CWA_Events import Scorecard
+    from database.stats_engine import StatsEngine
+    from webserver.web_server import FastAPIApp
+
+    reset()
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        counts = generate(riders, scorecards, seed)
+    seed_seconds = time.perf_counter() - start
+
+    results = {}
+    with tempfile.TemporaryDirectory() as directory:
+        missing_snapshot = os.path.join(directory, 'missing.snapshot')
+        snapshot_path = os.path.join(directory, 'server_memory.snapshot')
+
+        results['load_data'] = measure(lambda: load_memory(missing_snapshot), repeat)
+        with contextlib.redirect_stdout(io.StringIO()):
+            memory = load_memory(snapshot_path)
+            memory.save_snapshot()
+        results['load_data_snapshot'] = measure(lambda: load_memory(snapshot_path), repeat)
+
+        rider_ids = sorted(memory.riders.keys())[:RIDER_SAMPLE]
+        results['stats_rebuild'] = per_rider(StatsEngine().rebuild, rider_ids, repeat)
+        results.update(fold_benchmarks(rider_ids, repeat, seed))
+        results['get_trick_statistics'] = per_rider(Scorecard.get_trick_statistics, rider_ids, repeat)
+        for name in ('rider_rankings_cwa', 'rider_rankings_by_experience', 'rider_rankings_by_division',
+                     'rider_rankings_by_age_group'):
+            results[name] = measure(lambda name=name: getattr(memory, name), repeat)
+
+        # The Mongo reads of a profile are timed above, this is the in-memory rebuild
+        profile_inputs = [(memory.stats.get_by('rider', rider_id),
+                           (Scorecard.calculate_score_counts(rider_id), Scorecard.get_trick_statistics(rider_id)))
+                          for rider_id in rider_ids]
+        profile_inputs = [(stats, data) for stats, data in profile_inputs if stats is not None]
+        results['create_or_update_rider_profile'] = per_rider(
+            lambda item: memory.create_or_update_rider_profile(item[0], *item[1]), profile_inputs, repeat)
+
+        with contextlib.redirect_stdout(io.StringIO()):
+            app = FastAPIApp(None)
+            app.memory.snapshot_path = missing_snapshot
+            asyncio.run(app.memory.load_data())
+        client = TestClient(app.app)
+        rider_id = rider_ids[0] if rider_ids else ''
+        routes = {
+            'GET /api/riders': '/api/riders',
+            'GET /api/riders/profile/{rider_id}': f'/api/riders/profile/{rider_id}',
+            'GET /api/stats/riders': '/api/stats/riders',
+            'GET /api/scorecards': '/api/scorecards',
+            'GET /api/scorecards?rider_ids': '/api/scorecards?' + urlencode({'rider_ids': rider_id,
+                                                                            'sort_by': 'Score: Highest'}),
+            'GET /api/scorecards/summary': '/api/scorecards/summary?by=trick',
+            'GET /api/parks': '/api/parks',
+            'GET /api/contest/carriers': '/api/contest/carriers',
+            'GET /api/sync': '/api/sync',
+        }
+        for name, path in routes.items():
+            status = client.get(path).status_code
+            if status != 200:
+                print(f"{name} answered {status}, timing it anyway")
+            results[name] = measure(lambda path=path: client.get(path), repeat)
+
+    return {'size': counts, 'seed_seconds': round(seed_seconds, 3), 'benchmarks': results}
+
+
+def commit() -> str:
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True,
+                              cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__)))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ''
+
+
+def compare(results: dict, baseline: dict):
+    previous = {(json.dumps(entry['size'], sort_keys=True), name): timing['median_ms']
+                for entry in baseline['results'] for name, timing in entry['benchmarks'].items()}
+    print(f"\nMedian against {baseline['meta'].get('commit') or 'baseline'}")
+    for entry in results['results']:
+        size = json.dumps(entry['size'], sort_keys=True)
+        for name, timing in entry['benchmarks'].items():
+            before = previous.get((size, name))
+            if before:
+                print(f"{entry['size']['riders']:>6} {entry['size']['scorecards']:>8} {name:<36} "
+                      f"{before:>10.3f} {timing['median_ms']:>10.3f} {timing['median_ms'] / before:>7.2f}x")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--sizes', nargs='+', default=list(DEFAULT_SIZES), help='riders:scorecards')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='write the results to this JSON file')
+    parser.add_argument('--compare', help='an earlier results file to compare with')
+    args = parser.parse_args()
+
+    connect()
+    results = {
+        'meta': {
+            'commit': commit(),
+            'date': datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'repeat': args.repeat,
+            'seed': args.seed,
+        },
+        'results': [],
+    }
+
+    print(f"{'riders':>6} {'cards':>8} {'benchmark':<36} {'min ms':>10} {'median ms':>10}")
+    for size in args.sizes:
+        riders, scorecards = (int(part) for part in size.split(':'))
+        entry = benchmark_size(riders, scorecards, args.repeat, args.seed)
+        results['results'].append(entry)
+        for name, timing in entry['benchmarks'].items():
+            print(f"{riders:>6} {scorecards:>8} {name:<36} {timing['min_ms']:>10.3f} {timing['median_ms']:>10.3f}")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            compare(results, json.load(f))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,78 @@
+"""
+Compare the NumPy ``calculate_stats`` kernel with the original pandas path.
+
+    python -m benchmarks.stats_kernel --scorecards 50 200 1000 --repeat 20
+"""
+import argparse
+import math
+import random
+import time
+from datetime import datetime, timedelta
+
+from bson import ObjectId
+from pandas import DataFrame
+
+from database.stats_kernel import calculate_stats_from_scorecards
+from database.utils import calculate_stats_frame
+
+
+def make_scorecards(count, seed=0):
+    rng = random.Random(seed)
+    rider = ObjectId()
+    start = datetime(2024, 6, 1)
+    scorecards = []
+    for index in range(count):
+        metrics = [rng.uniform(0, 100) for _ in range(4)]
+        scorecards.append({
+            '_id': ObjectId(),
+            'date': start + timedelta(minutes=index),
+            'section': rng.choice(['Kicker', 'Rail', 'Air Trick']),
+            'division': metrics[0],
+            'execution': metrics[1],
+            'creativity': metrics[2],
+            'difficulty': metrics[3],
+            'score': sum(metrics) / 4,
+            'landed': rng.random() > 0.2,
+            'rider': rider,
+        })
+    return scorecards
+
+
+def max_difference(left, right):
+    if isinstance(left, dict):
+        return max((max_difference(left[key], right[key]) for key in left), default=0.0)
+    if isinstance(left, float) and math.isnan(left) and math.isnan(right):
+        return 0.0
+    return abs(left - right)
+
+
+def best_of(function, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--scorecards', type=int, nargs='+', default=[50, 200, 1000])
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    print(f"{'scorecards':>10} {'pandas ms':>10} {'numpy ms':>10} {'speedup':>8} {'max diff':>10}")
+    for count in args.scorecards:
+        scorecards = make_scorecards(count)
+        # calculate_stats builds the DataFrame from Mongo dicts, include that in the pandas timing
+        pandas_result = calculate_stats_frame(DataFrame(scorecards))
+        numpy_result = calculate_stats_from_scorecards(scorecards)
+
+        pandas_time = best_of(lambda: calculate_stats_frame(DataFrame(scorecards)), args.repeat)
+        numpy_time = best_of(lambda: calculate_stats_from_scorecards(scorecards), args.repeat)
+        print(f"{count:>10} {pandas_time * 1000:>10.2f} {numpy_time * 1000:>10.2f} "
+              f"{pandas_time / numpy_time:>7.1f}x {max_difference(numpy_result, pandas_result):>10.2e}")
+
+
+if __name__ == '__main__':
+    main()
@@ -3,7 +3,9 @@ from datetime import datetime
 
 import mongoengine as db
 
-class ContestCarrier(db.Document):
+from database.change_tracking import TrackedDocument
+
+class ContestCarrier(TrackedDocument):
     number = db.IntField(unique=True)
     rider = db.ReferenceField('Rider')
     bib_color = db.StringField()
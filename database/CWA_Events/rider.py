@@ -1,6 +1,8 @@
 from datetime import datetime
 
 from firebase_admin import storage
+from bson import ObjectId
+from pymongo import UpdateOne
 from mongoengine import IntField, StringField, ReferenceField, DateTimeField, BooleanField, FloatField
 
 from database.CWA_Events import User
@@ -55,6 +57,19 @@ class Rider(User):
             print(f"Failed to set {image_type} image for rider: {self.full_name}. Image path: {image_path}")
             print(f"Error: {e}")
 
+    @classmethod
+    def set_divisions(cls, divisions: dict):
+        """Write many riders' division scores in a single bulk_write instead of a save() each."""
+        if not divisions:
+            return
+        # The division is derived from the rider's stats, which carry their own last_modified.
+        # Stamping the riders here would mark every one of them changed after the sync watermark.
+        cls._get_collection().bulk_write(
+            [UpdateOne({'_id': ObjectId(rider_id)}, {'$set': {'division': division}})
+             for rider_id, division in divisions.items()],
+            ordered=False
+        )
+
     def to_dict(self):
         """Convert MongoDB document to a dictionary with formatted dates."""
         data = self.to_mongo().to_dict()
@@ -1,9 +1,14 @@
 from datetime import datetime
 
-import pandas as pd
 from bson import ObjectId
 from mongoengine import Document, DateTimeField, StringField, FloatField, BooleanField, ListField, ReferenceField
 
+from database.scorecard_cursor import cursor_query, parse_cursor, sort_spec
+from database.stats_engine import describe_values
+
+
+def _is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool) and value == value
 
 
 class Scorecard(Document):
@@ -25,7 +30,16 @@ class Scorecard(Document):
     park = ReferenceField("Park")
     judge = ReferenceField("Judge")
 
-    meta = {'db_alias': 'cable'}
+    meta = {
+        # Serve every feed sort mode, per rider list ($in) or overall, from an index
+        'indexes': [
+            ('rider', '-date', '-id'),
+            ('rider', '-score', '-id'),
+            ('-date', '-id'),
+            ('-score', '-id'),
+        ],
+        'db_alias': 'cable'
+    }
 
     def to_dict(self):
         """Convert MongoDB document to a dictionary with formatted dates."""
@@ -37,52 +51,18 @@ class Scorecard(Document):
 
     @classmethod
     def get_scorecards(cls, rider_ids=None, sort_by='Most Recent', cursor=None, batch_size=10):
-        all_scorecards = []
-
+        """
+        One page of scorecards across every rider in ``rider_ids``, in a single query.
+
+        ``cursor`` is the composite cursor of the last scorecard of the previous
+        page (see ``database.scorecard_cursor``) or a legacy ISO date.
+        """
+        field, descending = sort_spec(sort_by)
+        direction = '-' if descending else ''
+        query = cls.objects(cursor_query(parse_cursor(cursor, sort_by), sort_by))
         if rider_ids:
-            for rider_id in rider_ids:
-                query_params = {'rider': rider_id}
-
-                query = cls.objects(**query_params)
-
-                if sort_by == 'Most Recent':
-                    query = query.order_by('-date')
-                elif sort_by == 'Score: Highest':
-                    query = query.order_by('-score')
-                elif sort_by == 'Score: Lowest':
-                    query = query.order_by('score')
-
-                if cursor:
-                    if isinstance(cursor, str):
-                        cursor_date = datetime.fromisoformat(cursor)
-                    else:
-                        cursor_date = cursor
-                    query = query.filter(date__lt=cursor_date)
-
-                rider_scorecards = query.limit(batch_size)
-                all_scorecards.extend(rider_scorecards)
-
-        else:
-            # Handle case where no rider_ids are provided
-            query = cls.objects()
-
-            if sort_by == 'Most Recent':
-                query = query.order_by('-date')
-            elif sort_by == 'Score: Highest':
-                query = query.order_by('-score')
-            elif sort_by == 'Score: Lowest':
-                query = query.order_by('score')
-
-            if cursor:
-                if isinstance(cursor, str):
-                    cursor_date = datetime.fromisoformat(cursor)
-                else:
-                    cursor_date = cursor
-                query = query.filter(date__lt=cursor_date)
-
-            all_scorecards = query.limit(batch_size)
-
-        return all_scorecards
+            query = query.filter(rider__in=rider_ids)
+        return query.order_by(f'{direction}{field}', f'{direction}id').limit(batch_size)
 
     @classmethod
     def get_scorecards_by_rider(cls, rider):
@@ -107,48 +87,54 @@ class Scorecard(Document):
     @classmethod
     def get_trick_statistics(cls, rider_id):
         # Fetch all scorecards for the rider
-        scorecards = cls.objects.filter(rider=rider_id)
+        scorecards = cls.objects.filter(rider=rider_id).as_pymongo()
 
-        # Check if scorecards are empty
-        if not scorecards:
-            return
+        trick_stats = cls.summarize_tricks(scorecards)
 
-        # Convert scorecards to a list of dictionaries
-        scorecards_data = []
-        for scorecard in scorecards:
-            scorecard_dict = scorecard.to_mongo().to_dict()
-            scorecard_dict['_id'] = str(scorecard_dict['_id'])
-            scorecards_data.append(cls.convert_objectids(scorecard_dict))
-
-        # Create a DataFrame
-        df = pd.DataFrame(scorecards_data)
+        # Keep returning None for riders without scorecards
+        return trick_stats or None
 
-        # Construct the 'trick name'
-        df['trick_name'] = df['section'] + ' ' + df['approach'] + ' ' + df['trick_type'] + ' ' + df[
-            'spin_direction'] + ' ' + df['spin']
+    @classmethod
+    def get_all_trick_statistics(cls, rider_ids=None):
+        """Trick statistics of every rider, or of ``rider_ids``, from a single scan of the collection."""
+        scorecards_by_rider = {}
+        queryset = cls.objects(rider__in=list(rider_ids)) if rider_ids is not None else cls.objects
+        # Whole documents, the highest scorecard of each trick is echoed back as get_trick_statistics does
+        for scorecard in queryset.as_pymongo().batch_size(1000):
+            rider = scorecard.get('rider')
+            if rider is not None:
+                scorecards_by_rider.setdefault(str(rider), []).append(scorecard)
+        return {rider: cls.summarize_tricks(scorecards) for rider, scorecards in scorecards_by_rider.items()}
 
-        # Group by 'trick name'
-        grouped = df.groupby('trick_name')
+    @classmethod
+    def summarize_tricks(cls, scorecards):
+        """Group raw scorecard dicts by trick name and describe each group."""
+        tricks = {}
+        for scorecard in scorecards:
+            parts = [scorecard.get(field) for field in ('section', 'approach', 'trick_type', 'spin_direction', 'spin')]
+            if any(part is None for part in parts):
+                continue
+            scorecard = cls.convert_objectids(dict(scorecard))
+            scorecard['trick_name'] = ' '.join(parts)
+            tricks.setdefault(scorecard['trick_name'], []).append(scorecard)
 
         # Initialize a dictionary to store the results
         trick_stats = {}
+        for name in sorted(tricks):
+            group = tricks[name]
+            scored = [scorecard for scorecard in group if _is_number(scorecard.get('score'))]
+            if not scored:
+                continue
 
-        # Loop through each group
-        for name, group in grouped:
-            # Compute statistics using describe()
-            stats = group['score'].describe().to_dict()
-
-            # Find the scorecard with the highest score
-            highest_scorecard = group.loc[group['score'].idxmax()].to_dict()
-            highest_scorecard['_id'] = str(highest_scorecard['_id'])
-
-            score = group[['division', 'execution', 'difficulty', 'creativity']].describe().to_dict()
+            # Find the scorecard with the highest score, the first one wins ties
+            highest_scorecard = max(scored, key=lambda scorecard: scorecard['score'])
 
-            # Add overall and highest scorecard to the result dictionary
             trick_stats[name] = {
-                'stats': stats,
+                'stats': describe_values(scorecard['score'] for scorecard in scored),
                 'highest_scorecard': highest_scorecard,
-                'scores': score
+                'scores': {metric: describe_values(scorecard.get(metric) for scorecard in group
+                                                   if _is_number(scorecard.get(metric)))
+                           for metric in ('division', 'execution', 'difficulty', 'creativity')}
             }
 
         return trick_stats
@@ -175,16 +161,24 @@ class Scorecard(Document):
 
     @classmethod
     def calculate_score_counts(cls, rider_id):
-        # Calculate total count
-        total = cls.objects(rider=rider_id).count()
+        # Total, scored (>= 50) and attempted (not landed) counts in one round trip
+        return cls.calculate_all_score_counts({'rider': ObjectId(str(rider_id))}).get(str(rider_id), (0, 0, 0))
 
-        # Calculate scored count
-        scored = cls.objects(rider=rider_id, score__gte=50).count()
-
-        # Calculate attempted count
-        attempted = cls.objects(rider=rider_id, landed=False).count()
-
-        return total, scored, attempted
+    @classmethod
+    def calculate_all_score_counts(cls, match=None):
+        """(total, scored, attempted) per rider id from a single aggregation."""
+        pipeline = [
+            {'$group': {
+                '_id': '$rider',
+                'total': {'$sum': 1},
+                'scored': {'$sum': {'$cond': [{'$gte': ['$score', 50]}, 1, 0]}},
+                'attempted': {'$sum': {'$cond': [{'$eq': ['$landed', False]}, 1, 0]}},
+            }}
+        ]
+        if match:
+            pipeline.insert(0, {'$match': match})
+        return {str(row['_id']): (row['total'], row['scored'], row['attempted'])
+                for row in cls.objects.aggregate(pipeline) if row['_id'] is not None}
 
     @classmethod
     def convert_objectids(cls, data):
@@ -2,8 +2,10 @@ from datetime import datetime
 
 from mongoengine import DictField, ReferenceField, IntField, Document, FloatField
 
+from database.change_tracking import TrackedDocument
 
-class RiderCompStats(Document):
+
+class RiderCompStats(TrackedDocument):
     rider = ReferenceField('Rider', required=True)
     year = IntField(default=datetime.now().year)
 
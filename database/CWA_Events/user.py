@@ -2,8 +2,10 @@ from datetime import datetime, date
 
 import mongoengine as db
 
+from database.change_tracking import TrackedDocument
 
-class User(db.Document):
+
+class User(TrackedDocument):
     email = db.StringField()
     first_name = db.StringField()
     last_name = db.StringField()
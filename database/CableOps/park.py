@@ -1,8 +1,10 @@
 import mongoengine as db
 
-from mongoengine import Document, StringField, ReferenceField, ListField, EmbeddedDocument, EmbeddedDocumentField, \
+from mongoengine import StringField, ReferenceField, ListField, EmbeddedDocument, EmbeddedDocumentField, \
     EmailField
 
+from database.change_tracking import TrackedDocument
+
 
 
 class Address(EmbeddedDocument):
@@ -20,7 +22,7 @@ class Contact(EmbeddedDocument):
     email = EmailField()
 
 
-class Park(Document):
+class Park(TrackedDocument):
     name = StringField(required=True)
     abbreviation = StringField(required=False)
     address = EmbeddedDocumentField(Address, default=None)
@@ -1,11 +1,22 @@
 # auth_service.py
 
 from fastapi import HTTPException, status
+from database.executor import run_blocking
 from database.NoteBot.models import NoteBotUser, pwd_context, UserRegister, UserLogin
 
 class AuthService:
+    # Password hashing and the user lookups block, both run on the database pool
+
     @staticmethod
     async def register_user(user: UserRegister):
+        return await run_blocking(AuthService._register_user, user)
+
+    @staticmethod
+    async def login_user(user: UserLogin):
+        return await run_blocking(AuthService._login_user, user)
+
+    @staticmethod
+    def _register_user(user: UserRegister):
         try:
             # Check if the user already exists
             if NoteBotUser.objects(email=user.email).first():
@@ -41,7 +52,7 @@ class AuthService:
             )
 
     @staticmethod
-    async def login_user(user: UserLogin):
+    def _login_user(user: UserLogin):
         try:
             # Find the user by email
             existing_user = NoteBotUser.objects(email=user.email).first()
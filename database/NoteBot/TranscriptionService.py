@@ -1,3 +1,4 @@
+import asyncio
 import os
 import json
 from pprint import pprint
@@ -7,6 +8,7 @@ from dotenv import load_dotenv
 from fastapi import HTTPException, UploadFile
 from pydantic import ValidationError
 
+from database.executor import run_blocking
 from database.NoteBot.models import CallDetailsModel, TokenUsageModel, NOTE_TYPE_DESCRIPTORS, TranscriptionResponseModel
 from openai import OpenAI
 import assemblyai as aai
@@ -80,12 +82,12 @@ class TranscriptionService:
 
             print("Save")
             # Save the token usage and associate it with call details
-            call_details.token_usage = token_usage_model.save()
+            call_details.token_usage = await run_blocking(token_usage_model.save)
             print("*" * 20)
             print("Save")
 
             # Step 4: Save the CallDetailsModel to MongoDB
-            call_details_document = call_details.save()
+            call_details_document = await run_blocking(call_details.save)
             print("*" * 20)
 
             # Step 5: Return the saved document as a dictionary to be sent back to the client
@@ -100,8 +102,9 @@ class TranscriptionService:
             print(f"Starting AssemblyAI transcription for file: {file_location}")
             # Transcribe the local file using AssemblyAI
             with open(file_location, "rb") as audio_file:
-                # Upload file to AssemblyAI
-                transcript = self.transcriber.transcribe(
+                # Upload file to AssemblyAI, the SDK blocks until the transcript is ready
+                transcript = await asyncio.to_thread(
+                    self.transcriber.transcribe,
                     audio_file,
                     config=self.aai_config
                 )
@@ -185,7 +188,8 @@ class TranscriptionService:
         print("-" * 20)
 
         try:
-            response = client.chat.completions.create(
+            response = await asyncio.to_thread(
+                client.chat.completions.create,
                 model="gpt-4o-mini",
                 temperature=0,
                 messages=[
@@ -247,13 +251,14 @@ class TranscriptionService:
     async def transcribe_large_file(self, file_location: str):
         try:
             # Split the audio file into smaller chunks
-            chunk_files = self.split_audio(file_location)
+            chunk_files = await asyncio.to_thread(self.split_audio, file_location)
             transcription_results = []
 
             for chunk_file in chunk_files:
                 with open(chunk_file, "rb") as audio_file:
                     # Upload file to AssemblyAI and transcribe
-                    transcript = self.transcriber.transcribe(audio_file, config=self.aai_config)
+                    transcript = await asyncio.to_thread(self.transcriber.transcribe, audio_file,
+                                                         config=self.aai_config)
 
                     # Collect each chunk's transcription results
                     transcription_results.extend([{
@@ -1,3 +1,4 @@
+import asyncio
 import json
 import mimetypes
 import os
@@ -8,6 +9,7 @@ from typing import Optional
 
 from fastapi import APIRouter, UploadFile, File, HTTPException, Form
 
+from database.executor import run_blocking
 from database.NoteBot import TranscriptionService
 
 from database.NoteBot import AuthService
@@ -16,6 +18,19 @@ from database.NoteBot.models import CallDetails, UserRegister, UserLogin, Partic
 UPLOAD_DIR = "./temp_chunks"  # Directory to store chunks
 sessions = {}  # Dictionary to keep track of sessions and associated data
 
+
+def write_file(path: str, data: bytes):
+    with open(path, "wb") as output:
+        output.write(data)
+
+
+def assemble_chunks(session_path: str, total_chunks: int, final_path: str):
+    with open(final_path, "wb") as final_file:
+        for i in range(total_chunks):
+            chunk_file_path = os.path.join(session_path, f"chunk_{i}")
+            with open(chunk_file_path, "rb") as chunk:
+                final_file.write(chunk.read())
+
 #
 class NoteBotRoute:
     def __init__(self, connection_manager, server_memory):
@@ -46,11 +61,9 @@ class NoteBotRoute:
         @self.router.get("/calls")
         async def get_all_call_details():
             try:
-                # Query all CallDetails documents from MongoDB
-                call_details_list = CallDetails.objects.all()
-
-                # Convert each CallDetails document to a dictionary using to_dict()
-                call_details_dicts = [call_detail.to_dict() for call_detail in call_details_list]
+                # Query all CallDetails documents from MongoDB and convert each to a dictionary, off the loop
+                call_details_dicts = await run_blocking(
+                    lambda: [call_detail.to_dict() for call_detail in CallDetails.objects.all()])
 
                 # Return the list of call details as JSON
                 return {"call_details": call_details_dicts}
@@ -85,8 +98,7 @@ class NoteBotRoute:
 
                 # Save the current chunk
                 chunk_path = os.path.join(session_path, f"chunk_{chunk_index}")
-                with open(chunk_path, "wb") as chunk_file:
-                    chunk_file.write(await file.read())
+                await asyncio.to_thread(write_file, chunk_path, await file.read())
 
                 # Update the session's received chunk count
                 sessions[session_id]["received_chunks"] += 1
@@ -96,11 +108,7 @@ class NoteBotRoute:
                 if sessions[session_id]["received_chunks"] == total_chunks:
                     # Assemble chunks into one file
                     final_path = os.path.join(UPLOAD_DIR, f"{session_id}.m4a")
-                    with open(final_path, "wb") as final_file:
-                        for i in range(total_chunks):
-                            chunk_file_path = os.path.join(session_path, f"chunk_{i}")
-                            with open(chunk_file_path, "rb") as chunk:
-                                final_file.write(chunk.read())
+                    await asyncio.to_thread(assemble_chunks, session_path, total_chunks, final_path)
 
                     print(f"All chunks received for session {session_id}. File assembled at {final_path}")
 
@@ -1,6 +1,7 @@
 from typing import List, Optional
 from pydantic import BaseModel, validator
 from bson import ObjectId
+from datetime import datetime
 from database.CableOps.park import Park
 
 from pydantic import BaseModel
@@ -77,7 +78,7 @@ class ParkBase(BaseModel):
 
             if existing_park:
                 # Update the existing park document in the database
-                existing_park.update(**park_data)
+                existing_park.update(last_modified=datetime.utcnow(), **park_data)
             else:
                 # Insert a new park document if it doesn't exist
                 new_park = Park(**park_data)
@@ -6,7 +6,6 @@ from pydantic import BaseModel, validator
 
 from database.base_models import RiderStatsBase
 from database.CWA_Events import Rider
-from database.utils import calculate_division
 
 
 class RiderBase(BaseModel):
@@ -91,32 +90,3 @@ class RiderProfileBase(BaseModel):
         json_encoders = {
             datetime: lambda v: v.strftime("%Y-%m-%dT%H:%M:%S")
         }
-
-
-
-def calculate_cwa_rank(rider_id, rider_rankings_cwa):
-    for index, (ranking_id, score) in enumerate(rider_rankings_cwa):
-        if ranking_id == rider_id:
-            return index + 1
-    return 0
-
-
-def calculate_age_rank(rider_id, rider_rankings_by_age_group):
-    for age_group, rider_ids in rider_rankings_by_age_group.items():
-        if rider_id in rider_ids:
-
-            return rider_ids.index(rider_id) + 1
-    return 0
-
-def calculate_experience_rank(rider_id, rider_rankings_by_experience):
-    for bracket, riders in rider_rankings_by_experience.items():
-        if rider_id in [r['rider_id'] for r in riders]:
-            return list(r['rider_id'] for r in riders).index(rider_id) + 1
-    return 0
-
-def calculate_division_rank(rider_id, rider_rankings_by_division, division_score):
-    division = calculate_division(division_score)
-    for rank, (ranking_rider_id, score) in enumerate(rider_rankings_by_division.get(division, [])):
-        if ranking_rider_id == rider_id:
-            return rank + 1
-    return 0
\ No newline at end of file
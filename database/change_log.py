@@ -0,0 +1,71 @@
+import os
+import uuid
+from collections import deque
+from typing import Any, Dict, Optional, Tuple
+
+# Changes remembered for /api/sync, older clients get a full snapshot instead
+CHANGE_LOG_SIZE = int(os.getenv('CABLEOPS_CHANGE_LOG_SIZE', 10000))
+
+
+class ChangeLog:
+    """
+    Global version clock and bounded log of the changes made to ServerMemory.
+
+    Every IndexedStore reports its upserts, deletes and resets here. Each
+    change gets the next version; ``changes_since`` folds the log after a
+    client's version into the latest operation per document. Versions are
+    only meaningful within one process, so tokens handed to clients carry
+    a random epoch and a token from an earlier run asks for a full sync.
+    """
+
+    def __init__(self, size: int = CHANGE_LOG_SIZE):
+        self.epoch = uuid.uuid4().hex[:8]
+        self.version = 0
+        self._entries: deque = deque(maxlen=size)
+        # Version of the latest replace() of any collection, a delta cannot span it
+        self._reset_version = 0
+
+    def record(self, collection: str, operation: str, key: Any = None):
+        self.version += 1
+        if operation == 'reset':
+            self._reset_version = self.version
+            return
+        self._entries.append((self.version, collection, key, operation))
+
+    def token(self, version: Optional[int] = None) -> str:
+        return f"{self.epoch}-{self.version if version is None else version}"
+
+    def parse(self, token: Optional[str]) -> Optional[int]:
+        """Version of a token issued by this process, None if it is missing, foreign or malformed."""
+        if not token:
+            return None
+        epoch, _, version = token.rpartition('-')
+        if epoch != self.epoch or not version.isdigit() or int(version) > self.version:
+            return None
+        return int(version)
+
+    def changes_since(self, version: int) -> Optional[Dict[str, Dict[Any, str]]]:
+        """
+        ``{collection: {key: 'upsert' | 'delete'}}`` for the changes after
+        ``version``, or None when the log no longer covers that range.
+        """
+        if version < self._reset_version:
+            return None
+        if self._entries and self._entries[0][0] > version + 1 and len(self._entries) == self._entries.maxlen:
+            # Entries after ``version`` were already evicted
+            return None
+
+        changes: Dict[str, Dict[Any, str]] = {}
+        for entry_version, collection, key, operation in reversed(self._entries):
+            if entry_version <= version:
+                break
+            # Walking backwards, the first operation seen per key is its latest
+            changes.setdefault(collection, {}).setdefault(key, operation)
+        return changes
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def bounds(self) -> Tuple[int, int]:
+        oldest = self._entries[0][0] if self._entries else self.version
+        return oldest, self.version
@@ -0,0 +1,27 @@
+from datetime import datetime
+
+from bson import ObjectId
+from mongoengine import DateTimeField, Document, Q
+
+
+class TrackedDocument(Document):
+    """
+    Abstract document that stamps ``last_modified`` (UTC) on every save.
+
+    ServerMemory uses the stamp, together with the creation time embedded in
+    the ObjectId, to fetch only the documents that changed since a snapshot.
+    Writes that bypass ``save()`` (``update``, ``bulk_write``) must set
+    ``last_modified`` themselves.
+    """
+    last_modified = DateTimeField()
+
+    meta = {'abstract': True}
+
+    def save(self, *args, **kwargs):
+        self.last_modified = datetime.utcnow()
+        return super().save(*args, **kwargs)
+
+
+def changed_since(since: datetime) -> Q:
+    """Query matching documents created or saved after ``since`` (naive UTC)."""
+    return Q(id__gt=ObjectId.from_datetime(since)) | Q(last_modified__gt=since)
@@ -1,75 +1,155 @@
+import asyncio
+import time
+from typing import Dict
+
+from bson import ObjectId
+
 from database.CableOps.park import Park
-from database.base_models.rider_base import calculate_cwa_rank, calculate_age_rank, calculate_experience_rank, \
-    calculate_division_rank, RiderProfileBase
-from database.base_models import RiderBase, RiderStatsBase, ParkBase, ScorecardBase, ContestCarrierBase
+from database.change_tracking import changed_since
+from database.base_models.rider_base import RiderProfileBase
+from database.base_models import RiderBase, RiderStatsBase, ParkBase, ContestCarrierBase
 from database.CWA_Events import Rider, Scorecard
 from database.CWA_Events import RiderCompStats, ContestCarrier
+from database.executor import run_blocking
+from database.scorecard_store import ScorecardStore
 
 
-class DatabaseConverter:
+# Documents pulled from Mongo per cursor round trip and converted per chunk
+BATCH_SIZE = 500
+# Scorecard fields kept by the columnar store
+SCORECARD_FIELDS = ['date', 'section', 'division', 'execution', 'creativity', 'difficulty', 'score', 'landed',
+                    'approach', 'trick_type', 'spin', 'spin_direction', 'modifiers', 'session', 'park', 'rider',
+                    'judge']
 
-    async def fetch_and_convert_riders(self):
-        all_riders = Rider.objects().all()
-        return [RiderBase.from_orm(item) for item in all_riders]
 
+def convert_in_batches(queryset, model, batch_size: int = BATCH_SIZE):
+    """Stream ``queryset`` from Mongo in batches, converting each chunk to ``model`` as it arrives."""
+    converted = []
+    chunk = []
+    for document in queryset.batch_size(batch_size):
+        chunk.append(document)
+        if len(chunk) >= batch_size:
+            converted.extend(model.from_orm(item) for item in chunk)
+            chunk = []
+    converted.extend(model.from_orm(item) for item in chunk)
+    return converted
 
-    async def fetch_and_convert_stats(self):
-        all_stats = RiderCompStats.objects().all()
-        return [RiderStatsBase.from_orm(item) for item in all_stats]
 
+class DatabaseConverter:
 
-    async def fetch_and_convert_parks(self):
-        all_parks = Park.objects().all()
-        return [ParkBase.from_orm(item) for item in all_parks]
+    def __init__(self):
+        # Seconds spent fetching and converting each collection on the last load
+        self.timings: Dict[str, float] = {}
 
+    async def _fetch(self, name, queryset_factory, model):
+        start_time = time.time()
+        result = await run_blocking(lambda: convert_in_batches(queryset_factory(), model))
+        self.timings[name] = time.time() - start_time
+        print(f"Loaded {len(result)} {name} in {self.timings[name]:.2f} seconds")
+        return result
 
-    async def fetch_and_convert_scorecards(self):
-        recent_scorecards = Scorecard.objects().order_by('-date').limit(100)
-        return [ScorecardBase.from_orm(item) for item in recent_scorecards]
+    async def fetch_and_convert_riders(self):
+        return await self._fetch('riders', lambda: Rider.objects().all(), RiderBase)
 
+    async def fetch_and_convert_stats(self):
+        return await self._fetch('stats', lambda: RiderCompStats.objects().all(), RiderStatsBase)
+
+    async def fetch_and_convert_parks(self):
+        return await self._fetch('parks', lambda: Park.objects().all(), ParkBase)
+
+    async def fetch_scorecard_store(self) -> ScorecardStore:
+        """Stream every scorecard as raw dicts straight into a columnar ``ScorecardStore``."""
+        def load():
+            store = ScorecardStore(capacity=max(Scorecard.objects.count(), 1024))
+            store.extend(Scorecard.objects.only(*SCORECARD_FIELDS).as_pymongo().batch_size(BATCH_SIZE))
+            return store
+
+        start_time = time.time()
+        store = await run_blocking(load)
+        self.timings['scorecards'] = time.time() - start_time
+        print(f"Loaded {len(store)} scorecards ({store.memory_usage() / 1e6:.1f} MB) "
+              f"in {self.timings['scorecards']:.2f} seconds")
+        return store
+
+    async def fetch_new_scorecards(self, since):
+        # Scorecards are never edited, so anything created since ``since`` is everything missing
+        query = Scorecard.objects(id__gt=ObjectId.from_datetime(since)).only(*SCORECARD_FIELDS)
+        return await run_blocking(lambda: list(query.as_pymongo().batch_size(BATCH_SIZE)))
 
     async def fetch_and_convert_carriers(self):
-        carriers = ContestCarrier.objects().order_by('number')
-        return [ContestCarrierBase.from_orm(item) for item in carriers]
+        return await self._fetch('carriers', lambda: ContestCarrier.objects().order_by('number'),
+                                 ContestCarrierBase)
+
+    async def fetch_and_convert_all(self) -> Dict[str, list]:
+        """
+        Fetch every collection ServerMemory holds concurrently on the database pool.
+
+        Cold start is bounded by the slowest collection instead of the sum of them.
+        """
+        start_time = time.time()
+        riders, stats, scorecards, carriers, parks = await asyncio.gather(
+            self.fetch_and_convert_riders(),
+            self.fetch_and_convert_stats(),
+            self.fetch_scorecard_store(),
+            self.fetch_and_convert_carriers(),
+            self.fetch_and_convert_parks(),
+        )
+        self.timings['total'] = time.time() - start_time
+        return {'riders': riders, 'stats': stats, 'scorecards': scorecards, 'carriers': carriers, 'parks': parks}
+
+    async def fetch_and_convert_changes(self, since):
+        # Documents created or saved after ``since``, used to bring a snapshot up to date
+        query = changed_since(since)
+        riders, stats, carriers, parks = await asyncio.gather(
+            self._fetch('changed riders', lambda: Rider.objects(query), RiderBase),
+            self._fetch('changed stats', lambda: RiderCompStats.objects(query), RiderStatsBase),
+            self._fetch('changed carriers', lambda: ContestCarrier.objects(query), ContestCarrierBase),
+            self._fetch('changed parks', lambda: Park.objects(query), ParkBase),
+        )
+        return {'riders': riders, 'stats': stats, 'carriers': carriers, 'parks': parks}
+
+    async def fetch_ids(self):
+        # Only the ids, to find documents deleted since a snapshot
+        riders, stats, carriers, parks = await asyncio.gather(*(
+            run_blocking(lambda model=model: {str(item) for item in model.objects.scalar('id')})
+            for model in (Rider, RiderCompStats, ContestCarrier, Park)
+        ))
+        return {'riders': riders, 'stats': stats, 'carriers': carriers, 'parks': parks}
 
     async def fetch_and_convert_profiles(self, memory):
-        profiles = []
-        riders_mapping = {rider.id: rider for rider in memory.riders}
+        # Score counts and trick groupings for every rider in two round trips instead of five queries per rider
+        start_time = time.time()
+        score_counts, trick_statistics = await asyncio.gather(
+            run_blocking(Scorecard.calculate_all_score_counts),
+            run_blocking(Scorecard.get_all_trick_statistics),
+        )
 
+        profiles = []
+        divisions = {}
         for stat in memory.stats:
-            rider = riders_mapping.get(stat.rider)
+            rider = memory.riders.get(stat.rider)
             if not rider:
                 continue
 
-            cwa_rank = calculate_cwa_rank(rider.id, memory.rider_rankings_cwa) or 0
-            age_rank = calculate_age_rank(rider.id, memory.rider_rankings_by_age_group)
-            experience_rank = calculate_experience_rank(rider.id, memory.rider_rankings_by_experience)
             division_score = memory.get_rider_cwa_division_score(rider.id)
-            division_rank = calculate_division_rank(rider.id, memory.rider_rankings_by_division, division_score)
-            tricks = Scorecard.get_trick_statistics(rider.id) or {}
+            if rider.division != division_score:
+                rider.division = division_score
+                divisions[rider.id] = division_score
 
-            mongo_rider = Rider.objects(id=rider.id).first()
-            mongo_rider.division = division_score
-            mongo_rider.save()
-
-            # Calculate trick counts
-            overall_count, cwa_count, attempted_count = Scorecard.calculate_score_counts(rider.id)
+            overall_count, cwa_count, attempted_count = score_counts.get(rider.id, (0, 0, 0))
             profile = RiderProfileBase(
                 rider=rider,
                 statistics=stat,
-                cwa_rank=cwa_rank,
-                age_rank=age_rank,  # Guaranteed tuple
-                division_rank=division_rank,  # Guaranteed tuple
-                experience_rank=experience_rank,  # Guaranteed tuple
-                tricks=tricks,
+                tricks=trick_statistics.get(rider.id, {}),
                 trick_count=int(overall_count),
                 scored_count=int(cwa_count),
                 attempted_count=int(attempted_count)
             )
-            profiles.append(profile)
-        return profiles
-
-
-
+            profiles.append(memory.apply_rankings(profile))
 
+        # Write the divisions that changed back at once
+        await run_blocking(Rider.set_divisions, divisions)
 
+        self.timings['profiles'] = time.time() - start_time
+        print(f"Built {len(profiles)} profiles in {self.timings['profiles']:.2f} seconds")
+        return profiles
@@ -0,0 +1,15 @@
+import asyncio
+import os
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+# Bounded pool for blocking mongoengine/pymongo work, sized for the Pi and the Atlas connection pool
+DB_WORKERS = int(os.getenv('CABLEOPS_DB_WORKERS', 8))
+
+db_executor = ThreadPoolExecutor(max_workers=DB_WORKERS, thread_name_prefix='cableops-db')
+
+
+async def run_blocking(func, *args, **kwargs):
+    """Run a blocking call on the database pool and await its result."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(db_executor, partial(func, *args, **kwargs))
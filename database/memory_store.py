@@ -0,0 +1,188 @@
+from bisect import bisect_left, bisect_right, insort
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+
+class IndexedStore:
+    """
+    Insertion-ordered collection of pydantic models keyed by a primary id.
+
+    Behaves like the plain lists ServerMemory used to hold (iteration, len,
+    indexing, append) while keeping a primary map and any number of secondary
+    indexes so lookups by id, rider, carrier number, ... are constant time.
+    Secondary indexes map a key to every item sharing it, in insertion order.
+
+    ``version`` increases on every change, so readers can tell whether
+    anything they derived from the store (an encoded response) is stale.
+    Items mutated in place must be passed to ``reindex`` or ``touch``.
+    ``on_change(operation, key)``, when set, hears about every change as
+    'upsert', 'delete' or 'reset' (``replace``, key None).
+
+    An ``ordered`` store also keeps its primary keys, overall and per
+    secondary index key, in sorted lists so ``page`` can resume after a
+    cursor key with a bisect instead of a scan.
+    """
+
+    def __init__(self, key: Callable[[Any], Any], indexes: Optional[Dict[str, Callable[[Any], Any]]] = None,
+                 items=None, ordered: bool = False):
+        self._key = key
+        self._indexers = dict(indexes or {})
+        self._items: Dict[Any, Any] = {}
+        self._indexes: Dict[str, Dict[Any, Dict[Any, Any]]] = {name: {} for name in self._indexers}
+        self._index_keys: Dict[Any, Dict[str, Any]] = {}
+        self.ordered = ordered
+        self._sorted_keys: List[Any] = []
+        self._sorted_indexes: Dict[str, Dict[Any, List[Any]]] = {name: {} for name in self._indexers}
+        self.version = 0
+        self.on_change: Optional[Callable[[str, Any], None]] = None
+        if items:
+            self.extend(items)
+
+    # List compatible API
+
+    def __iter__(self) -> Iterator[Any]:
+        return iter(list(self._items.values()))
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def __bool__(self) -> bool:
+        return bool(self._items)
+
+    def __contains__(self, item) -> bool:
+        return self._key(item) in self._items
+
+    def __getitem__(self, index):
+        # Positional access is kept for compatibility, it is not used on hot paths
+        return list(self._items.values())[index]
+
+    def __repr__(self) -> str:
+        return f"{self.__class__.__name__}({len(self)} items)"
+
+    def append(self, item):
+        self.upsert(item)
+
+    def extend(self, items):
+        for item in items:
+            self.upsert(item)
+
+    def remove(self, item):
+        if self.discard(self._key(item)) is None:
+            raise ValueError(f"{self._key(item)} not in store")
+
+    def to_list(self) -> List[Any]:
+        return list(self._items.values())
+
+    # Keyed API
+
+    def get(self, key, default=None):
+        return self._items.get(key, default)
+
+    def get_by(self, index: str, key, default=None):
+        bucket = self._indexes[index].get(key)
+        if not bucket:
+            return default
+        return next(iter(bucket.values()))
+
+    def filter_by(self, index: str, key) -> List[Any]:
+        return list(self._indexes[index].get(key, {}).values())
+
+    def keys(self) -> List[Any]:
+        return list(self._items.keys())
+
+    def page(self, after=None, limit: Optional[int] = None, index: Optional[str] = None, key=None) -> List[Any]:
+        """
+        Up to ``limit`` items in primary key order whose key sorts after
+        ``after``, restricted to the items filed under ``key`` in ``index``
+        when given. Costs O(log n + limit) on an ordered store.
+        """
+        if not self.ordered:
+            raise TypeError(f"{self!r} is not ordered")
+        keys = self._sorted_keys if index is None else self._sorted_indexes[index].get(key, [])
+        start = 0 if after is None else bisect_right(keys, after)
+        stop = len(keys) if limit is None else start + limit
+        return [self._items[primary_key] for primary_key in keys[start:stop]]
+
+    def upsert(self, item):
+        """Insert ``item`` or replace the item sharing its primary key, refreshing every index."""
+        primary_key = self._key(item)
+        if self.ordered and primary_key not in self._items:
+            insort(self._sorted_keys, primary_key)
+        self._unindex(primary_key)
+        self._items[primary_key] = item
+        self._index(primary_key, item)
+        self._changed('upsert', primary_key)
+        return item
+
+    def reindex(self, item):
+        """Refresh the secondary indexes after ``item`` was mutated in place."""
+        primary_key = self._key(item)
+        if primary_key not in self._items:
+            return self.upsert(item)
+        self._unindex(primary_key)
+        self._index(primary_key, item)
+        self._changed('upsert', primary_key)
+        return item
+
+    def touch(self, item):
+        """Record that ``item`` was mutated in place without touching any indexed field."""
+        self._changed('upsert', self._key(item))
+        return item
+
+    def discard(self, key):
+        self._unindex(key)
+        item = self._items.pop(key, None)
+        if item is not None:
+            if self.ordered:
+                _remove_sorted(self._sorted_keys, key)
+            self._changed('delete', key)
+        return item
+
+    def replace(self, items):
+        """Drop the current content and load ``items``."""
+        self._items.clear()
+        self._index_keys.clear()
+        for index in self._indexes.values():
+            index.clear()
+        self._sorted_keys.clear()
+        for index in self._sorted_indexes.values():
+            index.clear()
+        self._changed('reset', None)
+        self.extend(items)
+
+    def _changed(self, operation: str, key):
+        self.version += 1
+        if self.on_change is not None:
+            self.on_change(operation, key)
+
+    def _index(self, primary_key, item):
+        keys = {}
+        for name, indexer in self._indexers.items():
+            index_key = indexer(item)
+            if index_key is None:
+                continue
+            self._indexes[name].setdefault(index_key, {})[primary_key] = item
+            if self.ordered:
+                insort(self._sorted_indexes[name].setdefault(index_key, []), primary_key)
+            keys[name] = index_key
+        self._index_keys[primary_key] = keys
+
+    def _unindex(self, primary_key):
+        for name, index_key in self._index_keys.pop(primary_key, {}).items():
+            bucket = self._indexes[name].get(index_key)
+            if bucket is None:
+                continue
+            bucket.pop(primary_key, None)
+            if not bucket:
+                del self._indexes[name][index_key]
+            if self.ordered:
+                sorted_bucket = self._sorted_indexes[name].get(index_key)
+                if sorted_bucket is not None:
+                    _remove_sorted(sorted_bucket, primary_key)
+                    if not sorted_bucket:
+                        del self._sorted_indexes[name][index_key]
+
+
+def _remove_sorted(keys: List[Any], key):
+    position = bisect_left(keys, key)
+    if position < len(keys) and keys[position] == key:
+        del keys[position]
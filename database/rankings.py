@@ -0,0 +1,244 @@
+import random
+from itertools import count
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+from database.utils import calculate_division
+
+
+class _Node:
+    __slots__ = ('key', 'priority', 'size', 'left', 'right')
+
+    def __init__(self, key, priority):
+        self.key = key
+        self.priority = priority
+        self.size = 1
+        self.left = None
+        self.right = None
+
+
+def _size(node: Optional[_Node]) -> int:
+    return node.size if node else 0
+
+
+def _update(node: _Node) -> _Node:
+    node.size = 1 + _size(node.left) + _size(node.right)
+    return node
+
+
+def _merge(left: Optional[_Node], right: Optional[_Node]) -> Optional[_Node]:
+    # Every key in ``left`` sorts before every key in ``right``
+    if not left or not right:
+        return left or right
+    if left.priority > right.priority:
+        left.right = _merge(left.right, right)
+        return _update(left)
+    right.left = _merge(left, right.left)
+    return _update(right)
+
+
+def _split(node: Optional[_Node], key) -> Tuple[Optional[_Node], Optional[_Node]]:
+    # Returns (keys < key, keys >= key)
+    if not node:
+        return None, None
+    if node.key < key:
+        node.right, right = _split(node.right, key)
+        return _update(node), right
+    left, node.left = _split(node.left, key)
+    return left, _update(node)
+
+
+def _delete(node: Optional[_Node], key) -> Optional[_Node]:
+    if not node:
+        return None
+    if key == node.key:
+        return _merge(node.left, node.right)
+    if key < node.key:
+        node.left = _delete(node.left, key)
+    else:
+        node.right = _delete(node.right, key)
+    return _update(node)
+
+
+class RankTree:
+    """
+    Order-statistic tree (a size augmented treap) over comparable keys.
+
+    Insert, remove and rank-of-key are O(log n) expected, the first ``n``
+    keys come back in O(log n + n).
+    """
+
+    def __init__(self):
+        self._root: Optional[_Node] = None
+        self._random = random.Random(0)
+
+    def __len__(self) -> int:
+        return _size(self._root)
+
+    def insert(self, key):
+        left, right = _split(self._root, key)
+        self._root = _merge(_merge(left, _Node(key, self._random.random())), right)
+
+    def remove(self, key):
+        self._root = _delete(self._root, key)
+
+    def rank(self, key) -> int:
+        """1-based position of ``key``, assuming it is in the tree."""
+        position = 0
+        node = self._root
+        while node:
+            if key <= node.key:
+                if key == node.key:
+                    return position + _size(node.left) + 1
+                node = node.left
+            else:
+                position += _size(node.left) + 1
+                node = node.right
+        return position + 1
+
+    def between(self, low=None, high=None) -> List[Any]:
+        """Keys strictly between ``low`` and ``high`` in order, a missing bound is open."""
+        keys = []
+
+        def visit(node):
+            if not node:
+                return
+            above = low is None or node.key > low
+            below = high is None or node.key < high
+            if above:
+                visit(node.left)
+            if above and below:
+                keys.append(node.key)
+            if below:
+                visit(node.right)
+
+        visit(self._root)
+        return keys
+
+    def top(self, n: Optional[int] = None) -> List[Any]:
+        keys = []
+        stack = []
+        node = self._root
+        while (stack or node) and (n is None or len(keys) < n):
+            while node:
+                stack.append(node)
+                node = node.left
+            node = stack.pop()
+            keys.append(node.key)
+            node = node.right
+        return keys
+
+
+class RankingEngine:
+    """
+    Incremental CWA leaderboards.
+
+    Every ranked rider is filed in the overall ``cwa`` board and in the
+    ``age_group``, ``experience`` and ``division`` board of its category,
+    ordered by CWA division mean (highest first). Updating one rider only
+    touches the trees it moves between, so a new scorecard costs O(log n)
+    instead of re-sorting every leaderboard.
+    """
+
+    BOARDS = ('cwa', 'age_group', 'experience', 'division')
+
+    def __init__(self):
+        self._boards: Dict[str, Dict[Any, RankTree]] = {board: {} for board in self.BOARDS}
+        self._entries: Dict[str, Tuple[tuple, Dict[str, Any]]] = {}
+        self._sequence: Dict[str, int] = {}
+        self._counter = count()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, rider_id) -> bool:
+        return rider_id in self._entries
+
+    def clear(self):
+        self.__init__()
+
+    def update(self, rider_id: str, score: float, age_group: Optional[str] = None,
+               experience: Optional[str] = None, report: bool = False) -> Set[str]:
+        """
+        File ``rider_id`` under its current score and categories.
+
+        With ``report``, returns the other riders whose rank changed in any
+        board: those between the rider's old and new place, or after either
+        place when it changed category. Without, returns an empty set.
+        """
+        previous = self._entries.get(rider_id)
+        self.remove(rider_id)
+        if score is None or score != score:
+            score = 0.0
+
+        # Ties keep the order riders were first ranked in, like the stable sorts this replaces
+        sequence = self._sequence.setdefault(rider_id, next(self._counter))
+        key = (-score, sequence, rider_id)
+        categories = {
+            'cwa': None,
+            'age_group': age_group,
+            'experience': experience,
+            'division': calculate_division(score),
+        }
+        for board, category in categories.items():
+            if board != 'cwa' and category is None:
+                continue
+            tree = self._boards[board].get(category)
+            if tree is None:
+                tree = self._boards[board][category] = RankTree()
+            tree.insert(key)
+
+        self._entries[rider_id] = (key, categories)
+        return self._moved(previous, key, categories) if report else set()
+
+    def _moved(self, previous: Optional[Tuple[tuple, Dict[str, Any]]], key: tuple,
+               categories: Dict[str, Any]) -> Set[str]:
+        moved = set()
+        for board in self.BOARDS:
+            ranked = board == 'cwa' or categories[board] is not None
+            was_ranked = previous is not None and (board == 'cwa' or previous[1].get(board) is not None)
+            if ranked and was_ranked and previous[1].get(board) == categories[board]:
+                # Same leaderboard, only the riders passed on the way moved
+                if previous[0] == key:
+                    continue
+                keys = self._boards[board][categories[board]].between(*sorted((previous[0], key)))
+            else:
+                keys = []
+                if was_ranked:
+                    keys += self._boards[board][previous[1].get(board)].between(previous[0])
+                if ranked:
+                    keys += self._boards[board][categories[board]].between(key)
+            moved.update(key[2] for key in keys)
+        return moved
+
+    def remove(self, rider_id: str):
+        entry = self._entries.pop(rider_id, None)
+        if entry is None:
+            return
+        key, categories = entry
+        for board, category in categories.items():
+            tree = self._boards[board].get(category)
+            if tree is not None:
+                tree.remove(key)
+
+    def category(self, board: str, rider_id: str):
+        entry = self._entries.get(rider_id)
+        return entry[1].get(board) if entry else None
+
+    def rank(self, board: str, rider_id: str) -> int:
+        """1-based rank of the rider in its category of ``board``, 0 when unranked."""
+        entry = self._entries.get(rider_id)
+        if entry is None:
+            return 0
+        key, categories = entry
+        if board != 'cwa' and categories.get(board) is None:
+            return 0
+        return self._boards[board][categories.get(board)].rank(key)
+
+    def top(self, board: str, category=None, n: Optional[int] = 10) -> List[Tuple[str, float]]:
+        tree = self._boards[board].get(category)
+        if tree is None:
+            return []
+        return [(key[2], -key[0]) for key in tree.top(n)]
+
+    def ranking(self, board: str, category=None) -> List[Tuple[str, float]]:
+        return self.top(board, category, n=None)
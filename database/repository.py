@@ -0,0 +1,109 @@
+from typing import Dict, List, Optional, Tuple
+
+from bson import ObjectId
+from mongoengine import DoesNotExist
+
+from database.base_models import RiderBase, RiderStatsBase, ScorecardBase
+from database.CWA_Events import ContestCarrier, Rider, RiderCompStats, Scorecard
+from database.executor import run_blocking
+
+
+class Repository:
+    """
+    Awaitable data access for the request handlers.
+
+    mongoengine is synchronous; every method runs its queries, saves and the
+    conversion of the documents to pydantic models on the database pool so
+    the event loop keeps serving WebSockets while Mongo answers. Multi step
+    operations (find, mutate, save) make a single trip to the pool.
+    """
+
+    # Scorecards
+
+    @staticmethod
+    async def get_scorecards(rider_ids=None, sort_by='Most Recent', cursor=None) -> List[ScorecardBase]:
+        def load():
+            scorecards = Scorecard.get_scorecards(rider_ids=rider_ids, sort_by=sort_by, cursor=cursor)
+            return [ScorecardBase.from_orm(scorecard) for scorecard in scorecards]
+        return await run_blocking(load)
+
+    @staticmethod
+    async def profile_data(rider_id: str) -> Tuple[Tuple[int, int, int], Optional[dict]]:
+        """Score counts and trick statistics of a rider, for its profile."""
+        def load():
+            return Scorecard.calculate_score_counts(rider_id), Scorecard.get_trick_statistics(rider_id)
+        return await run_blocking(load)
+
+    @staticmethod
+    async def profile_data_for(rider_ids) -> Dict[str, Tuple[Tuple[int, int, int], Optional[dict]]]:
+        """``profile_data`` of many riders, in one aggregation and one scan instead of two queries per rider."""
+        rider_ids = list(rider_ids)
+        if not rider_ids:
+            return {}
+
+        def load():
+            score_counts = Scorecard.calculate_all_score_counts({'rider': {'$in': [ObjectId(r) for r in rider_ids]}})
+            tricks = Scorecard.get_all_trick_statistics(rider_ids)
+            # Riders without scorecards get what profile_data returns for them
+            return {rider_id: (score_counts.get(rider_id, (0, 0, 0)), tricks.get(rider_id) or None)
+                    for rider_id in rider_ids}
+        return await run_blocking(load)
+
+    # Carriers
+
+    @staticmethod
+    async def assign_carrier(number, rider_id=None, bib_color=None, session=None) -> Optional[ContestCarrier]:
+        """Put a rider on carrier ``number``, or clear it without ``rider_id``. None if there is no such carrier."""
+        def assign():
+            carrier = ContestCarrier.objects(number=number).first()
+            if carrier is None:
+                return None
+            carrier.rider_id = rider_id or None
+            carrier.bib_color = bib_color if rider_id else None
+            carrier.session = session if rider_id else None
+            carrier.save()
+            return carrier
+        return await run_blocking(assign)
+
+    @staticmethod
+    async def clear_carrier_session(session_id: str) -> Optional[ContestCarrier]:
+        """Take the rider off the carrier riding ``session_id``."""
+        def clear():
+            carrier = ContestCarrier.objects(session=session_id).first()
+            if carrier is None:
+                return None
+            carrier.rider_id = None
+            carrier.bib_color = None
+            carrier.session = None
+            carrier.save()
+            return carrier
+        return await run_blocking(clear)
+
+    # Riders and stats
+
+    @staticmethod
+    async def save_rider_stats(rider_id: str, stats: dict) -> RiderStatsBase:
+        def save():
+            try:
+                mongo_stats = RiderCompStats.objects.get(rider=rider_id)
+            except DoesNotExist:
+                mongo_stats = RiderCompStats(rider=rider_id)
+            for key, value in stats.items():
+                setattr(mongo_stats, key, value)
+            mongo_stats.save()
+            return RiderStatsBase.from_orm(mongo_stats)
+        return await run_blocking(save)
+
+    @staticmethod
+    async def update_or_create_rider(rider_data: dict) -> RiderBase:
+        def save():
+            return RiderBase.from_orm(RiderBase.update_or_create_rider(rider_data))
+        return await run_blocking(save)
+
+    @staticmethod
+    async def create_rider() -> str:
+        def create():
+            rider = Rider()
+            rider.save()
+            return str(rider.id)
+        return await run_blocking(create)
@@ -0,0 +1,80 @@
+from datetime import datetime
+from typing import NamedTuple, Optional, Tuple, Union
+
+from mongoengine import Q
+
+# Sort modes of the scorecard feed and the field, direction they order by.
+# Ties are broken by id in the same direction so every scorecard has one position.
+SORT_MODES = {
+    'Most Recent': ('date', True),
+    'Score: Highest': ('score', True),
+    'Score: Lowest': ('score', False),
+}
+DEFAULT_SORT = 'Most Recent'
+# Separates the sort value from the id in a cursor, e.g. "2024-06-01T10:00:00|6650..."
+CURSOR_SEPARATOR = '|'
+NULL = 'null'
+
+
+class ScorecardCursor(NamedTuple):
+    """
+    Position after which the next page starts.
+
+    ``id`` is None for the cursors issued before composite cursors, a bare
+    ISO date, which keep their meaning of "older than ``value``".
+    """
+    value: Union[datetime, float, None]
+    id: Optional[str] = None
+
+
+def sort_spec(sort_by: Optional[str]) -> Tuple[str, bool]:
+    return SORT_MODES.get(sort_by, SORT_MODES[DEFAULT_SORT])
+
+
+def encode_cursor(scorecard, sort_by: Optional[str]) -> str:
+    field, _ = sort_spec(sort_by)
+    value = getattr(scorecard, field)
+    if value is None or value != value:
+        encoded = NULL
+    elif field == 'date':
+        encoded = value.isoformat()
+    else:
+        encoded = repr(float(value))
+    return f"{encoded}{CURSOR_SEPARATOR}{scorecard.id}"
+
+
+def parse_cursor(cursor: Union[str, datetime, None], sort_by: Optional[str]) -> Optional[ScorecardCursor]:
+    if cursor is None or cursor == '':
+        return None
+    if isinstance(cursor, datetime):
+        return ScorecardCursor(cursor)
+    if CURSOR_SEPARATOR not in cursor:
+        return ScorecardCursor(datetime.fromisoformat(cursor))
+    encoded, scorecard_id = cursor.rsplit(CURSOR_SEPARATOR, 1)
+    field, _ = sort_spec(sort_by)
+    if encoded == NULL:
+        value = None
+    elif field == 'date':
+        value = datetime.fromisoformat(encoded)
+    else:
+        value = float(encoded)
+    return ScorecardCursor(value, scorecard_id)
+
+
+def cursor_query(cursor: Optional[ScorecardCursor], sort_by: Optional[str]) -> Q:
+    """Mongo condition for the scorecards that sort after ``cursor``; nulls sort lowest, like Mongo does."""
+    if cursor is None:
+        return Q()
+    if cursor.id is None:
+        return Q(date__lt=cursor.value)
+    field, descending = sort_spec(sort_by)
+    operator = 'lt' if descending else 'gt'
+    same_value = Q(**{field: cursor.value, f'id__{operator}': cursor.id})
+    if cursor.value is None:
+        # Nothing sorts below null, ascending pages continue with every non null value
+        return same_value if descending else same_value | Q(**{f'{field}__ne': None})
+    after_value = Q(**{f'{field}__{operator}': cursor.value})
+    if descending:
+        # Descending pages end with the nulls
+        after_value |= Q(**{field: None})
+    return after_value | same_value
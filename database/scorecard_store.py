@@ -0,0 +1,306 @@
+from datetime import datetime, timezone
+from typing import Any, Dict, Iterable, List, Optional, Union
+
+import numpy as np
+from bson import ObjectId
+
+from database.base_models import ScorecardBase
+from database.scorecard_cursor import parse_cursor, sort_spec
+
+FLOAT_COLUMNS = ('score', 'division', 'execution', 'creativity', 'difficulty')
+CODED_COLUMNS = ('section', 'trick', 'rider', 'park', 'approach', 'trick_type', 'spin', 'spin_direction', 'modifiers',
+                 'session', 'judge')
+TRICK_PARTS = ('section', 'approach', 'trick_type', 'spin_direction', 'spin')
+
+_EPOCH = datetime(1970, 1, 1)
+
+
+def _to_millis(value: Optional[datetime]) -> int:
+    if value is None:
+        return np.iinfo(np.int64).min
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return int((value - _EPOCH).total_seconds() * 1000)
+
+
+def _from_millis(value: int) -> Optional[datetime]:
+    if value == np.iinfo(np.int64).min:
+        return None
+    return datetime.fromtimestamp(value / 1000, tz=timezone.utc).replace(tzinfo=None)
+
+
+def _get(scorecard, name):
+    if isinstance(scorecard, dict):
+        return scorecard.get(name)
+    return getattr(scorecard, name, None)
+
+
+class Dictionary:
+    """Dictionary encoding of a string column: each distinct value gets a small int code, None is -1."""
+
+    def __init__(self, values: Iterable = ()):
+        self.values: List[Any] = []
+        self._codes: Dict[Any, int] = {}
+        for value in values:
+            self.encode(value)
+
+    def __len__(self) -> int:
+        return len(self.values)
+
+    def encode(self, value) -> int:
+        if value is None:
+            return -1
+        code = self._codes.get(value)
+        if code is None:
+            code = self._codes[value] = len(self.values)
+            self.values.append(value)
+        return code
+
+    def code(self, value) -> int:
+        """Code of an existing value without adding it, -2 (matches nothing) if unknown."""
+        if value is None:
+            return -1
+        return self._codes.get(value, -2)
+
+    def decode(self, code: int):
+        return None if code < 0 else self.values[code]
+
+
+class ScorecardStore:
+    """
+    Append-only columnar store of every scorecard, queried with vectorized masks.
+
+    Scores are float64 columns, ``landed`` an int8 (-1 for unknown), the
+    date int64 milliseconds, the id the 12 ObjectId bytes, and every string
+    column (section, trick, rider, park, ...) an int32 code into a
+    ``Dictionary``.
+
+    Memory budget: 5 x 8 (scores) + 1 (landed) + 8 (date) + 11 x 4 (codes)
+    + 12 (id) = 105 bytes per scorecard, so about 105 MB for 1M scorecards.
+    Capacity grows by 1.5x, which peaks near 160 MB right after a resize;
+    dictionaries add a few MB (sessions are the largest). That fits a
+    Raspberry Pi 4 next to the Kivy UI.
+    """
+
+    GROWTH = 1.5
+
+    def __init__(self, capacity: int = 1024):
+        self.size = 0
+        self.capacity = 0
+        self.dictionaries = {column: Dictionary() for column in CODED_COLUMNS}
+        self.floats = {column: np.empty(0, dtype=np.float64) for column in FLOAT_COLUMNS}
+        self.codes = {column: np.empty(0, dtype=np.int32) for column in CODED_COLUMNS}
+        self.landed = np.empty(0, dtype=np.int8)
+        self.date = np.empty(0, dtype=np.int64)
+        self.ids = np.empty(0, dtype='S12')
+        self._reserve(capacity)
+
+    def __len__(self) -> int:
+        return self.size
+
+    def memory_usage(self) -> int:
+        arrays = [*self.floats.values(), *self.codes.values(), self.landed, self.date, self.ids]
+        return sum(array.nbytes for array in arrays)
+
+    # Growth
+
+    def _reserve(self, capacity: int):
+        if capacity <= self.capacity:
+            return
+        capacity = max(capacity, int(self.capacity * self.GROWTH))
+        for columns in (self.floats, self.codes):
+            for column, array in columns.items():
+                columns[column] = self._resized(array, capacity)
+        self.landed = self._resized(self.landed, capacity)
+        self.date = self._resized(self.date, capacity)
+        self.ids = self._resized(self.ids, capacity)
+        self.capacity = capacity
+
+    def _resized(self, array: np.ndarray, capacity: int) -> np.ndarray:
+        resized = np.empty(capacity, dtype=array.dtype)
+        resized[:self.size] = array[:self.size]
+        return resized
+
+    # Writes
+
+    def append(self, scorecard) -> int:
+        """Append a ScorecardBase or a raw Mongo dict, returning its row."""
+        self._reserve(self.size + 1)
+        row = self.size
+        for column in FLOAT_COLUMNS:
+            value = _get(scorecard, column)
+            self.floats[column][row] = np.nan if value is None else value
+
+        values = {column: _get(scorecard, column) for column in CODED_COLUMNS if column not in ('trick', 'modifiers')}
+        for column in ('rider', 'park', 'judge', 'session'):
+            if values[column] is not None:
+                values[column] = str(values[column])
+        parts = [values[part] for part in TRICK_PARTS]
+        values['trick'] = None if any(part is None for part in parts) else ' '.join(parts)
+        values['modifiers'] = tuple(_get(scorecard, 'modifiers') or ())
+        for column in CODED_COLUMNS:
+            self.codes[column][row] = self.dictionaries[column].encode(values[column])
+
+        landed = _get(scorecard, 'landed')
+        self.landed[row] = -1 if landed is None else int(bool(landed))
+        self.date[row] = _to_millis(_get(scorecard, 'date'))
+        scorecard_id = _get(scorecard, 'id') or _get(scorecard, '_id')
+        self.ids[row] = ObjectId(str(scorecard_id)).binary if scorecard_id else b''
+        self.size += 1
+        return row
+
+    def extend(self, scorecards: Iterable):
+        # Streams querysets row by row, only sized inputs reserve up front
+        if isinstance(scorecards, (list, tuple)):
+            self._reserve(self.size + len(scorecards))
+        for scorecard in scorecards:
+            self.append(scorecard)
+
+    def contains_ids(self, scorecard_ids: Iterable) -> np.ndarray:
+        wanted = np.array([ObjectId(str(scorecard_id)).binary for scorecard_id in scorecard_ids], dtype='S12')
+        return np.isin(wanted, self.ids[:self.size])
+
+    # Reads
+
+    def row(self, index: int) -> ScorecardBase:
+        data = {column: None if np.isnan(self.floats[column][index]) else float(self.floats[column][index])
+                for column in FLOAT_COLUMNS}
+        for column in CODED_COLUMNS:
+            if column != 'trick':
+                data[column] = self.dictionaries[column].decode(self.codes[column][index])
+        data['modifiers'] = list(data['modifiers'] or ())
+        landed = self.landed[index]
+        data['landed'] = None if landed < 0 else bool(landed)
+        # NumPy strips trailing NUL bytes from fixed width bytes
+        raw_id = bytes(self.ids[index]).ljust(12, b'\0')
+        data['id'] = str(ObjectId(raw_id)) if self.ids[index] else None
+        date = _from_millis(int(self.date[index]))
+        if date is not None:
+            data['date'] = date
+        return ScorecardBase(**data)
+
+    def rows(self, indices: Iterable[int]) -> List[ScorecardBase]:
+        return [self.row(int(index)) for index in indices]
+
+    def recent(self, limit: int = 100) -> List[ScorecardBase]:
+        return self.query(limit=limit)
+
+    def mask(self, rider_ids: Optional[List[str]] = None, park_id: Optional[str] = None,
+             section: Optional[str] = None, trick: Optional[str] = None, landed: Optional[bool] = None) -> np.ndarray:
+        """Boolean mask over the stored rows for the given filters."""
+        mask = np.ones(self.size, dtype=bool)
+        if rider_ids:
+            rider_codes = [self.dictionaries['rider'].code(rider_id) for rider_id in rider_ids]
+            mask &= np.isin(self.codes['rider'][:self.size], rider_codes)
+        for column, value in (('park', park_id), ('section', section), ('trick', trick)):
+            if value is not None:
+                mask &= self.codes[column][:self.size] == self.dictionaries[column].code(value)
+        if landed is not None:
+            mask &= self.landed[:self.size] == int(landed)
+        return mask
+
+    def query(self, rider_ids: Optional[List[str]] = None, sort_by: str = 'Most Recent',
+              cursor: Union[str, datetime, None] = None, limit: int = 10, **filters) -> List[ScorecardBase]:
+        """``Scorecard.get_scorecards`` served from memory: filter, sort and page with array operations."""
+        mask = self.mask(rider_ids=rider_ids, **filters)
+        field, descending = sort_spec(sort_by)
+        # Ascending sort keys, nulls sort lowest like in Mongo
+        if field == 'date':
+            keys = self.date[:self.size].astype(np.float64)
+        else:
+            scores = self.floats['score'][:self.size]
+            keys = np.where(np.isnan(scores), -np.inf, scores)
+        words = self._id_words()
+        if descending:
+            keys, words = -keys, -words
+
+        cursor = parse_cursor(cursor, sort_by)
+        if cursor is not None and cursor.id is None:
+            mask &= self.date[:self.size] < _to_millis(cursor.value)
+        elif cursor is not None:
+            if field == 'date':
+                cursor_key = float(_to_millis(cursor.value))
+            else:
+                cursor_key = -np.inf if cursor.value is None else cursor.value
+            cursor_words = np.frombuffer(ObjectId(cursor.id).binary, dtype='>u4').astype(np.int64)
+            if descending:
+                cursor_key, cursor_words = -cursor_key, -cursor_words
+            mask &= (keys > cursor_key) | ((keys == cursor_key) & _after(words, cursor_words))
+
+        candidates = np.flatnonzero(mask)
+        keys, words = keys[candidates], words[candidates]
+        # Partial selection of the page, then a sort of just that page by (key, id)
+        if limit and candidates.size > limit:
+            selected = np.argpartition(keys, limit - 1)[:limit]
+            boundary = keys[selected].max()
+            # Rows tied with the page's last key compete on id, keep all of them for the sort
+            selected = np.flatnonzero(keys <= boundary)
+            candidates, keys, words = candidates[selected], keys[selected], words[selected]
+        order = np.lexsort((words[:, 2], words[:, 1], words[:, 0], keys))[:limit or None]
+        return self.rows(candidates[order])
+
+    def _id_words(self) -> np.ndarray:
+        """Ids as three big endian 32 bit words per row, which order like the ObjectIds."""
+        raw = np.frombuffer(self.ids[:self.size].tobytes(), dtype='>u4')
+        return raw.reshape(-1, 3).astype(np.int64)
+
+    def aggregate(self, by: str = 'trick', **filters) -> Dict[Any, Dict[str, float]]:
+        """Count, mean and max score per value of a dictionary encoded column."""
+        mask = self.mask(**filters) & ~np.isnan(self.floats['score'][:self.size])
+        codes = self.codes[by][:self.size][mask] + 1  # shift None (-1) to 0
+        scores = self.floats['score'][:self.size][mask]
+        groups = len(self.dictionaries[by]) + 1
+        counts = np.bincount(codes, minlength=groups)
+        sums = np.bincount(codes, weights=scores, minlength=groups)
+        maxima = np.full(groups, -np.inf)
+        np.maximum.at(maxima, codes, scores)
+
+        summary = {}
+        for code in np.flatnonzero(counts):
+            value = self.dictionaries[by].decode(code - 1)
+            summary[value] = {'count': int(counts[code]), 'mean': float(sums[code] / counts[code]),
+                              'max': float(maxima[code])}
+        return summary
+
+    # Snapshots
+
+    def to_snapshot(self) -> Dict[str, Any]:
+        """Raw column bytes plus dictionaries, for ``database.snapshot``."""
+        return {
+            'size': self.size,
+            'floats': {column: self.floats[column][:self.size].tobytes() for column in FLOAT_COLUMNS},
+            'codes': {column: self.codes[column][:self.size].tobytes() for column in CODED_COLUMNS},
+            'dictionaries': {column: [list(value) if isinstance(value, tuple) else value
+                                      for value in self.dictionaries[column].values]
+                             for column in CODED_COLUMNS},
+            'landed': self.landed[:self.size].tobytes(),
+            'date': self.date[:self.size].tobytes(),
+            'ids': self.ids[:self.size].tobytes(),
+        }
+
+    @classmethod
+    def from_snapshot(cls, data: Dict[str, Any]) -> 'ScorecardStore':
+        store = cls(capacity=max(data['size'], 1024))
+        size = store.size = data['size']
+        for column in FLOAT_COLUMNS:
+            store.floats[column][:size] = np.frombuffer(data['floats'][column], dtype=np.float64)
+        for column in CODED_COLUMNS:
+            store.codes[column][:size] = np.frombuffer(data['codes'][column], dtype=np.int32)
+            values = data['dictionaries'][column]
+            if column == 'modifiers':
+                values = [tuple(value) for value in values]
+            store.dictionaries[column] = Dictionary(values)
+        store.landed[:size] = np.frombuffer(data['landed'], dtype=np.int8)
+        store.date[:size] = np.frombuffer(data['date'], dtype=np.int64)
+        store.ids[:size] = np.frombuffer(data['ids'], dtype='S12')
+        return store
+
+
+def _after(words: np.ndarray, cursor_words: np.ndarray) -> np.ndarray:
+    """Rows whose id words sort after ``cursor_words``, compared word by word."""
+    after = np.zeros(len(words), dtype=bool)
+    tied = np.ones(len(words), dtype=bool)
+    for position in range(3):
+        after |= tied & (words[:, position] > cursor_words[position])
+        tied &= words[:, position] == cursor_words[position]
+    return after
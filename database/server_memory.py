@@ -1,41 +1,208 @@
+import asyncio
+import os
 import time
-from datetime import datetime
-from typing import List, Optional
+from functools import partial
+from datetime import datetime, timedelta
+from typing import Optional
 
 from database.base_models import RiderBase, RiderStatsBase, ScorecardBase, ParkBase, ContestCarrierBase, \
     RiderProfileBase
-from database.base_models.rider_base import calculate_cwa_rank, calculate_age_rank, calculate_experience_rank, \
-    calculate_division_rank
+from database.change_log import ChangeLog
 from database.database_converter import DatabaseConverter
-from database.CWA_Events import Scorecard
-from database.utils import calculate_age_group, calculate_division
+from database.memory_store import IndexedStore
+from database.rankings import RankingEngine
+from database.repository import Repository
+from database.scorecard_store import ScorecardStore
+from database.snapshot import SNAPSHOT_PATH, read_snapshot, write_snapshot
+from database.stats_engine import StatsEngine
+from database.utils import calculate_age_group, calculate_experience_bracket
+
+
+# Seconds between periodic snapshots of the memory to disk
+SNAPSHOT_INTERVAL = int(os.getenv('CABLEOPS_SNAPSHOT_INTERVAL', 300))
+# Margin subtracted from sync watermarks to absorb clock skew between writers
+SYNC_SKEW = timedelta(seconds=60)
 
 
 class ServerMemory:
 
-    def __init__(self):
-        self.riders: List[RiderBase] = []
-        self.stats: List[RiderStatsBase] = []
-        self.scorecards: List[ScorecardBase] = []
-        self.parks: List[ParkBase] = []
-        self.carriers: List[ContestCarrierBase] = []
-        self.rider_profiles: List[RiderProfileBase] = []
-        self.arider_profiles_map: dict[str, RiderProfileBase] = {}  # New attribute
+    def __init__(self, snapshot_path: str = SNAPSHOT_PATH):
+        self.riders: IndexedStore = IndexedStore(key=lambda rider: rider.id)
+        # Ordered by id for the keyset pagination of /api/stats/riders
+        self.stats: IndexedStore = IndexedStore(key=lambda stat: stat.id,
+                                                indexes={'rider': lambda stat: stat.rider,
+                                                         'year': lambda stat: stat.year,
+                                                         'rider_year': lambda stat: (stat.rider, stat.year)},
+                                                ordered=True)
+        self.scorecards = ScorecardStore()
+        self.parks: IndexedStore = IndexedStore(key=lambda park: park.id)
+        self.carriers: IndexedStore = IndexedStore(key=lambda carrier: carrier.id,
+                                                   indexes={'number': lambda carrier: carrier.number,
+                                                            'session': lambda carrier: carrier.session})
+        self.rider_profiles: IndexedStore = IndexedStore(key=lambda profile: profile.rider.id)
+        # Versioned log of every change to the synced collections, served by /api/sync
+        self.changes = ChangeLog()
+        for name, store in self.synced_stores().items():
+            store.on_change = partial(self.changes.record, name)
+        self.rankings = RankingEngine()
+        self.stats_engine = StatsEngine()
         self.accepted_currencies: dict
+        self.snapshot_path = snapshot_path
+        # UTC time up to which the memory is known to match Mongo, None until loaded
+        self.synced_at: Optional[datetime] = None
 
     async def load_data(self):
         # Start timing
-        converter = DatabaseConverter()
         total_start_time = time.time()
-        self.riders = await converter.fetch_and_convert_riders()
-        self.stats = await converter.fetch_and_convert_stats()
-        self.scorecards = await converter.fetch_and_convert_scorecards()
-        self.carriers = await converter.fetch_and_convert_carriers()
-        self.parks = await converter.fetch_and_convert_parks()
-        self.rider_profiles = await converter.fetch_and_convert_profiles(self)
-        self.rider_profiles_map = {profile.rider.id: profile for profile in self.rider_profiles}
+        if self.restore_snapshot():
+            print(f"Restored server memory from snapshot in {time.time() - total_start_time:.2f} seconds")
+            # The API serves the snapshot while the changes since it are fetched
+            await self.reconcile()
+        else:
+            await self.load_from_database()
         print(f"Total load and conversion time: {time.time() - total_start_time:.2f} seconds")
 
+    async def load_from_database(self):
+        converter = DatabaseConverter()
+        sync_start = datetime.utcnow() - SYNC_SKEW
+        collections = await converter.fetch_and_convert_all()
+        self.riders.replace(collections['riders'])
+        self.stats.replace(collections['stats'])
+        self.rebuild_rankings()
+        self.adopt_scorecards(collections['scorecards'])
+        self.carriers.replace(collections['carriers'])
+        self.parks.replace(collections['parks'])
+        self.rider_profiles.replace(await converter.fetch_and_convert_profiles(self))
+        self.synced_at = sync_start
+
+    async def reconcile(self):
+        """Apply the documents created, saved or deleted in Mongo since ``synced_at``."""
+        converter = DatabaseConverter()
+        sync_start = datetime.utcnow() - SYNC_SKEW
+        changes = await converter.fetch_and_convert_changes(self.synced_at)
+        existing_ids = await converter.fetch_ids()
+
+        for name, store in (('riders', self.riders), ('stats', self.stats),
+                            ('carriers', self.carriers), ('parks', self.parks)):
+            for key in set(store.keys()) - existing_ids[name]:
+                store.discard(key)
+        for rider_id in set(self.rider_profiles.keys()) - existing_ids['riders']:
+            self.rider_profiles.discard(rider_id)
+
+        for rider in changes['riders']:
+            self.update_rider(rider)
+        self.carriers.extend(changes['carriers'])
+        self.parks.extend(changes['parks'])
+        # Profile data of every changed rider in one trip rather than one per rider
+        profile_data = await Repository.profile_data_for({stat.rider for stat in changes['stats']})
+        for stat in changes['stats']:
+            await self.update_stats(stat, profile_data.get(stat.rider))
+        self.rebuild_rankings()
+
+        new_scorecards = await converter.fetch_new_scorecards(self.synced_at)
+        # The skew margin overlaps the snapshot, skip scorecards it already holds
+        known = self.scorecards.contains_ids(scorecard['_id'] for scorecard in new_scorecards)
+        self.scorecards.extend(scorecard for scorecard, seen in zip(new_scorecards, known) if not seen)
+        self.synced_at = sync_start
+        print(f"Reconciled snapshot: {', '.join(f'{len(docs)} {name}' for name, docs in changes.items())} changed")
+
+    def snapshot(self) -> dict:
+        profiles = []
+        for profile in self.rider_profiles:
+            # Riders and stats are stored once and linked back on restore
+            profile_data = profile.dict(exclude={'rider', 'statistics'})
+            profile_data['rider_id'] = profile.rider.id
+            profiles.append(profile_data)
+        return {
+            'synced_at': self.synced_at,
+            'riders': [rider.dict() for rider in self.riders],
+            'stats': [stat.dict() for stat in self.stats],
+            'scorecards': self.scorecards.to_snapshot(),
+            'carriers': [carrier.dict() for carrier in self.carriers],
+            'parks': [park.dict() for park in self.parks],
+            'profiles': profiles,
+        }
+
+    def restore_snapshot(self) -> bool:
+        payload = read_snapshot(self.snapshot_path)
+        if not payload:
+            return False
+        try:
+            self.riders.replace(RiderBase(**rider) for rider in payload['riders'])
+            self.stats.replace(RiderStatsBase(**stat) for stat in payload['stats'])
+            self.rebuild_rankings()
+            self.adopt_scorecards(ScorecardStore.from_snapshot(payload['scorecards']))
+            self.carriers.replace(ContestCarrierBase(**carrier) for carrier in payload['carriers'])
+            self.parks.replace(ParkBase(**park) for park in payload['parks'])
+            profiles = []
+            for profile_data in payload['profiles']:
+                rider = self.riders.get(profile_data.pop('rider_id'))
+                if rider:
+                    statistics = self.stats.get_by('rider', rider.id)
+                    profiles.append(RiderProfileBase(rider=rider, statistics=statistics, **profile_data))
+            self.rider_profiles.replace(profiles)
+        except Exception as e:
+            print(f"Failed to restore snapshot, loading from database: {e}")
+            return False
+        self.synced_at = payload['synced_at']
+        return True
+
+    def save_snapshot(self):
+        if self.synced_at is None:
+            # Never overwrite a good snapshot with a memory that has not loaded yet
+            return
+        start_time = time.time()
+        write_snapshot(self.snapshot(), self.snapshot_path)
+        print(f"Snapshot written in {time.time() - start_time:.2f} seconds")
+
+    async def snapshot_periodically(self, interval: int = SNAPSHOT_INTERVAL):
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(interval)
+            if self.synced_at is None:
+                continue
+            try:
+                # Build the payload on the loop, pack and write it off the loop
+                await loop.run_in_executor(None, write_snapshot, self.snapshot(), self.snapshot_path)
+            except Exception as e:
+                print(f"Error writing snapshot: {e}")
+
+    def synced_stores(self) -> dict:
+        return {'riders': self.riders, 'stats': self.stats, 'profiles': self.rider_profiles,
+                'carriers': self.carriers, 'parks': self.parks}
+
+    def changes_since(self, token: Optional[str] = None) -> dict:
+        """
+        Documents created, updated or deleted since the version ``token``.
+
+        Returns every document with ``full`` set when the token is missing,
+        from another process, or older than the change log reaches.
+        """
+        version = self.changes.parse(token)
+        changes = self.changes.changes_since(version) if version is not None else None
+        stores = self.synced_stores()
+        payload = {'version': self.changes.token(), 'full': changes is None, 'changes': {}}
+        for name, store in stores.items():
+            if changes is None:
+                upserted, deleted = store.to_list(), []
+            else:
+                operations = changes.get(name, {})
+                upserted = [store.get(key) for key, operation in operations.items() if operation == 'upsert']
+                deleted = [key for key, operation in operations.items() if operation == 'delete']
+            if name == 'profiles':
+                upserted = [self.apply_rankings(profile) for profile in upserted]
+            payload['changes'][name] = {'upserted': upserted, 'deleted': deleted}
+        return payload
+
+    def adopt_scorecards(self, loaded: ScorecardStore):
+        """Swap in a loaded scorecard store, keeping the scorecards submitted while it loaded."""
+        current = self.scorecards
+        if len(current):
+            rows = [row for row in current.rows(range(len(current))) if row.id]
+            known = loaded.contains_ids(row.id for row in rows)
+            loaded.extend(row for row, seen in zip(rows, known) if not seen)
+        self.scorecards = loaded
+
     def add_scorecard(self, scorecard: ScorecardBase):
         self.scorecards.append(scorecard)
 
@@ -43,16 +210,14 @@ class ServerMemory:
 
         pydantic_carrier = ContestCarrierBase.from_orm(carrier).dict()
 
-        carrier_to_update = None
-        for c in self.carriers:
-            if c.number == pydantic_carrier['number']:
-                carrier_to_update = c
-                break
+        carrier_to_update = self.carriers.get_by('number', pydantic_carrier['number'])
 
         if carrier_to_update:
             # Update the carrier_to_update with pydantic_carrier data
             for key, value in pydantic_carrier.items():
                 setattr(carrier_to_update, key, value)
+            # The session may have changed, keep the session index current
+            self.carriers.reindex(carrier_to_update)
         else:
             # Convert dict back to Pydantic model before appending
             new_carrier = ContestCarrierBase(**pydantic_carrier)
@@ -61,183 +226,115 @@ class ServerMemory:
 
         return pydantic_carrier
 
-    async def update_stats(self, new_stats: RiderStatsBase):
-        # Find the index of the existing stats for the rider, if it exists
-        existing_stats_index = next((index for index, stat in enumerate(self.stats) if stat.rider == new_stats.rider),
-                                    None)
+    async def update_stats(self, new_stats: RiderStatsBase, profile_data: Optional[tuple] = None):
+        # Find the existing stats for the rider, if it exists
+        existing_stats = self.stats.get_by('rider', new_stats.rider)
 
-        print(f"Total number of stats entries: {len(self.stats)}")
-        if existing_stats_index is not None:
+        if existing_stats is not None:
             # Update the existing stats object with the new data
-            existing_stats = self.stats[existing_stats_index]
+            previous_id = existing_stats.id
             for key, value in new_stats.dict().items():
                 setattr(existing_stats, key, value)
+            if existing_stats.id != previous_id:
+                self.stats.discard(previous_id)
+            self.stats.reindex(existing_stats)
 
         else:
             # If no existing stats found, append the new stats and create a new profile
             self.stats.append(new_stats)
 
-        print(f"Total number of stats entries: {len(self.stats)}")
-
-        self.create_or_update_rider_profile(new_stats)
-        # For debug purposes, print the length of the stats list
-        print(f"Total number of stats entries: {len(self.stats)}")
+        # Profile counts and trick statistics come from Mongo, fetch them off the loop unless given
+        if profile_data is None:
+            profile_data = await Repository.profile_data(new_stats.rider)
+        score_counts, tricks = profile_data
+        self.create_or_update_rider_profile(new_stats, score_counts, tricks)
 
     def get_rider_cwa_division_score(self, rider_id: str) -> float:
         # This function should retrieve the relevant statistic for the rider.
         # Assuming here that you have a method or way to get the cwa.score.division.mean statistic for a rider.
         # You would replace this implementation with your actual logic.
         # For example:
-        for stats in self.stats:
-            if stats.rider == rider_id and stats.cwa and 'score' in stats.cwa and 'division' in stats.cwa[
+        for stats in self.stats.filter_by('rider', rider_id):
+            if stats.cwa and 'score' in stats.cwa and 'division' in stats.cwa[
                 'score'] and 'mean' in stats.cwa['score']['division']:
                 return stats.cwa['score']['division']['mean']
         return 0.0
 
+    def rebuild_rankings(self):
+        self.rankings.clear()
+        for stat in self.stats:
+            self.update_ranking(stat.rider, notify=False)
+
+    def update_ranking(self, rider_id: str, notify: bool = True):
+        # Re-file a single rider in every leaderboard, O(log n)
+        rider = self.riders.get(rider_id)
+        age_group = None
+        experience = None
+        if rider and rider.date_of_birth:
+            age_group = calculate_age_group(rider.date_of_birth)
+        if rider and rider.year_started:
+            experience = calculate_experience_bracket(rider.year_started)
+        moved = self.rankings.update(rider_id, self.get_rider_cwa_division_score(rider_id), age_group, experience,
+                                     report=notify)
+        # Ranks are applied to profiles when served, log the profiles whose ranks moved for /api/sync
+        for moved_rider_id in moved:
+            profile = self.rider_profiles.get(moved_rider_id)
+            if profile is not None:
+                self.rider_profiles.touch(profile)
+
+    def apply_rankings(self, profile: RiderProfileBase) -> RiderProfileBase:
+        rider_id = profile.rider.id
+        profile.cwa_rank = self.rankings.rank('cwa', rider_id)
+        profile.age_rank = self.rankings.rank('age_group', rider_id)
+        profile.experience_rank = self.rankings.rank('experience', rider_id)
+        profile.division_rank = self.rankings.rank('division', rider_id)
+        return profile
+
     @property
     def rider_rankings_cwa(self):
-        print(f"Rider rankings property: Total number of stats entries: {len(self.stats)}")
-        # Filter out stats entries without a valid division score mean
-        # valid_stats = [stat for stat in self.stats if
-        #                stat.cwa and 'score' in stat.cwa and 'division' in stat.cwa['score'] and 'mean' in
-        #                stat.cwa['score']['division']]
-
-        # Create a list of tuples containing rider ID and score
-        rider_scores = [(stat.rider, self.get_rider_cwa_division_score(stat.rider)) for stat in self.stats]
-
-        # Sort the list by score in descending order
-        sorted_rider_scores = sorted(rider_scores, key=lambda x: x[1], reverse=True)
-
-        print("sorted rider scores")
-        print(len(sorted_rider_scores))
-        return sorted_rider_scores
+        return self.rankings.ranking('cwa')
 
     @property
     def rider_rankings_by_experience(self):
-        # Define experience brackets and initialize the dictionary
-        experience_brackets = {
-            'Newbie': [],
-            'Rookie': [],
-            'Seasoned': [],
-            'Expert': [],
-            'Legend': []
-        }
-
-        # Iterate over each rider
-        for stat in self.stats:
-            rider = None
-            for r in self.riders:
-                if r.id == stat.rider:
-                    rider = r
-                    break
-            # Calculate the number of years of experience for the rider
-            years_experience = datetime.now().year - rider.year_started
-
-            # Get the rider's score
-            score = self.get_rider_cwa_division_score(rider.id)
-
-            # Determine the experience bracket for the rider
-            if years_experience < 1:
-                bracket = 'Newbie'
-            elif 1 <= years_experience < 3:
-                bracket = 'Rookie'
-            elif 3 <= years_experience < 5:
-                bracket = 'Seasoned'
-            elif 5 <= years_experience < 10:
-                bracket = 'Expert'
-            else:
-                bracket = 'Legend'
-
-            # Append the rider and their score to the corresponding bracket
-            experience_brackets[bracket].append({'rider_id': rider.id, 'score': score})
-
-        for bracket in experience_brackets:
-            experience_brackets[bracket].sort(key=lambda x: x['score'], reverse=True)
-
+        experience_brackets = {}
+        for bracket in ('Newbie', 'Rookie', 'Seasoned', 'Expert', 'Legend'):
+            experience_brackets[bracket] = [{'rider_id': rider_id, 'score': score}
+                                            for rider_id, score in self.rankings.ranking('experience', bracket)]
         return experience_brackets
 
     @property
     def rider_rankings_by_division(self):
-        division_rankings = {'Beginner': [], 'Novice': [], 'Intermediate': [], 'Advanced': [], 'Pro': []}
-
-        for stat in self.stats:
-            rider = None
-            for r in self.riders:
-                if r.id == stat.rider:
-                    rider = r
-                    break
-            score = self.get_rider_cwa_division_score(rider.id)
-            division = calculate_division(score)
-            division_rankings[division].append((rider.id, score))
-
-        # Sorting riders within each division by score in descending order
-        for division in division_rankings:
-            division_rankings[division].sort(key=lambda x: x[1], reverse=True)
-
-        return division_rankings
+        return {division: self.rankings.ranking('division', division)
+                for division in ('Beginner', 'Novice', 'Intermediate', 'Advanced', 'Pro')}
 
     @property
     def rider_rankings_by_age_group(self):
-        # Define age group categories
-        age_groups = {
-            'Grom': [],
-            'Juniors': [],
-            'Adults': [],
-            'Masters': [],
-            'Veterans': []
-        }
-
-        # Iterate over all riders
-        for stat in self.stats:
-            # TODO Get the self.riders object that matches stat.rider
-            rider = None
+        return {age_group: [rider_id for rider_id, _ in self.rankings.ranking('age_group', age_group)]
+                for age_group in ('Grom', 'Juniors', 'Adults', 'Masters', 'Veterans')}
 
-            for r in self.riders:
-                if r.id == stat.rider:
-                    rider = r
-                    break
-
-            age_group = calculate_age_group(rider.date_of_birth)
-            if age_group in age_groups:
-                age_groups[age_group].append(rider.id)
-            else:
-                age_groups['Unknown'].append(rider.id)
-
-        # Sort riders within each age group by rank based on CWA division score mean
-        for age_group, rider_ids in age_groups.items():
-            rider_ids.sort(key=lambda rider_id: self.get_rider_cwa_division_score(rider_id), reverse=True)
-
-        return age_groups
-
-    def create_or_update_rider_profile(self, rider_stat: RiderStatsBase):
-        rider = None
-        for r in self.riders:
-            if r.id == rider_stat.rider:
-                rider = r
+    def create_or_update_rider_profile(self, rider_stat: RiderStatsBase, score_counts: tuple, tricks: Optional[dict]):
+        rider = self.riders.get(rider_stat.rider)
+        if rider is None:
+            print(f"No rider {rider_stat.rider} for stats {rider_stat.id}")
+            return None
 
         rider.division = self.get_rider_cwa_division_score(rider.id)
-        print("getting existing profile")
-        existing_profile = self.rider_profiles_map.get(rider.id)
-        overall_count, cwa_count, attempted_count = Scorecard.calculate_score_counts(rider.id)
+        self.riders.touch(rider)
+        self.update_ranking(rider.id)
+        existing_profile = self.rider_profiles.get(rider.id)
+        overall_count, cwa_count, attempted_count = score_counts
 
         if existing_profile:
-            print("found existing profile")
             # Update the existing profile
             existing_profile.statistics = rider_stat
             existing_profile.trick_count = int(overall_count)
             existing_profile.scored_count = int(cwa_count)
             existing_profile.attempted_count = int(attempted_count)
             existing_profile.rider = rider
-            existing_profile.cwa_rank = calculate_cwa_rank(rider.id, self.rider_rankings_cwa)
-            existing_profile.age_rank = calculate_age_rank(rider.id, self.rider_rankings_by_age_group)
-            existing_profile.experience_rank = calculate_experience_rank(rider.id, self.rider_rankings_by_experience)
-            existing_profile.division_rank = calculate_division_rank(rider.id, self.rider_rankings_by_division,
-                                                                     self.get_rider_cwa_division_score(
-                                                                         rider_stat.rider))
-            existing_profile.tricks = Scorecard.get_trick_statistics(rider.id)
-            return existing_profile
+            existing_profile.tricks = tricks
+            self.rider_profiles.touch(existing_profile)
+            return self.apply_rankings(existing_profile)
         else:
-            print("creating new profile")
             # Create a new profile
             new_profile = RiderProfileBase(
                 rider=rider,
@@ -245,25 +342,26 @@ class ServerMemory:
                 trick_count=int(overall_count),
                 scored_count=int(cwa_count),
                 attempted_count=int(attempted_count),
-                cwa_rank=calculate_cwa_rank(rider.id, self.rider_rankings_cwa),
-                age_rank=calculate_age_rank(rider.id, self.rider_rankings_by_age_group),
-                division_rank=calculate_division_rank(rider.id, self.rider_rankings_by_division,
-                                                      self.get_rider_cwa_division_score(rider_stat.rider)),
-                experience_rank=calculate_experience_rank(rider.id, self.rider_rankings_by_experience),
-                tricks=Scorecard.get_trick_statistics(rider.id)
+                tricks=tricks
             )
+            self.apply_rankings(new_profile)
             self.rider_profiles.append(new_profile)
-
-            # Update rider_profiles_map with the new profile
-            self.rider_profiles_map[new_profile.rider.id] = new_profile
-
-            print("length of rider profiles in memory")
-            print(len(self.rider_profiles))
             return new_profile
 
+    def update_rider(self, rider: RiderBase):
+        # Date of birth or start year may have moved the rider to another leaderboard
+        self.riders.upsert(rider)
+        if rider.id in self.rankings:
+            self.update_ranking(rider.id)
+        profile = self.rider_profiles.get(rider.id)
+        if profile:
+            profile.rider = rider
+            self.rider_profiles.touch(profile)
+
     # Method to fetch a rider profile
     def get_rider_profile(self, rider_id: str) -> Optional[RiderProfileBase]:
-        for profile in self.rider_profiles:
-            if profile.rider and profile.rider.id == rider_id:
-                return profile
-        return None
+        profile = self.rider_profiles.get(rider_id)
+        if profile is None:
+            return None
+        # Other riders' scores move ranks too, refresh them on read
+        return self.apply_rankings(profile)
@@ -0,0 +1,69 @@
+import hashlib
+import os
+from datetime import datetime
+from typing import Any, Dict, Optional
+
+import msgpack
+
+SNAPSHOT_MAGIC = b'CWASNAP'
+SNAPSHOT_VERSION = 2
+SNAPSHOT_PATH = os.getenv('CABLEOPS_SNAPSHOT_PATH',
+                          os.path.join(os.path.dirname(os.path.realpath(__file__)), 'server_memory.snapshot'))
+
+_DATETIME_EXT = 1
+_HEADER_SIZE = len(SNAPSHOT_MAGIC) + 1 + hashlib.sha256().digest_size
+
+
+def _encode(obj):
+    if isinstance(obj, datetime):
+        return msgpack.ExtType(_DATETIME_EXT, obj.isoformat().encode())
+    if hasattr(obj, 'item'):
+        # NumPy/pandas scalars left in trick statistics
+        return obj.item()
+    return str(obj)
+
+
+def _decode(code, data):
+    if code == _DATETIME_EXT:
+        return datetime.fromisoformat(data.decode())
+    return msgpack.ExtType(code, data)
+
+
+def write_snapshot(payload: Dict[str, Any], path: str = SNAPSHOT_PATH):
+    """
+    Write ``payload`` as ``magic | version | sha256(body) | msgpack body``.
+
+    The file is written next to its destination and renamed into place so
+    a crash mid-write never leaves a truncated snapshot behind.
+    """
+    body = msgpack.packb(payload, default=_encode, use_bin_type=True)
+    temporary_path = f"{path}.tmp"
+    with open(temporary_path, 'wb') as snapshot_file:
+        snapshot_file.write(SNAPSHOT_MAGIC)
+        snapshot_file.write(bytes([SNAPSHOT_VERSION]))
+        snapshot_file.write(hashlib.sha256(body).digest())
+        snapshot_file.write(body)
+    os.replace(temporary_path, path)
+
+
+def read_snapshot(path: str = SNAPSHOT_PATH) -> Optional[Dict[str, Any]]:
+    """Return the snapshot payload, or None if it is missing, from another version or corrupt."""
+    try:
+        with open(path, 'rb') as snapshot_file:
+            data = snapshot_file.read()
+    except FileNotFoundError:
+        return None
+
+    if not data.startswith(SNAPSHOT_MAGIC) or len(data) < _HEADER_SIZE:
+        print(f"Ignoring snapshot {path}: not a snapshot file")
+        return None
+    version = data[len(SNAPSHOT_MAGIC)]
+    if version != SNAPSHOT_VERSION:
+        print(f"Ignoring snapshot {path}: version {version}, expected {SNAPSHOT_VERSION}")
+        return None
+    checksum = data[len(SNAPSHOT_MAGIC) + 1:_HEADER_SIZE]
+    body = data[_HEADER_SIZE:]
+    if hashlib.sha256(body).digest() != checksum:
+        print(f"Ignoring snapshot {path}: checksum mismatch")
+        return None
+    return msgpack.unpackb(body, ext_hook=_decode, raw=False, strict_map_key=False)
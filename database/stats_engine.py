@@ -0,0 +1,383 @@
+import bisect
+import heapq
+import math
+from itertools import count
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+SECTIONS = ['Kicker', 'Rail', 'Air Trick']
+SCORE_METRICS = ['division', 'execution', 'difficulty', 'creativity']
+SECTION_METRICS = ['division', 'creativity', 'execution', 'difficulty']
+QUANTILES = (0.25, 0.5, 0.75)
+
+NAN = float('nan')
+
+
+def _field(scorecard, name):
+    # Scorecards arrive as pydantic models from the websocket and as dicts from Mongo
+    if isinstance(scorecard, dict):
+        return scorecard.get(name)
+    return getattr(scorecard, name, None)
+
+
+def _number(value) -> Optional[float]:
+    if value is None:
+        return None
+    value = float(value)
+    return None if math.isnan(value) else value
+
+
+def _quantile(ordered: List[float], q: float) -> float:
+    # Linear interpolation, the pandas/numpy default
+    position = (len(ordered) - 1) * q
+    lower = math.floor(position)
+    upper = math.ceil(position)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (position - lower)
+
+
+def describe_values(values: Iterable[float]) -> Dict[str, float]:
+    """Exact equivalent of ``Series.describe().to_dict()`` for a handful of values."""
+    ordered = sorted(v for v in values if v is not None and not math.isnan(v))
+    n = len(ordered)
+    if not n:
+        return {'count': 0.0, 'mean': NAN, 'std': NAN, 'min': NAN, '25%': NAN, '50%': NAN, '75%': NAN, 'max': NAN}
+    mean = sum(ordered) / n
+    std = math.sqrt(sum((v - mean) ** 2 for v in ordered) / (n - 1)) if n > 1 else NAN
+    return {
+        'count': float(n),
+        'mean': mean,
+        'std': std,
+        'min': ordered[0],
+        '25%': _quantile(ordered, 0.25),
+        '50%': _quantile(ordered, 0.5),
+        '75%': _quantile(ordered, 0.75),
+        'max': ordered[-1],
+    }
+
+
+class P2Quantile:
+    """
+    Streaming quantile estimate with the P-square algorithm (Jain & Chlamtac).
+
+    Keeps five markers, so memory and update cost are O(1) whatever the
+    number of observations.
+    """
+
+    def __init__(self, q: float, ordered: List[float]):
+        # Markers start at the minimum, q/2, q, (1+q)/2 quantiles and maximum of a sorted sample
+        n = len(ordered)
+        self.q = q
+        self._desired = [1, 1 + (n - 1) * q / 2, 1 + (n - 1) * q, 1 + (n - 1) * (1 + q) / 2, n]
+        self._positions = [1, 0, 0, 0, n]
+        for i in (1, 2, 3):
+            self._positions[i] = min(max(round(self._desired[i]), self._positions[i - 1] + 1), n - (4 - i))
+        self._heights = [ordered[position - 1] for position in self._positions]
+        self._increments = [0, q / 2, q, (1 + q) / 2, 1]
+
+    def add(self, x: float):
+        heights = self._heights
+        if x < heights[0]:
+            heights[0] = x
+            k = 0
+        elif x >= heights[4]:
+            heights[4] = x
+            k = 3
+        else:
+            k = 0
+            while x >= heights[k + 1]:
+                k += 1
+
+        positions = self._positions
+        for i in range(k + 1, 5):
+            positions[i] += 1
+        for i in range(5):
+            self._desired[i] += self._increments[i]
+
+        for i in (1, 2, 3):
+            d = self._desired[i] - positions[i]
+            if (d >= 1 and positions[i + 1] - positions[i] > 1) or (d <= -1 and positions[i - 1] - positions[i] < -1):
+                d = 1 if d > 0 else -1
+                height = self._parabolic(i, d)
+                if not heights[i - 1] < height < heights[i + 1]:
+                    height = heights[i] + d * (heights[i + d] - heights[i]) / (positions[i + d] - positions[i])
+                heights[i] = height
+                positions[i] += d
+
+    def _parabolic(self, i: int, d: int) -> float:
+        n = self._positions
+        h = self._heights
+        return h[i] + d / (n[i + 1] - n[i - 1]) * (
+            (n[i] - n[i - 1] + d) * (h[i + 1] - h[i]) / (n[i + 1] - n[i])
+            + (n[i + 1] - n[i] - d) * (h[i] - h[i - 1]) / (n[i] - n[i - 1]))
+
+    def value(self) -> float:
+        return self._heights[2]
+
+
+class RunningStats:
+    """
+    Count, Welford mean/variance, min/max and quartiles of one column.
+
+    Quartiles are exact while the column holds up to ``EXACT_LIMIT`` values
+    (a sorted sample), after that they switch to P-square sketches seeded
+    from that sample so memory stays bounded.
+    """
+
+    EXACT_LIMIT = 128
+
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self._m2 = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+        self._sample: Optional[List[float]] = []
+        self._quantiles: List[P2Quantile] = []
+
+    def add(self, value):
+        value = _number(value)
+        if value is None:
+            return
+        self.count += 1
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self._m2 += delta * (value - self.mean)
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+
+        if self._sample is None:
+            for quantile in self._quantiles:
+                quantile.add(value)
+            return
+        bisect.insort(self._sample, value)
+        if len(self._sample) > self.EXACT_LIMIT:
+            self._quantiles = [P2Quantile(q, self._sample) for q in QUANTILES]
+            self._sample = None
+
+    def quantiles(self) -> List[float]:
+        if self._sample is not None:
+            return [_quantile(self._sample, q) for q in QUANTILES]
+        return [quantile.value() for quantile in self._quantiles]
+
+    def describe(self) -> Dict[str, float]:
+        if not self.count:
+            return describe_values([])
+        q25, q50, q75 = self.quantiles()
+        return {
+            'count': float(self.count),
+            'mean': self.mean,
+            'std': math.sqrt(self._m2 / (self.count - 1)) if self.count > 1 else NAN,
+            'min': self.min,
+            '25%': q25,
+            '50%': q50,
+            '75%': q75,
+            'max': self.max,
+        }
+
+
+class MetricStats:
+    """RunningStats for each judged metric of a scorecard."""
+
+    def __init__(self, metrics: List[str] = SCORE_METRICS):
+        self.columns = {metric: RunningStats() for metric in metrics}
+
+    def add(self, scorecard):
+        for metric, column in self.columns.items():
+            column.add(_field(scorecard, metric))
+
+    def describe(self) -> Dict[str, Dict[str, float]]:
+        return {metric: column.describe() for metric, column in self.columns.items()}
+
+
+class FilterAccumulator:
+    """Per-section score stats plus metric stats for one scorecard filter (landed, cwa, ...)."""
+
+    def __init__(self):
+        self.sections: Dict[str, RunningStats] = {}
+        self.metrics = MetricStats()
+
+    def add(self, scorecard):
+        section = _field(scorecard, 'section')
+        if section is not None:
+            self.sections.setdefault(section, RunningStats()).add(_field(scorecard, 'score'))
+        self.metrics.add(scorecard)
+
+    def to_dict(self) -> Dict[str, Dict]:
+        return {
+            'section': {section: self.sections[section].describe() for section in sorted(self.sections)},
+            'score': self.metrics.describe(),
+        }
+
+
+class _Row:
+    __slots__ = ('score', 'metrics')
+
+    def __init__(self, scorecard):
+        self.score = _number(_field(scorecard, 'score'))
+        self.metrics = {metric: _number(_field(scorecard, metric)) for metric in SCORE_METRICS}
+
+
+class TopScores:
+    """Bounded min-heap of the best ``size`` rows per section, first arrival wins ties."""
+
+    def __init__(self, size: int = 10):
+        self.size = size
+        self._heaps: Dict[str, list] = {section: [] for section in SECTIONS}
+        self._sequence = count()
+
+    def add(self, section, row: _Row):
+        heap = self._heaps.get(section)
+        if heap is None or row.score is None:
+            return
+        entry = (row.score, -next(self._sequence), row)
+        if len(heap) < self.size:
+            heapq.heappush(heap, entry)
+        elif entry[:2] > heap[0][:2]:
+            heapq.heapreplace(heap, entry)
+
+    def to_dict(self) -> Dict[str, Dict]:
+        section_summary = {}
+        rows = []
+        for section in sorted(self._heaps):
+            heap = self._heaps[section]
+            if not heap:
+                continue
+            section_summary[section] = describe_values(entry[0] for entry in heap)
+            rows.extend(entry[2] for entry in sorted(heap, reverse=True))
+        return {
+            'section': section_summary,
+            'score': {metric: describe_values(row.metrics[metric] for row in rows) for metric in SCORE_METRICS},
+        }
+
+
+class RiderStatsAccumulator:
+    """
+    All the summaries ``calculate_stats_from_scorecards`` produces for one rider, folded one scorecard at a time.
+
+    Adding a scorecard is O(1); ``to_dict`` returns the same layout
+    ``RiderCompStats`` stores.
+    """
+
+    def __init__(self):
+        self.scorecard_ids = set()
+        self.overall = FilterAccumulator()
+        self.cwa = FilterAccumulator()
+        self.attempted = FilterAccumulator()
+        self.top_10 = TopScores()
+        self.best_trick: Dict[str, _Row] = {}
+        self.section_stats = {section: MetricStats(SECTION_METRICS) for section in SECTIONS}
+
+    def __len__(self) -> int:
+        return len(self.scorecard_ids)
+
+    def add(self, scorecard) -> bool:
+        scorecard_id = _field(scorecard, 'id') or _field(scorecard, '_id')
+        if scorecard_id is not None:
+            scorecard_id = str(scorecard_id)
+            if scorecard_id in self.scorecard_ids:
+                return False
+            self.scorecard_ids.add(scorecard_id)
+
+        section = _field(scorecard, 'section')
+        if section in self.section_stats:
+            self.section_stats[section].add(scorecard)
+
+        if not _field(scorecard, 'landed'):
+            self.attempted.add(scorecard)
+            return True
+
+        self.overall.add(scorecard)
+        row = _Row(scorecard)
+        if row.score is not None and row.score > 50:
+            self.cwa.add(scorecard)
+        self.top_10.add(section, row)
+        if section is not None and row.score is not None:
+            best = self.best_trick.get(section)
+            if best is None or row.score > best.score:
+                self.best_trick[section] = row
+        return True
+
+    def best_trick_dict(self) -> Dict[str, Dict]:
+        sections = sorted(self.best_trick)
+        return {
+            'section': {section: describe_values([self.best_trick[section].score]) for section in sections},
+            'score': {metric: describe_values(self.best_trick[section].metrics[metric] for section in sections)
+                      for metric in SCORE_METRICS},
+        }
+
+    def to_dict(self) -> Dict[str, Any]:
+        if not self.scorecard_ids:
+            return {}
+        cwa_stats = self.cwa.to_dict()
+        return {
+            "division": cwa_stats['score']['division']['mean'],
+            "overall": self.overall.to_dict(),
+            "top_10": self.top_10.to_dict(),
+            "cwa": cwa_stats,
+            "attempted": self.attempted.to_dict(),
+            "best_trick": self.best_trick_dict(),
+            "kicker_stats": self.section_stats['Kicker'].describe(),
+            "rail_stats": self.section_stats['Rail'].describe(),
+            "air_trick_stats": self.section_stats['Air Trick'].describe(),
+        }
+
+
+class StatsEngine:
+    """
+    Per-rider stats kept current as scorecards arrive.
+
+    A rider's accumulator is seeded from Mongo the first time it is needed,
+    after that every new scorecard is folded in without touching the
+    database.
+    """
+
+    def __init__(self, loader: Optional[Callable[[str], Iterable]] = None):
+        if loader is None:
+            from database.CWA_Events import Scorecard
+            loader = Scorecard.get_scorecards_by_rider
+        self._loader = loader
+        self._riders: Dict[str, RiderStatsAccumulator] = {}
+
+    def __contains__(self, rider_id) -> bool:
+        return str(rider_id) in self._riders
+
+    def seed(self, rider_id, scorecards: Iterable) -> RiderStatsAccumulator:
+        accumulator = RiderStatsAccumulator()
+        for scorecard in scorecards:
+            accumulator.add(scorecard)
+        self._riders[str(rider_id)] = accumulator
+        return accumulator
+
+    def rebuild(self, rider_id) -> Dict[str, Any]:
+        """
+        Seed the rider from its stored scorecards and return its exact stats, blocking.
+
+        Whole histories go through the vectorized kernel; the accumulator
+        seeded alongside takes the scorecards that follow.
+        """
+        from database.stats_kernel import calculate_stats_from_scorecards
+        scorecards = list(self._loader(str(rider_id)))
+        self.seed(rider_id, scorecards)
+        return calculate_stats_from_scorecards(scorecards) if scorecards else {}
+
+    def load(self, rider_id) -> Iterable:
+        """The rider's stored scorecards, blocking; callers on the loop seed with them off the loop."""
+        return self._loader(str(rider_id))
+
+    def forget(self, rider_id):
+        self._riders.pop(str(rider_id), None)
+
+    def fold(self, scorecard) -> Dict[str, Any]:
+        """Add ``scorecard`` to its rider's stats and return the updated stats dict."""
+        rider_id = str(_field(scorecard, 'rider'))
+        accumulator = self._riders.get(rider_id)
+        if accumulator is None:
+            # The scorecard is already saved, so the seed includes it
+            accumulator = self.seed(rider_id, self._loader(rider_id))
+        accumulator.add(scorecard)
+        return accumulator.to_dict()
+
+    def stats(self, rider_id) -> Dict[str, Any]:
+        accumulator = self._riders.get(str(rider_id))
+        if accumulator is None:
+            accumulator = self.seed(rider_id, self._loader(str(rider_id)))
+        return accumulator.to_dict()
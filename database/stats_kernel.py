@@ -0,0 +1,147 @@
+from typing import Any, Dict, Iterable, List
+
+import numpy as np
+
+from database.stats_engine import SECTIONS, SCORE_METRICS, SECTION_METRICS, describe_values
+
+METRICS = ['division', 'execution', 'creativity', 'difficulty']
+QUARTILES = np.array([0.25, 0.5, 0.75])
+
+
+class ScorecardColumns:
+    """A rider's scorecards as NumPy columns, built once per ``calculate_stats_from_scorecards`` call."""
+
+    def __init__(self, scorecards: List[Any]):
+        self.size = len(scorecards)
+        self.score = self._floats(scorecards, 'score')
+        self.metrics = {metric: self._floats(scorecards, metric) for metric in METRICS}
+        self.landed = np.fromiter((bool(self._get(s, 'landed')) for s in scorecards), dtype=bool, count=self.size)
+
+        sections = [self._get(s, 'section') for s in scorecards]
+        self.has_section = np.fromiter((s is not None for s in sections), dtype=bool, count=self.size)
+        names, codes = np.unique(np.array([s or '' for s in sections], dtype=object).astype(str),
+                                 return_inverse=True)
+        # np.unique sorts, so section codes follow the groupby('section') order
+        self.section_names: List[str] = [str(name) for name in names]
+        self.section = codes.reshape(-1)
+
+        # Sort once by (section, score descending, arrival); every grouped summary slices this order
+        self.by_section_score = np.lexsort((np.arange(self.size), -self.score, self.section))
+        # And once per metric column, NaN last
+        self.metric_order = {metric: np.argsort(values, kind='stable') for metric, values in self.metrics.items()}
+
+    @staticmethod
+    def _get(scorecard, name):
+        if isinstance(scorecard, dict):
+            return scorecard.get(name)
+        return getattr(scorecard, name, None)
+
+    def _floats(self, scorecards, name) -> np.ndarray:
+        values = (self._get(s, name) for s in scorecards)
+        return np.fromiter((np.nan if v is None else v for v in values), dtype=np.float64, count=self.size)
+
+    def section_code(self, name: str) -> int:
+        try:
+            return self.section_names.index(name)
+        except ValueError:
+            return -1
+
+
+def describe_sorted(values: np.ndarray) -> Dict[str, float]:
+    """``Series.describe()`` of an ascending array whose NaNs (if any) sit at the end."""
+    n = int(np.count_nonzero(~np.isnan(values)))
+    if not n:
+        return describe_values([])
+    values = values[:n]
+    positions = (n - 1) * QUARTILES
+    lower = np.floor(positions).astype(int)
+    upper = np.ceil(positions).astype(int)
+    quartiles = values[lower] + (values[upper] - values[lower]) * (positions - lower)
+    return {
+        'count': float(n),
+        'mean': float(values.mean()),
+        'std': float(values.std(ddof=1)) if n > 1 else float('nan'),
+        'min': float(values[0]),
+        '25%': float(quartiles[0]),
+        '50%': float(quartiles[1]),
+        '75%': float(quartiles[2]),
+        'max': float(values[-1]),
+    }
+
+
+def _section_summary(columns: ScorecardColumns, rows: np.ndarray) -> Dict[str, Dict[str, float]]:
+    # ``rows`` is a subset of ``by_section_score`` in the same order, i.e. grouped by section
+    rows = rows[columns.has_section[rows]]
+    codes = columns.section[rows]
+    boundaries = np.flatnonzero(np.diff(codes)) + 1
+    summary = {}
+    for group in np.split(rows, boundaries) if rows.size else []:
+        # Scores are sorted descending within the group with NaN last, flip the non-NaN part
+        scores = columns.score[group]
+        valid = scores[~np.isnan(scores)][::-1]
+        summary[columns.section_names[columns.section[group[0]]]] = describe_sorted(valid)
+    return summary
+
+
+def _metric_summary(columns: ScorecardColumns, mask: np.ndarray, metrics: List[str]) -> Dict[str, Dict[str, float]]:
+    summary = {}
+    for metric in metrics:
+        order = columns.metric_order[metric]
+        summary[metric] = describe_sorted(columns.metrics[metric][order[mask[order]]])
+    return summary
+
+
+def _filter_summary(columns: ScorecardColumns, mask: np.ndarray) -> Dict[str, Dict]:
+    rows = columns.by_section_score[mask[columns.by_section_score]]
+    return {
+        'section': _section_summary(columns, rows),
+        'score': _metric_summary(columns, mask, SCORE_METRICS),
+    }
+
+
+def _ranked_rows(columns: ScorecardColumns, mask: np.ndarray, per_section: int) -> np.ndarray:
+    # First ``per_section`` rows of every section block in score order, NaN scores excluded
+    rows = columns.by_section_score
+    rows = rows[mask[rows] & ~np.isnan(columns.score[rows]) & columns.has_section[rows]]
+    if not rows.size:
+        return rows
+    codes = columns.section[rows]
+    starts = np.r_[0, np.flatnonzero(np.diff(codes)) + 1]
+    offsets = np.arange(rows.size) - np.repeat(starts, np.diff(np.r_[starts, rows.size]))
+    return rows[offsets < per_section]
+
+
+def calculate_stats_from_scorecards(scorecards: Iterable[Any]) -> Dict[str, Any]:
+    """
+    Rider stats of a whole history, vectorized: the RiderCompStats layout, one set of sorts.
+
+    The scorecards become NumPy columns once; every filter (landed, cwa,
+    attempted, top 10, best trick, section) is a boolean mask over shared
+    sort orders instead of a new DataFrame and ``groupby().describe()``.
+    """
+    scorecards = list(scorecards)
+    if not scorecards:
+        return {}
+
+    columns = ScorecardColumns(scorecards)
+    landed = columns.landed
+    cwa = landed & (columns.score > 50)
+
+    top_sections = np.isin(columns.section, [columns.section_code(section) for section in SECTIONS])
+    top_10 = np.zeros(columns.size, dtype=bool)
+    top_10[_ranked_rows(columns, landed & top_sections, 10)] = True
+    best_trick = np.zeros(columns.size, dtype=bool)
+    best_trick[_ranked_rows(columns, landed, 1)] = True
+
+    cwa_stats = _filter_summary(columns, cwa)
+    stats_dict = {
+        "division": cwa_stats['score']['division']['mean'],
+        "overall": _filter_summary(columns, landed),
+        "top_10": _filter_summary(columns, top_10),
+        "cwa": cwa_stats,
+        "attempted": _filter_summary(columns, ~landed),
+        "best_trick": _filter_summary(columns, best_trick),
+    }
+    for key, section in (('kicker_stats', 'Kicker'), ('rail_stats', 'Rail'), ('air_trick_stats', 'Air Trick')):
+        stats_dict[key] = _metric_summary(columns, columns.section == columns.section_code(section), SECTION_METRICS)
+    return stats_dict
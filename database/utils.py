@@ -1,4 +1,3 @@
-import time
 from datetime import datetime, date
 from enum import Enum
 
@@ -66,13 +65,12 @@ def calculate_age_group(dob: date) -> str:
 
 
 def get_experience_label(years_experience: int) -> str:
-    if years_experience < 0:
-        return "Invalid"
-    elif years_experience <= 1:
+    # A year_started in the future counts as no experience yet
+    if years_experience < 1:
         return "Newbie"
-    elif years_experience <= 3:
+    elif years_experience < 3:
         return "Rookie"
-    elif years_experience <= 5:
+    elif years_experience < 5:
         return "Seasoned"
     elif years_experience < 10:
         return "Expert"
@@ -80,6 +78,10 @@ def get_experience_label(years_experience: int) -> str:
         return "Legend"
 
 
+def calculate_experience_bracket(year_started: int) -> str:
+    return get_experience_label(datetime.now().year - year_started)
+
+
 def calculate_age(birth_date: datetime) -> int:
     # Implement age calculation from birth_date
     today = datetime.today()
@@ -152,24 +154,20 @@ def handle_nan_values(data):
                 handle_nan_values(value)
 
 
-def calculate_stats(rider_id):
-    start_time = time.time()
-
-    # Fetch scorecards for the rider
-    df = DataFrame(Scorecard.get_scorecards_by_rider(rider_id))
-    if df.empty:
-        print("DataFrame is empty")
-        return {}  # Return an empty dict if no scorecards found
+def calculate_stats_frame(df):
+    """
+    The original pandas implementation of the rider stats for a scorecard DataFrame.
 
+    Kept as the reference the NumPy kernel is checked and benchmarked against.
+    """
     df['_id'] = df['_id'].astype(str)
     df['date'] = to_datetime(df['date'])
     df['date'] = df['date'].dt.strftime("%Y-%m-%dT%H:%M:%S")
 
-
     cwa_stats = calculate_cwa(df)
     division_mean = cwa_stats.pop('mean_division_score', None)
 
-    stats_dict = {
+    return {
         "division": division_mean,  # Example for division, adjust as needed
         "overall": calculate_overall(df),
         "top_10": calculate_top_10(df),
@@ -181,12 +179,6 @@ def calculate_stats(rider_id):
         "air_trick_stats": calculate_section_stats(df, 'Air Trick')
     }
 
-    end_time = time.time()
-    execution_time = end_time - start_time
-    print(execution_time)
-
-    return stats_dict
-
 
 def calculate_overall(df):
     # Step 1: Filter out scorecards where landed is False
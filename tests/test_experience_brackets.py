@@ -0,0 +1,23 @@
+from datetime import datetime
+
+from database.utils import calculate_experience_bracket, get_experience_label
+
+
+def test_experience_label_boundaries():
+    assert get_experience_label(-2) == "Newbie"
+    assert get_experience_label(0) == "Newbie"
+    assert get_experience_label(1) == "Rookie"
+    assert get_experience_label(2) == "Rookie"
+    assert get_experience_label(3) == "Seasoned"
+    assert get_experience_label(4) == "Seasoned"
+    assert get_experience_label(5) == "Expert"
+    assert get_experience_label(9) == "Expert"
+    assert get_experience_label(10) == "Legend"
+
+
+def test_experience_bracket_from_year_started():
+    year = datetime.now().year
+    assert calculate_experience_bracket(year + 1) == "Newbie"
+    assert calculate_experience_bracket(year - 1) == "Rookie"
+    assert calculate_experience_bracket(year - 3) == "Seasoned"
+    assert calculate_experience_bracket(year - 5) == "Expert"
@@ -1,41 +1,382 @@
-import json
-from typing import Dict, Tuple, Any
+import asyncio
+import os
+import time
+from collections import deque
+from typing import Dict, Any, Iterable, List, Optional, Set, Union
 
-from fastapi import WebSocket
+from fastapi import WebSocket, WebSocketDisconnect
 from icecream import ic
 
+from webserver.metrics import BROADCAST_FLUSH, BROADCAST_FRAMES
+from webserver.serialization import DEFAULT_FORMAT, FORMATS, decode, dumps_text, encode, encode_message
+
+# Outbound messages buffered per connection before the slow consumer policy kicks in
+SEND_QUEUE_SIZE = int(os.getenv('CABLEOPS_WS_QUEUE_SIZE', 64))
+# Seconds a single send may take before the connection is considered dead
+SEND_TIMEOUT = float(os.getenv('CABLEOPS_WS_SEND_TIMEOUT', 5))
+# What to do when a connection's queue is full: 'drop_oldest' or 'disconnect'
+SLOW_CONSUMER_POLICY = os.getenv('CABLEOPS_WS_SLOW_CONSUMER_POLICY', 'drop_oldest')
+# Seconds broadcasts are collected and coalesced before being sent, 0 sends right away
+BROADCAST_TICK = float(os.getenv('CABLEOPS_WS_TICK', 0.05))
+
+
+class BroadcastMetrics:
+    """Counters and recent send latencies of the WebSocket fan-out."""
+
+    def __init__(self, window: int = 1000):
+        self.broadcasts = 0
+        self.coalesced = 0
+        self.ticks = 0
+        self.sent = 0
+        self.dropped = 0
+        self.disconnected = 0
+        self.send_errors = 0
+        self.latencies = deque(maxlen=window)
+
+    def observe_send(self, seconds: float):
+        self.sent += 1
+        self.latencies.append(seconds)
+
+    def latency_percentile(self, q: float) -> Optional[float]:
+        if not self.latencies:
+            return None
+        ordered = sorted(self.latencies)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+    def to_dict(self, connections: Dict[str, 'ClientConnection']) -> dict:
+        depths = [client.queue.qsize() for client in connections.values()]
+        return {
+            'connections': len(connections),
+            'broadcasts': self.broadcasts,
+            'coalesced': self.coalesced,
+            'ticks': self.ticks,
+            'sent': self.sent,
+            'dropped': self.dropped,
+            'disconnected': self.disconnected,
+            'send_errors': self.send_errors,
+            'queue_depth': {'max': max(depths, default=0), 'total': sum(depths)},
+            'send_latency_ms': {
+                'p50': self._millis(self.latency_percentile(0.5)),
+                'p99': self._millis(self.latency_percentile(0.99)),
+                'max': self._millis(max(self.latencies, default=None)),
+            },
+        }
+
+    @staticmethod
+    def _millis(seconds: Optional[float]) -> Optional[float]:
+        return None if seconds is None else round(seconds * 1000, 3)
+
+
+class PendingMessage:
+    __slots__ = ('type', 'data', 'topics', 'path', 'requires', 'excludes')
+
+    def __init__(self, type: str, data: Any, topics: List[str], path: Optional[str], requires: Optional[str],
+                 excludes: Optional[str]):
+        self.type = type
+        self.data = data
+        self.topics = topics
+        self.path = path
+        self.requires = requires
+        self.excludes = excludes
+
+    def item(self, format: str) -> dict:
+        # One entry of a batch frame, with the same ``data`` encoding as a standalone message
+        if format == 'legacy' and not isinstance(self.data, str):
+            return {'type': self.type, 'data': dumps_text(self.data)}
+        return {'type': self.type, 'data': self.data}
+
+
+class ClientConnection:
+    """
+    One registered WebSocket with its own bounded outbound queue and writer task.
+
+    Broadcasts only enqueue; the writer drains the queue at whatever pace the
+    client can take, so a slow phone never holds up anyone else.
+    """
+
+    def __init__(self, websocket: WebSocket, user_uuid: str, path: str, manager: 'ConnectionManager'):
+        self.websocket = websocket
+        self.user_uuid = user_uuid
+        self.path = path
+        self.manager = manager
+        # Empty means the client never subscribed and receives every broadcast
+        self.topics: Set[str] = set()
+        # Protocol extensions the client opted into, e.g. 'stats_delta'
+        self.features: Set[str] = set()
+        self.format = DEFAULT_FORMAT
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=manager.queue_size)
+        self.closed = False
+        self.closing = False
+        self.writer = asyncio.create_task(self._write())
+
+    def enqueue(self, message: Union[str, bytes]) -> bool:
+        """Queue ``message`` without waiting, applying the slow consumer policy when full."""
+        if self.closed or self.closing:
+            return False
+        if self.queue.full():
+            if self.manager.policy == 'disconnect':
+                print(f"Disconnecting slow consumer {self.user_uuid}")
+                self.manager.metrics.disconnected += 1
+                self._drop()
+                return False
+            # Newer carrier/scorecard/stats updates supersede the oldest queued one
+            self.queue.get_nowait()
+            self.manager.metrics.dropped += 1
+        self.queue.put_nowait(message)
+        return True
+
+    async def _write(self):
+        while True:
+            message = await self.queue.get()
+            start_time = time.perf_counter()
+            try:
+                if isinstance(message, bytes):
+                    send = self.websocket.send_bytes(message)
+                else:
+                    send = self.websocket.send_text(message)
+                await asyncio.wait_for(send, self.manager.send_timeout)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"Error sending message to {self.user_uuid}: {e}")
+                self.manager.metrics.send_errors += 1
+                self._drop()
+                return
+            self.manager.metrics.observe_send(time.perf_counter() - start_time)
+
+    def _drop(self):
+        # Stop queueing right away, the socket is closed in the background
+        self.closing = True
+        task = asyncio.create_task(self.manager.disconnect(self.user_uuid, client=self, close_socket=True))
+        # The loop only keeps weak references to tasks
+        self.manager.background_tasks.add(task)
+        task.add_done_callback(self.manager.background_tasks.discard)
+
+    async def close(self, close_socket: bool = False):
+        if self.closed:
+            return
+        self.closed = True
+        if self.writer is not asyncio.current_task():
+            self.writer.cancel()
+        if close_socket:
+            # The client's receive loop ends and it reconnects with a fresh queue
+            try:
+                await asyncio.wait_for(self.websocket.close(), self.manager.send_timeout)
+            except Exception as e:
+                print(f"Error closing WebSocket of {self.user_uuid}: {e}")
+
 
 class ConnectionManager:
-    def __init__(self):
-        self.active_connections: Dict[str, Tuple[WebSocket, str]] = {}
+    def __init__(self, queue_size: int = SEND_QUEUE_SIZE, send_timeout: float = SEND_TIMEOUT,
+                 policy: str = SLOW_CONSUMER_POLICY, tick: float = BROADCAST_TICK):
+        if policy not in ('drop_oldest', 'disconnect'):
+            raise ValueError(f"Unknown slow consumer policy {policy}")
+        self.active_connections: Dict[str, ClientConnection] = {}
         self.total_connections: int = 0
+        # Messages waiting for the next tick, and the position of keyed ones
+        self.tick = tick
+        self._pending: List[Optional[PendingMessage]] = []
+        self._pending_keys: Dict[tuple, int] = {}
+        self._flush_handle: Optional[asyncio.TimerHandle] = None
+        # topic -> uuids subscribed to it, and the uuids without any subscription
+        self.subscribers: Dict[str, Set[str]] = {}
+        self.unsubscribed: Set[str] = set()
+        self.queue_size = queue_size
+        self.send_timeout = send_timeout
+        self.policy = policy
+        self.metrics = BroadcastMetrics()
+        # Disconnects started by a failing writer, held until they finish
+        self.background_tasks: Set[asyncio.Task] = set()
 
     async def connect(self, websocket: WebSocket):
         await websocket.accept()
 
-    async def disconnect(self, user_uuid: str):
-        if user_uuid in self.active_connections:
-            del self.active_connections[user_uuid]
-            self.total_connections -= 1
-            print(f"Disconnected: {user_uuid}. Total connections: {self.total_connections}")
+    async def disconnect(self, user_uuid: str, client: Optional[ClientConnection] = None,
+                         close_socket: bool = False, websocket: Optional[WebSocket] = None):
+        current = self.active_connections.get(user_uuid)
+        # A writer failing, or a receive loop ending, on a replaced connection must not drop the new one
+        if websocket is not None and current is not None and current.websocket is not websocket:
+            return
+        if current is None or (client is not None and current is not client):
+            if client is not None:
+                await client.close(close_socket)
+            return
+        del self.active_connections[user_uuid]
+        self._unindex(current)
+        self.total_connections = len(self.active_connections)
+        await current.close(close_socket)
+        print(f"Disconnected: {user_uuid}. Total connections: {self.total_connections}")
 
-    async def broadcast(self, type: str, data: Any):
-        serialized_data = json.dumps(data) if isinstance(data, dict) else data
-        formatted_message = json.dumps({"type": type, "data": serialized_data})
-        for websocket, _ in self.active_connections.values():
-            try:
-                await websocket.send_text(formatted_message)
-                if type == "stats":
-                    print("broadcast", formatted_message)
+    async def broadcast(self, type: str, data: Any, topics: Optional[Iterable[str]] = None,
+                        path: Optional[str] = None, requires: Optional[str] = None, excludes: Optional[str] = None,
+                        key: Optional[Any] = None):
+        """
+        Send ``data`` to the connections interested in it.
 
-            except Exception as e:
-                print(f"Error sending message: {e}")
+        ``topics`` defaults to the message type. Clients subscribed to any of
+        them, and clients that never subscribed, receive the message; ``path``
+        further limits it to connections registered on that path, and
+        ``requires``/``excludes`` to clients with or without a feature.
+
+        Messages wait for the next tick. A message with a ``key`` replaces a
+        pending message of the same type and key, so only the latest state of
+        e.g. one rider's stats goes out per tick.
+        """
+        self.metrics.broadcasts += 1
+        message = PendingMessage(type, data, list(topics) if topics is not None else [type], path, requires,
+                                 excludes)
+        if key is not None:
+            superseded = self._pending_keys.get((type, key))
+            if superseded is not None:
+                # Sent in place of the older one, after whatever caused it
+                self._pending[superseded] = None
+                self.metrics.coalesced += 1
+            self._pending_keys[(type, key)] = len(self._pending)
+        self._pending.append(message)
+
+        if self.tick <= 0:
+            self.flush()
+        elif self._flush_handle is None:
+            self._flush_handle = asyncio.get_running_loop().call_later(self.tick, self.flush)
+
+    def flush(self):
+        """Deliver the pending messages: one frame per message, or one batch frame per 'batch' client."""
+        self._flush_handle = None
+        pending, self._pending, self._pending_keys = self._pending, [], {}
+        if not pending:
+            return
+        self.metrics.ticks += 1
+        start = time.perf_counter()
+        enqueued = 0
+
+        deliveries: Dict[str, List[int]] = {}
+        for index, message in enumerate(pending):
+            if message is None:
+                continue
+            for client in self._recipients_of(message):
+                deliveries.setdefault(client.user_uuid, []).append(index)
+
+        # Frames are encoded once per format and message (or set of messages) and shared by every recipient
+        frames: Dict[tuple, Union[str, bytes]] = {}
+        for user_uuid, indices in deliveries.items():
+            client = self.active_connections.get(user_uuid)
+            if client is None:
+                continue
+            if 'batch' in client.features and len(indices) > 1:
+                frame_key = (client.format, tuple(indices))
+                if frame_key not in frames:
+                    items = [pending[index].item(client.format) for index in indices]
+                    frames[frame_key] = encode({'type': 'batch', 'data': items}, client.format)
+                # Enqueueing never waits on a socket, delivery happens in each connection's writer
+                client.enqueue(frames[frame_key])
+                enqueued += 1
+                continue
+            for index in indices:
+                frame_key = (client.format, index)
+                if frame_key not in frames:
+                    message = pending[index]
+                    frames[frame_key] = encode_message(message.type, message.data, client.format)
+                client.enqueue(frames[frame_key])
+                enqueued += 1
+        BROADCAST_FLUSH.observe(time.perf_counter() - start)
+        BROADCAST_FRAMES.inc(amount=enqueued)
+
+    def _recipients_of(self, message: 'PendingMessage') -> List[ClientConnection]:
+        recipients = self.recipients(message.topics, message.path)
+        if message.requires is not None:
+            recipients = [client for client in recipients if message.requires in client.features]
+        if message.excludes is not None:
+            recipients = [client for client in recipients if message.excludes not in client.features]
+        return recipients
 
-    async def register(self, websocket: WebSocket, user_uuid: str, path: str):
+    def recipients(self, topics: Iterable[str], path: Optional[str] = None) -> List[ClientConnection]:
+        uuids = set(self.unsubscribed)
+        for topic in topics:
+            uuids |= self.subscribers.get(topic, set())
+        clients = (self.active_connections.get(user_uuid) for user_uuid in uuids)
+        return [client for client in clients if client is not None and (path is None or client.path == path)]
+
+    @staticmethod
+    def topics_for(type: str, *keys: Optional[str]) -> List[str]:
+        """The topic of a message type plus one ``type:key`` topic per key, e.g. ``stats:<rider id>``."""
+        return [type] + [f"{type}:{key}" for key in keys if key]
+
+    def subscribe(self, user_uuid: str, topics: Iterable[str]) -> Set[str]:
+        client = self.active_connections.get(user_uuid)
+        if client is None:
+            return set()
+        self._unindex(client)
+        client.topics |= set(topics)
+        self._index(client)
+        return client.topics
+
+    def unsubscribe(self, user_uuid: str, topics: Iterable[str]) -> Set[str]:
+        client = self.active_connections.get(user_uuid)
+        if client is None:
+            return set()
+        self._unindex(client)
+        client.topics -= set(topics)
+        self._index(client)
+        return client.topics
+
+    def _index(self, client: ClientConnection):
+        if not client.topics:
+            self.unsubscribed.add(client.user_uuid)
+        for topic in client.topics:
+            self.subscribers.setdefault(topic, set()).add(client.user_uuid)
+
+    def _unindex(self, client: ClientConnection):
+        self.unsubscribed.discard(client.user_uuid)
+        for topic in client.topics:
+            uuids = self.subscribers.get(topic)
+            if uuids is not None:
+                uuids.discard(client.user_uuid)
+                if not uuids:
+                    del self.subscribers[topic]
+
+    async def register(self, websocket: WebSocket, user_uuid: str, path: str,
+                       topics: Optional[Iterable[str]] = None, features: Optional[Iterable[str]] = None,
+                       format: Optional[str] = None):
         if user_uuid:
-            self.active_connections[user_uuid] = (websocket, path)
-            self.total_connections += 1  # Increment total connections
+            previous = self.active_connections.get(user_uuid)
+            if previous is not None:
+                self._unindex(previous)
+                await previous.close()
+            client = ClientConnection(websocket, user_uuid, path, self)
+            client.topics = set(topics or ())
+            client.features = set(features or ())
+            if format in FORMATS:
+                client.format = format
+            elif format is not None:
+                print(f"Unknown message format {format} from {user_uuid}, using {client.format}")
+            self.active_connections[user_uuid] = client
+            self._index(client)
+            self.total_connections = len(self.active_connections)
             print(f"Registered {user_uuid} on path {path}. Total connections: {self.total_connections}")
         else:
             print("User UUID not provided for registration")
 
+    @staticmethod
+    async def receive(websocket: WebSocket) -> Any:
+        """Next message from ``websocket``, decoded from a JSON text or MessagePack binary frame."""
+        message = await websocket.receive()
+        if message['type'] == 'websocket.disconnect':
+            raise WebSocketDisconnect(message.get('code', 1000))
+        if message.get('bytes') is not None:
+            return decode(message['bytes'])
+        return decode(message['text'])
+
+    def format_of(self, user_uuid: Optional[str]) -> str:
+        client = self.active_connections.get(user_uuid) if user_uuid else None
+        return client.format if client else DEFAULT_FORMAT
+
+    async def send(self, websocket: WebSocket, payload: Any, format: str = DEFAULT_FORMAT):
+        """Send a direct reply to one client in its format."""
+        frame = encode(payload, format)
+        if isinstance(frame, bytes):
+            await websocket.send_bytes(frame)
+        else:
+            await websocket.send_text(frame)
+
+    def get_metrics(self) -> dict:
+        return self.metrics.to_dict(self.active_connections)
@@ -0,0 +1,107 @@
+import copy
+import math
+from typing import Any, Dict, List, Optional, Tuple
+
+from webserver.serialization import dumps
+
+# Relative difference below which two floats count as unchanged
+FLOAT_TOLERANCE = 1e-9
+
+
+def _escape(key) -> str:
+    return str(key).replace('~', '~0').replace('/', '~1')
+
+
+def _unescape(token: str) -> str:
+    return token.replace('~1', '/').replace('~0', '~')
+
+
+def diff(old: Any, new: Any, path: str = '') -> List[Dict[str, Any]]:
+    """
+    JSON-patch (RFC 6902) operations turning ``old`` into ``new``.
+
+    Dicts are compared key by key; anything else, lists included, is
+    replaced as a whole when it differs. A dict whose operations would
+    encode larger than the dict itself (a describe() table where every
+    number moved) is replaced as a whole too.
+    """
+    if isinstance(old, dict) and isinstance(new, dict):
+        operations = []
+        for key in old:
+            if key not in new:
+                operations.append({'op': 'remove', 'path': f"{path}/{_escape(key)}"})
+        for key, value in new.items():
+            child = f"{path}/{_escape(key)}"
+            if key not in old:
+                operations.append({'op': 'add', 'path': child, 'value': value})
+            else:
+                operations.extend(diff(old[key], value, child))
+        if len(operations) > 1:
+            replacement = [{'op': 'replace', 'path': path, 'value': new}]
+            if _encoded_size(replacement) < _encoded_size(operations):
+                return replacement
+        return operations
+    if type(old) is float and type(new) is float:
+        # Streaming and batch stats disagree in the last bits, that is not a change; NaN stays NaN
+        if math.isclose(old, new, rel_tol=FLOAT_TOLERANCE) or (math.isnan(old) and math.isnan(new)):
+            return []
+    if old == new and type(old) is type(new):
+        return []
+    return [{'op': 'replace', 'path': path, 'value': new}]
+
+
+def _encoded_size(value) -> int:
+    return len(dumps(value))
+
+
+def apply_patch(document: Any, operations: List[Dict[str, Any]]) -> Any:
+    """Apply operations produced by ``diff`` to a copy of ``document``."""
+    document = copy.deepcopy(document)
+    for operation in operations:
+        if not operation['path']:
+            document = copy.deepcopy(operation.get('value'))
+            continue
+        *parents, last = [_unescape(token) for token in operation['path'].split('/')[1:]]
+        target = document
+        for token in parents:
+            target = target[token]
+        if operation['op'] == 'remove':
+            del target[last]
+        else:
+            target[last] = copy.deepcopy(operation['value'])
+    return document
+
+
+class DeltaTracker:
+    """
+    Last broadcast state and sequence number per key, e.g. per rider.
+
+    Every ``update`` bumps the key's sequence number; a client holding
+    ``seq - 1`` applies the patch, any other client asks for a snapshot.
+    """
+
+    def __init__(self):
+        self._states: Dict[str, Tuple[int, Any]] = {}
+
+    def __contains__(self, key) -> bool:
+        return key in self._states
+
+    def update(self, key: str, state: Any) -> Tuple[int, List[Dict[str, Any]]]:
+        previous = self._states.get(key)
+        state = copy.deepcopy(state)
+        if previous is None:
+            # Nothing sent yet for this key, the patch carries the whole document
+            sequence, operations = 1, [{'op': 'replace', 'path': '', 'value': state}]
+        else:
+            sequence, operations = previous[0] + 1, diff(previous[1], state)
+        self._states[key] = (sequence, state)
+        return sequence, operations
+
+    def snapshot(self, key: str) -> Optional[Tuple[int, Any]]:
+        return self._states.get(key)
+
+    def seed(self, key: str, state: Any) -> Tuple[int, Any]:
+        """Start tracking ``key`` at sequence 0 without broadcasting, for snapshots of untracked keys."""
+        if key not in self._states:
+            self._states[key] = (0, copy.deepcopy(state))
+        return self._states[key]
@@ -0,0 +1,295 @@
+import asyncio
+import os
+import time
+from collections import deque
+from datetime import datetime
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from bson import ObjectId
+from pymongo.errors import BulkWriteError, ConnectionFailure
+
+from database.base_models import ScorecardBase
+from database.CWA_Events import Scorecard
+from database.executor import run_blocking
+from webserver.tracing import TRACER, SpanContext
+
+# Scorecards waiting to be written before submissions are refused
+INGEST_QUEUE_SIZE = int(os.getenv('CABLEOPS_INGEST_QUEUE_SIZE', 10000))
+# Most scorecards written by one insert_many
+INGEST_BATCH_SIZE = int(os.getenv('CABLEOPS_INGEST_BATCH_SIZE', 100))
+# Seconds a rider's stats wait for more scorecards before they are recomputed and broadcast
+STATS_DEBOUNCE = float(os.getenv('CABLEOPS_STATS_DEBOUNCE', 0.25))
+# Seconds between attempts to write a batch while Mongo cannot be reached, doubling up to the maximum
+RETRY_DELAY = 0.5
+MAX_RETRY_DELAY = 10.0
+# Scorecards Mongo refused for good, kept for /api/contest/ingestion
+DEAD_LETTER_SIZE = int(os.getenv('CABLEOPS_INGEST_DEAD_LETTER_SIZE', 1000))
+
+DUPLICATE_KEY = 11000
+
+
+class IngestionFull(Exception):
+    pass
+
+
+class IngestionMetrics:
+    """Queue depth, write batches and submit-to-persisted lag of the scorecard pipeline."""
+
+    def __init__(self, window: int = 1000):
+        self.submitted = 0
+        self.written = 0
+        self.batches = 0
+        self.retries = 0
+        self.rejected = 0
+        self.stats_recomputes = 0
+        self.stats_coalesced = 0
+        self.dead_lettered = 0
+        self.lags = deque(maxlen=window)
+        # {id, rider, error, at} of the scorecards that could not be written, most recent last
+        self.dead_letters = deque(maxlen=DEAD_LETTER_SIZE)
+
+    def lag_percentile(self, q: float) -> Optional[float]:
+        if not self.lags:
+            return None
+        ordered = sorted(self.lags)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+    def to_dict(self, queue_depth: int, oldest_age: Optional[float], stats_pending: int) -> dict:
+        return {
+            'queue_depth': queue_depth,
+            'oldest_queued_ms': self._millis(oldest_age),
+            'submitted': self.submitted,
+            'written': self.written,
+            'batches': self.batches,
+            'retries': self.retries,
+            'rejected': self.rejected,
+            'stats_pending': stats_pending,
+            'stats_recomputes': self.stats_recomputes,
+            'stats_coalesced': self.stats_coalesced,
+            'dead_lettered': self.dead_lettered,
+            'dead_letters': list(self.dead_letters),
+            'persist_lag_ms': {
+                'p50': self._millis(self.lag_percentile(0.5)),
+                'p99': self._millis(self.lag_percentile(0.99)),
+                'max': self._millis(max(self.lags, default=None)),
+            },
+        }
+
+    @staticmethod
+    def _millis(seconds: Optional[float]) -> Optional[float]:
+        return None if seconds is None else round(seconds * 1000, 3)
+
+
+class ScorecardIngestion:
+    """
+    Write-behind pipeline for judged scorecards.
+
+    ``submit`` gives the scorecard its ObjectId, adds it to the server memory
+    and queues it, so the judge gets an answer without waiting on Mongo. A
+    writer task persists the queue with ``insert_many`` batches. Once a
+    rider's scorecards are written, the rider's stats are folded, saved and
+    published ``debounce`` seconds later, once per burst of scorecards
+    rather than once per scorecard.
+    """
+
+    def __init__(self, memory, publish_stats: Callable[[str, Dict[str, Any]], Awaitable[Any]],
+                 queue_size: int = INGEST_QUEUE_SIZE, batch_size: int = INGEST_BATCH_SIZE,
+                 debounce: float = STATS_DEBOUNCE):
+        self.memory = memory
+        self.publish_stats = publish_stats
+        self.batch_size = batch_size
+        self.debounce = debounce
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+        self.metrics = IngestionMetrics()
+        self._writer: Optional[asyncio.Task] = None
+        # (enqueued_at, scorecard, trace) of the queued scorecards, oldest first, for the lag metrics
+        self._queued: deque = deque()
+        # rider -> written scorecards not folded into the stats yet, and the timers flushing them
+        self._unfolded: Dict[str, List[ScorecardBase]] = {}
+        # rider -> trace of the latest of those scorecards, the recompute is recorded under it
+        self._traces: Dict[str, Optional[SpanContext]] = {}
+        self._stats_timers: Dict[str, asyncio.TimerHandle] = {}
+        self._recomputing: Dict[str, asyncio.Task] = {}
+
+    def submit(self, scorecard: ScorecardBase) -> str:
+        """Accept ``scorecard`` and return its id; it is written and counted in the stats shortly after."""
+        if self.queue.full():
+            self.metrics.rejected += 1
+            raise IngestionFull(f"{self.queue.qsize()} scorecards are waiting to be written")
+        if not scorecard.id:
+            scorecard.id = str(ObjectId())
+        if scorecard.date is None or 'date' not in scorecard.__fields_set__:
+            # The model's default is the import time; stamp it here so memory and Mongo agree,
+            # at the millisecond precision Mongo keeps
+            now = datetime.now()
+            scorecard.date = now.replace(microsecond=now.microsecond // 1000 * 1000)
+        item = (time.perf_counter(), scorecard, TRACER.current())
+        self.queue.put_nowait(item)
+        self._queued.append(item)
+        self.metrics.submitted += 1
+        self.memory.add_scorecard(scorecard)
+        self._ensure_writer()
+        return scorecard.id
+
+    def _ensure_writer(self):
+        if self._writer is None or self._writer.done():
+            self._writer = asyncio.get_running_loop().create_task(self._write_forever())
+
+    async def _write_forever(self):
+        while True:
+            batch = [await self.queue.get()]
+            while len(batch) < self.batch_size and not self.queue.empty():
+                batch.append(self.queue.get_nowait())
+            now, now_ns = time.perf_counter(), time.time_ns()
+            for enqueued_at, scorecard, trace in batch:
+                TRACER.record('ingest.queue', now_ns - int((now - enqueued_at) * 1e9), trace,
+                              rider_id=scorecard.rider or '')
+            try:
+                await self._write(batch)
+            finally:
+                for _ in batch:
+                    self.queue.task_done()
+
+    async def _write(self, batch: List[Tuple[float, ScorecardBase, Optional[SpanContext]]]):
+        started_ns = time.time_ns()
+        scorecards = [scorecard for _, scorecard, _ in batch]
+        errors: Dict[str, str] = {}
+        try:
+            written = await self._insert(scorecards)
+        except Exception as e:
+            # Mongo refused the batch for good, likely over one scorecard: write them one at a time
+            print(f"Error writing {len(batch)} scorecards, writing them one by one: {e}")
+            written = set()
+            for scorecard in scorecards:
+                try:
+                    written |= await self._insert([scorecard])
+                except Exception as e:
+                    errors[scorecard.id] = str(e)
+
+        now = time.perf_counter()
+        self.metrics.batches += 1
+        for enqueued_at, scorecard, trace in batch:
+            self._queued.popleft()
+            self.metrics.lags.append(now - enqueued_at)
+            # One span per scorecard, each trace shows the batch write it waited on
+            TRACER.record('ingest.write', started_ns, trace, rider_id=scorecard.rider or '',
+                          batch_size=len(batch), written=scorecard.id in written)
+            if scorecard.id not in written:
+                self._dead_letter(scorecard, errors.get(scorecard.id, 'Failed validation'))
+                continue
+            self.metrics.written += 1
+            if scorecard.rider:
+                self._unfolded.setdefault(scorecard.rider, []).append(scorecard)
+                self._traces[scorecard.rider] = trace
+                self._schedule_stats(scorecard.rider)
+
+    async def _insert(self, scorecards: List[ScorecardBase]) -> set:
+        delay = RETRY_DELAY
+        while True:
+            try:
+                return await run_blocking(insert_scorecards, scorecards)
+            except ConnectionFailure as e:
+                # Judges were already told the scorecards are accepted, wait for Mongo to come back
+                self.metrics.retries += 1
+                print(f"Mongo unreachable writing {len(scorecards)} scorecards, retrying in {delay:.1f}s: {e}")
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, MAX_RETRY_DELAY)
+
+    def _dead_letter(self, scorecard: ScorecardBase, error: str):
+        # The scorecard stays in the server memory until the next reload from Mongo
+        print(f"Scorecard {scorecard.id} of rider {scorecard.rider} was not written: {error}")
+        self.metrics.dead_lettered += 1
+        self.metrics.dead_letters.append({'id': scorecard.id, 'rider': scorecard.rider, 'error': error,
+                                          'at': time.time()})
+
+    def _schedule_stats(self, rider_id: str):
+        if rider_id in self._stats_timers:
+            # The pending recompute will include this scorecard
+            self.metrics.stats_coalesced += 1
+            return
+        loop = asyncio.get_running_loop()
+        self._stats_timers[rider_id] = loop.call_later(self.debounce, self._start_recompute, rider_id)
+
+    def _start_recompute(self, rider_id: str):
+        del self._stats_timers[rider_id]
+        if rider_id in self._recomputing:
+            # One recompute per rider at a time, try again after this one
+            self._schedule_stats(rider_id)
+            return
+        task = asyncio.get_running_loop().create_task(self._recompute(rider_id))
+        self._recomputing[rider_id] = task
+        task.add_done_callback(lambda _: self._recomputing.pop(rider_id, None))
+
+    async def _recompute(self, rider_id: str):
+        scorecards = self._unfolded.pop(rider_id, [])
+        trace = self._traces.pop(rider_id, None)
+        if not scorecards:
+            return
+        with TRACER.span('stats.recompute', trace, rider_id=rider_id, scorecards=len(scorecards)) as span:
+            try:
+                engine = self.memory.stats_engine
+                if rider_id not in engine:
+                    # The rider's history already holds these scorecards, describe it in one pass
+                    with TRACER.span('stats.load', rider_id=rider_id):
+                        stats = await run_blocking(engine.rebuild, rider_id)
+                else:
+                    with TRACER.span('stats.fold', rider_id=rider_id):
+                        for scorecard in scorecards:
+                            stats = engine.fold(scorecard)
+                self.metrics.stats_recomputes += 1
+                await self.publish_stats(rider_id, stats)
+            except Exception as e:
+                span.fail(str(e))
+                print(f"Error updating stats of rider {rider_id}: {e}")
+
+    async def drain(self, timeout: float = 10.0):
+        """Write the queued scorecards and fold the pending stats, e.g. before shutting down."""
+        try:
+            await asyncio.wait_for(self._drain(), timeout)
+        except asyncio.TimeoutError:
+            print(f"{self.queue.qsize()} scorecards were not written and {len(self._unfolded)} riders' stats "
+                  f"not updated before shutdown")
+
+    async def _drain(self):
+        await self.queue.join()
+        # The debounce timers would fire after the snapshot, run their recomputes now
+        for timer in self._stats_timers.values():
+            timer.cancel()
+        self._stats_timers.clear()
+        await asyncio.gather(*self._recomputing.values(), return_exceptions=True)
+        for rider_id in list(self._unfolded):
+            await self._recompute(rider_id)
+
+    def get_metrics(self) -> dict:
+        oldest_age = time.perf_counter() - self._queued[0][0] if self._queued else None
+        return self.metrics.to_dict(self.queue.qsize(), oldest_age, len(self._unfolded))
+
+
+def insert_scorecards(scorecards: List[ScorecardBase]) -> set:
+    """
+    Write ``scorecards`` with one unordered ``insert_many``, blocking.
+
+    Returns the ids now stored: a retried batch finds part of it already
+    written (duplicate key), which counts as written; invalid scorecards
+    are reported and left out.
+    """
+    documents = []
+    for scorecard in scorecards:
+        document = Scorecard(**dict(scorecard.dict(exclude_unset=True), id=scorecard.id))
+        try:
+            document.validate()
+        except Exception as e:
+            print(f"Invalid scorecard {scorecard.id}: {e}")
+            continue
+        documents.append(document.to_mongo())
+    if not documents:
+        return set()
+
+    ids = {str(document['_id']) for document in documents}
+    try:
+        Scorecard._get_collection().insert_many(documents, ordered=False)
+    except BulkWriteError as e:
+        errors = e.details.get('writeErrors', [])
+        if any(error.get('code') != DUPLICATE_KEY for error in errors):
+            raise
+    return ids
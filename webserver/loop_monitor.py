@@ -0,0 +1,147 @@
+import asyncio
+import os
+import sys
+import threading
+import time
+import traceback
+from collections import deque
+from datetime import datetime, timezone
+from typing import List, Optional
+
+from webserver.metrics import LOOP_LAG
+
+# Milliseconds the loop may be held by one callback before its stack is recorded
+SLOW_CALLBACK_MS = float(os.getenv('CABLEOPS_SLOW_CALLBACK_MS', 100))
+# Stalls kept for /api/admin/loop, the oldest are dropped first
+STALL_BUFFER_SIZE = int(os.getenv('CABLEOPS_STALL_BUFFER_SIZE', 100))
+# Seconds between heartbeats of the loop, and between checks of the watchdog
+HEARTBEAT_INTERVAL = 0.05
+# Frames kept per recorded stack, innermost last
+STACK_DEPTH = 40
+
+
+class Stall:
+    """One period during which the loop did not run its heartbeat."""
+    __slots__ = ('beat', 'started_at', 'duration', 'stack', 'ongoing')
+
+    def __init__(self, beat: float, started_at: float, duration: float, stack: List[str]):
+        # The heartbeat the loop missed, the stall ends when a newer one happens
+        self.beat = beat
+        self.started_at = started_at
+        self.duration = duration
+        self.stack = stack
+        self.ongoing = True
+
+    def to_dict(self) -> dict:
+        return {
+            'started_at': datetime.fromtimestamp(self.started_at, timezone.utc).isoformat(timespec='milliseconds'),
+            'duration_ms': round(self.duration * 1000, 1),
+            'ongoing': self.ongoing,
+            'stack': self.stack,
+        }
+
+
+class LoopMonitor:
+    """
+    Event loop lag sampler and slow callback detector.
+
+    A heartbeat task on the loop wakes every ``interval`` and records how
+    late it woke in the lag histogram. A watchdog thread checks the
+    heartbeat; when the loop has not beaten for ``threshold`` seconds, the
+    loop thread is busy in a single callback, and the watchdog records that
+    thread's current stack. Stalls go to a ring buffer for the admin routes.
+    """
+
+    def __init__(self, threshold: float = SLOW_CALLBACK_MS / 1000, interval: float = HEARTBEAT_INTERVAL,
+                 size: int = STALL_BUFFER_SIZE):
+        self.threshold = threshold
+        self.interval = interval
+        self.stalls: deque = deque(maxlen=size)
+        self.lags: deque = deque(maxlen=1000)
+        self._loop_thread: Optional[int] = None
+        self._last_beat = time.perf_counter()
+        self._current: Optional[Stall] = None
+        self._heartbeat: Optional[asyncio.Task] = None
+        self._watchdog: Optional[threading.Thread] = None
+        self._stopped = threading.Event()
+
+    @property
+    def running(self) -> bool:
+        return self._heartbeat is not None and not self._heartbeat.done()
+
+    async def start(self):
+        """Start monitoring the running loop, from a startup handler."""
+        if self.running:
+            return
+        self._loop_thread = threading.get_ident()
+        self._last_beat = time.perf_counter()
+        self._stopped.clear()
+        self._heartbeat = asyncio.create_task(self._beat())
+        self._watchdog = threading.Thread(target=self._watch, name='cableops-loop-watchdog', daemon=True)
+        self._watchdog.start()
+
+    async def stop(self):
+        self._stopped.set()
+        if self._heartbeat is not None:
+            self._heartbeat.cancel()
+
+    async def _beat(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            expected = loop.time() + self.interval
+            await asyncio.sleep(self.interval)
+            lag = max(0.0, loop.time() - expected)
+            self.lags.append(lag)
+            LOOP_LAG.observe(lag)
+            self._last_beat = time.perf_counter()
+
+    def _watch(self):
+        while not self._stopped.wait(self.interval):
+            last_beat = self._last_beat
+            blocked = time.perf_counter() - last_beat - self.interval
+            stall = self._current
+            if stall is not None and stall.beat != last_beat:
+                stall.ongoing = False
+                stall = self._current = None
+            if blocked < self.threshold:
+                continue
+            if stall is not None:
+                # Still the same stall, only its duration grows
+                stall.duration = blocked
+                continue
+            self._current = Stall(last_beat, time.time() - blocked, blocked, self._loop_stack())
+            self.stalls.append(self._current)
+            print(f"Event loop blocked for {blocked * 1000:.0f} ms at {self._current.stack[-1]}")
+
+    def _loop_stack(self) -> List[str]:
+        frame = sys._current_frames().get(self._loop_thread)
+        if frame is None:
+            return ['<loop thread not found>']
+        return [f"{entry.filename}:{entry.lineno} in {entry.name}: {entry.line}"
+                for entry in traceback.extract_stack(frame, limit=STACK_DEPTH)]
+
+    def lag_percentile(self, q: float) -> Optional[float]:
+        if not self.lags:
+            return None
+        ordered = sorted(self.lags)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+    def report(self) -> dict:
+        def millis(seconds: Optional[float]) -> Optional[float]:
+            return None if seconds is None else round(seconds * 1000, 3)
+
+        return {
+            'running': self.running,
+            'threshold_ms': self.threshold * 1000,
+            'lag_ms': {
+                'p50': millis(self.lag_percentile(0.5)),
+                'p99': millis(self.lag_percentile(0.99)),
+                'max': millis(max(self.lags, default=None)),
+            },
+            # Most recent first
+            'stalls': [stall.to_dict() for stall in reversed(self.stalls)],
+        }
+
+    def clear(self):
+        self.stalls.clear()
+        self.lags.clear()
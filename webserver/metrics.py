@@ -0,0 +1,259 @@
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+from pymongo import monitoring
+
+# Upper bounds of the latency histograms, in seconds
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# WebSocket message types with their own series, anything else a client sends is counted as 'other'
+WEBSOCKET_MESSAGE_TYPES = ('connect', 'subscribe', 'unsubscribe', 'carrier', 'scorecard', 'stats_snapshot', 'ping')
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def _escape(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(names: Tuple[str, ...], values: Tuple, extra: str = '') -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _number(value: float) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    type = 'untyped'
+
+    def __init__(self, name: str, help: str, labels: Iterable[str] = ()):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(labels)
+        # Observations come from the loop and from database pool threads
+        self._lock = threading.Lock()
+
+    def header(self) -> List[str]:
+        return [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} {self.type}']
+
+    def render(self) -> List[str]:
+        raise NotImplementedError
+
+
+class Counter(Metric):
+    type = 'counter'
+
+    def __init__(self, name: str, help: str, labels: Iterable[str] = ()):
+        super().__init__(name, help, labels)
+        self._values: Dict[Tuple, float] = {}
+
+    def inc(self, *labels, amount: float = 1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self) -> List[str]:
+        with self._lock:
+            values = sorted(self._values.items())
+        return self.header() + [f'{self.name}{_labels(self.label_names, key)} {_number(value)}'
+                                for key, value in values]
+
+
+class Gauge(Metric):
+    """A gauge read when the metrics are scraped."""
+    type = 'gauge'
+
+    def __init__(self, name: str, help: str, read: Callable[[], Optional[float]]):
+        super().__init__(name, help)
+        self.read = read
+
+    def render(self) -> List[str]:
+        value = self.read()
+        return self.header() + ([] if value is None else [f'{self.name} {_number(value)}'])
+
+
+class Histogram(Metric):
+    type = 'histogram'
+
+    def __init__(self, name: str, help: str, labels: Iterable[str] = (), buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(buckets)
+        # labels -> (count per bucket, +Inf last; sum)
+        self._series: Dict[Tuple, Tuple[List[int], List[float]]] = {}
+
+    def observe(self, seconds: float, *labels):
+        position = bisect.bisect_left(self.buckets, seconds)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = ([0] * (len(self.buckets) + 1), [0.0])
+            series[0][position] += 1
+            series[1][0] += seconds
+
+    @contextmanager
+    def time(self, *labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, *labels)
+
+    def render(self) -> List[str]:
+        with self._lock:
+            series = sorted((key, (list(counts), total[0])) for key, (counts, total) in self._series.items())
+        lines = self.header()
+        for key, (counts, total) in series:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                bucket_labels = _labels(self.label_names, key, f'le="{_number(bound)}"')
+                lines.append(f'{self.name}_bucket{bucket_labels} {cumulative}')
+            lines.append(f'{self.name}_sum{_labels(self.label_names, key)} {_number(total)}')
+            lines.append(f'{self.name}_count{_labels(self.label_names, key)} {cumulative}')
+        return lines
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self.metrics: Dict[str, Metric] = {}
+
+    def register(self, metric: Metric) -> Metric:
+        self.metrics[metric.name] = metric
+        return metric
+
+    def render(self) -> str:
+        lines = []
+        for metric in self.metrics.values():
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = MetricsRegistry()
+
+HTTP_REQUESTS = REGISTRY.register(Counter(
+    'cableops_http_requests_total', 'HTTP requests by route and status.', ('method', 'route', 'status')))
+HTTP_ERRORS = REGISTRY.register(Counter(
+    'cableops_http_request_errors_total', 'HTTP requests answered with a 5xx or an exception.', ('method', 'route')))
+HTTP_LATENCY = REGISTRY.register(Histogram(
+    'cableops_http_request_duration_seconds', 'HTTP request latency by route.', ('method', 'route')))
+WEBSOCKET_MESSAGES = REGISTRY.register(Counter(
+    'cableops_websocket_messages_total', 'WebSocket messages handled by type.', ('type',)))
+WEBSOCKET_ERRORS = REGISTRY.register(Counter(
+    'cableops_websocket_message_errors_total', 'WebSocket messages answered with an error.', ('type',)))
+WEBSOCKET_LATENCY = REGISTRY.register(Histogram(
+    'cableops_websocket_message_duration_seconds', 'Time to handle a WebSocket message by type.', ('type',)))
+BROADCAST_FLUSH = REGISTRY.register(Histogram(
+    'cableops_broadcast_flush_duration_seconds', 'Time to encode and enqueue one tick of broadcasts.'))
+BROADCAST_FRAMES = REGISTRY.register(Counter(
+    'cableops_broadcast_frames_total', 'Frames enqueued to WebSocket clients by broadcasts.'))
+MONGO_LATENCY = REGISTRY.register(Histogram(
+    'cableops_mongo_command_duration_seconds', 'Mongo command latency by command.', ('command',)))
+MONGO_ERRORS = REGISTRY.register(Counter(
+    'cableops_mongo_command_errors_total', 'Failed Mongo commands by command.', ('command',)))
+# Sampled by webserver.loop_monitor
+LOOP_LAG = REGISTRY.register(Histogram(
+    'cableops_event_loop_lag_seconds', 'Delay of the event loop waking up for a timer.'))
+
+
+class MetricsMiddleware:
+    """
+    Pure ASGI middleware recording the count, errors and latency of every HTTP request.
+
+    Requests are labelled with the route template (``/api/riders/profile/{rider_id}``)
+    rather than the path, so ids do not create new series.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self._templates: Dict[Callable, str] = {}
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+
+        status = 500
+        start = time.perf_counter()
+
+        async def send_with_status(message):
+            nonlocal status
+            if message['type'] == 'http.response.start':
+                status = message['status']
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        except Exception:
+            status = 500
+            raise
+        finally:
+            method, route = scope['method'], self.route_of(scope)
+            HTTP_LATENCY.observe(time.perf_counter() - start, method, route)
+            HTTP_REQUESTS.inc(method, route, status)
+            if status >= 500:
+                HTTP_ERRORS.inc(method, route)
+
+    def route_of(self, scope) -> str:
+        # The router stores the matched endpoint in the scope, map it back to its path template
+        endpoint = scope.get('endpoint')
+        if endpoint is None:
+            return 'unmatched'
+        template = self._templates.get(endpoint)
+        if template is None:
+            for route in getattr(scope.get('app'), 'routes', ()):
+                if getattr(route, 'endpoint', None) is endpoint:
+                    template = route.path
+                    break
+            else:
+                template = getattr(endpoint, '__name__', 'unknown')
+            self._templates[endpoint] = template
+        return template
+
+
+class MessageObservation:
+    __slots__ = ('failed',)
+
+    def __init__(self):
+        self.failed = False
+
+
+@contextmanager
+def observe_websocket_message(message_type: Optional[str]):
+    """Time the handling of one WebSocket message; set ``failed`` on the yielded observation for error replies."""
+    message_type = message_type if message_type in WEBSOCKET_MESSAGE_TYPES else 'other'
+    observation = MessageObservation()
+    start = time.perf_counter()
+    try:
+        yield observation
+    except BaseException:
+        observation.failed = True
+        raise
+    finally:
+        WEBSOCKET_LATENCY.observe(time.perf_counter() - start, message_type)
+        WEBSOCKET_MESSAGES.inc(message_type)
+        if observation.failed:
+            WEBSOCKET_ERRORS.inc(message_type)
+
+
+class MongoCommandListener(monitoring.CommandListener):
+    """Times every command pymongo sends, from whichever thread sends it."""
+
+    def started(self, event):
+        pass
+
+    def succeeded(self, event):
+        MONGO_LATENCY.observe(event.duration_micros / 1e6, event.command_name)
+
+    def failed(self, event):
+        MONGO_LATENCY.observe(event.duration_micros / 1e6, event.command_name)
+        MONGO_ERRORS.inc(event.command_name)
+
+
+# Applies to the clients connected after this import; web_server is imported before the database connects
+monitoring.register(MongoCommandListener())
@@ -0,0 +1,157 @@
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from typing import Dict, List, Optional, Tuple
+
+# Longest profile one request may ask for, in seconds
+MAX_PROFILE_SECONDS = float(os.getenv('CABLEOPS_MAX_PROFILE_SECONDS', 120))
+# Default seconds between samples, 100 Hz
+SAMPLE_INTERVAL = 0.01
+# Frames kept per sampled stack, counted from the innermost one
+STACK_DEPTH = 128
+FORMATS = ('collapsed', 'speedscope')
+
+# Paths are shown relative to the project, and site-packages paths from the package on
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+
+# (function, file, line of its definition)
+Frame = Tuple[str, str, int]
+
+
+class ProfilerBusy(Exception):
+    pass
+
+
+def _short_path(filename: str) -> str:
+    if filename.startswith(PROJECT_ROOT + os.sep):
+        return filename[len(PROJECT_ROOT) + 1:]
+    _, separator, inside = filename.rpartition('site-packages' + os.sep)
+    return inside if separator else filename
+
+
+class Profile:
+    """Stacks sampled across every thread, counted per thread and stack."""
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self.started_at = time.time()
+        self.duration = 0.0
+        self.samples = 0
+        # (thread name, stack from the outermost frame) -> times seen
+        self.stacks: Counter = Counter()
+
+    def collapsed(self) -> str:
+        """Brendan Gregg's folded format, one ``thread;outer;...;inner count`` line per stack."""
+        lines = []
+        for (thread, stack), count in self.stacks.most_common():
+            names = [thread] + [f"{name} ({filename}:{line})" for name, filename, line in stack]
+            lines.append(f"{';'.join(name.replace(';', ':') for name in names)} {count}")
+        return '\n'.join(lines) + '\n'
+
+    def speedscope(self) -> dict:
+        """A speedscope file with one sampled profile per thread, weighted in seconds."""
+        frames: List[dict] = []
+        frame_index: Dict[Frame, int] = {}
+        profiles: Dict[str, dict] = {}
+        for (thread, stack), count in self.stacks.items():
+            indexes = []
+            for frame in stack:
+                index = frame_index.get(frame)
+                if index is None:
+                    index = frame_index[frame] = len(frames)
+                    frames.append({'name': frame[0], 'file': frame[1], 'line': frame[2]})
+                indexes.append(index)
+            profile = profiles.get(thread)
+            if profile is None:
+                profile = profiles[thread] = {
+                    'type': 'sampled', 'name': thread, 'unit': 'seconds',
+                    'startValue': 0, 'endValue': 0, 'samples': [], 'weights': [],
+                }
+            weight = count * self.interval
+            profile['samples'].append(indexes)
+            profile['weights'].append(weight)
+            profile['endValue'] += weight
+        return {
+            '$schema': 'https://www.speedscope.app/file-format-schema.json',
+            'name': f"cableops {time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(self.started_at))}",
+            'exporter': 'cableops',
+            'activeProfileIndex': 0,
+            'shared': {'frames': frames},
+            'profiles': sorted(profiles.values(), key=lambda profile: -profile['endValue']),
+        }
+
+
+class SamplingProfiler:
+    """
+    Statistical profiler for the running process.
+
+    Nothing runs until a profile is asked for. ``run`` then starts a thread
+    that reads the stack of every other thread (the event loop, database
+    pool, UI, motor, sensor and camera threads) with ``sys._current_frames``
+    every ``interval`` seconds, for ``seconds``. Samples are wall clock:
+    threads waiting on a lock or a socket are counted where they wait.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.current: Optional[Profile] = None
+        self._code_frames: Dict[object, Frame] = {}
+
+    @property
+    def running(self) -> bool:
+        return self.current is not None
+
+    def run(self, seconds: float, interval: float = SAMPLE_INTERVAL) -> Profile:
+        """Sample every thread for ``seconds``, blocking; one profile runs at a time."""
+        if not 0 < seconds <= MAX_PROFILE_SECONDS:
+            raise ValueError(f"seconds must be between 0 and {MAX_PROFILE_SECONDS:g}")
+        if not 0.001 <= interval <= 1:
+            raise ValueError("interval must be between 1 and 1000 ms")
+        with self._lock:
+            if self.current is not None:
+                raise ProfilerBusy("A profile is already running")
+            profile = self.current = Profile(interval)
+        try:
+            self._sample(profile, seconds)
+        finally:
+            self.current = None
+            self._code_frames.clear()
+        return profile
+
+    def _sample(self, profile: Profile, seconds: float):
+        own = threading.get_ident()
+        start = time.perf_counter()
+        deadline = start + seconds
+        next_sample = start
+        while True:
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+                profile.stacks[(names.get(ident, f"thread-{ident}"), self._stack(frame))] += 1
+            profile.samples += 1
+
+            next_sample += profile.interval
+            now = time.perf_counter()
+            if next_sample >= deadline:
+                break
+            if next_sample > now:
+                time.sleep(next_sample - now)
+            else:
+                # Sampling fell behind, skip the missed ticks rather than bursting
+                next_sample = now
+        profile.duration = time.perf_counter() - start
+
+    def _stack(self, frame) -> Tuple[Frame, ...]:
+        stack = []
+        while frame is not None and len(stack) < STACK_DEPTH:
+            code = frame.f_code
+            entry = self._code_frames.get(code)
+            if entry is None:
+                entry = self._code_frames[code] = (code.co_name, _short_path(code.co_filename), code.co_firstlineno)
+            stack.append(entry)
+            frame = frame.f_back
+        stack.reverse()
+        return tuple(stack)
@@ -0,0 +1,67 @@
+import hashlib
+from collections import OrderedDict
+from typing import Any, Callable, Hashable, Optional, Tuple
+
+from fastapi import Request, Response
+
+from webserver.serialization import FastJSONResponse, dumps
+
+# Encoded responses kept per path and query string, the least recently used is evicted first
+CACHE_SIZE = 64
+
+
+def etag_for(body: bytes) -> str:
+    """Strong ETag of an encoded body, stable across restarts because it hashes content, not versions."""
+    return f'"{hashlib.blake2b(body, digest_size=16).hexdigest()}"'
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == '*':
+        return True
+    # If-None-Match uses the weak comparison, a W/ prefix does not prevent a match
+    candidates = (candidate.strip() for candidate in if_none_match.split(','))
+    return any(candidate.removeprefix('W/') == etag for candidate in candidates)
+
+
+class ResponseCache:
+    """
+    Encoded response bodies and ETags keyed by request and memory version.
+
+    A read endpoint passes the ``version`` of every IndexedStore it reads.
+    While those versions stand, repeated polls reuse the bytes encoded the
+    first time, and clients sending the ETag back get an empty 304.
+    """
+
+    def __init__(self, size: int = CACHE_SIZE):
+        self.size = size
+        self._entries: OrderedDict[Hashable, Tuple[Hashable, bytes, str]] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def respond(self, request: Request, version: Hashable, build: Callable[[], Any]) -> Response:
+        key = (request.url.path, str(request.query_params))
+        entry = self._entries.get(key)
+        if entry is not None and entry[0] == version:
+            self.hits += 1
+            self._entries.move_to_end(key)
+        else:
+            self.misses += 1
+            body = dumps(build())
+            entry = self._entries[key] = (version, body, etag_for(body))
+            self._entries.move_to_end(key)
+            if len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+
+        _, body, etag = entry
+        headers = {'ETag': etag, 'Cache-Control': 'no-cache'}
+        if etag_matches(request.headers.get('if-none-match'), etag):
+            return Response(status_code=304, headers=headers)
+        return _EncodedResponse(body, headers=headers)
+
+
+class _EncodedResponse(FastJSONResponse):
+    # The body is already encoded, skip rendering it again
+    def render(self, content: Any) -> bytes:
+        return content
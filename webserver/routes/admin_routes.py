@@ -0,0 +1,83 @@
+import asyncio
+import os
+import secrets
+from typing import Optional
+
+from fastapi import APIRouter, Depends, Header, HTTPException, Request
+from fastapi.responses import PlainTextResponse
+
+from webserver.profiler import FORMATS, ProfilerBusy, SamplingProfiler
+from webserver.serialization import FastJSONResponse
+from webserver.tracing import TRACE_EXPORT_PATH, TRACER
+
+# When set, admin routes require this value in the X-Admin-Token header, otherwise they only answer local clients
+ADMIN_TOKEN = os.getenv('CABLEOPS_ADMIN_TOKEN')
+LOOPBACK_HOSTS = ('127.0.0.1', '::1', 'localhost')
+
+
+class AdminRoutes:
+    def __init__(self, connection_manager, server_memory, loop_monitor):
+        self.router = APIRouter(tags=["Admin"], dependencies=[Depends(self.authorize)])
+        self.manager = connection_manager
+        self.memory = server_memory
+        self.loop_monitor = loop_monitor
+        self.profiler = SamplingProfiler()
+        self.define_routes()
+
+    def define_routes(self):
+        @self.router.get("/loop")
+        async def get_loop_report() -> dict:
+            # Event loop lag and the stacks of the callbacks that held it longest
+            return {"data": self.loop_monitor.report()}
+
+        @self.router.delete("/loop/stalls")
+        async def clear_loop_report() -> dict:
+            self.loop_monitor.clear()
+            return {"success": True}
+
+        @self.router.get("/profile")
+        async def profile(seconds: float = 10, interval_ms: float = 10, format: str = 'collapsed'):
+            """
+            Sample the stacks of every thread in the process for ``seconds``.
+
+            ``collapsed`` returns folded stacks for flamegraph.pl or speedscope,
+            ``speedscope`` returns a speedscope JSON file with one profile per thread.
+            """
+            if format not in FORMATS:
+                raise HTTPException(status_code=400, detail=f"format must be one of {', '.join(FORMATS)}")
+            try:
+                # The sampler sleeps between samples in its own thread, the loop keeps serving
+                result = await asyncio.to_thread(self.profiler.run, seconds, interval_ms / 1000)
+            except ValueError as e:
+                raise HTTPException(status_code=400, detail=str(e))
+            except ProfilerBusy as e:
+                raise HTTPException(status_code=409, detail=str(e))
+            if format == 'speedscope':
+                return FastJSONResponse(result.speedscope())
+            return PlainTextResponse(result.collapsed())
+
+        @self.router.get("/traces")
+        async def get_traces(limit: int = 20):
+            # p50/p99 per pipeline stage, and the most recent traces with their spans
+            return FastJSONResponse({"data": {"stages": TRACER.stage_summary(),
+                                              "traces": TRACER.traces(max(0, limit))}})
+
+        @self.router.post("/traces/export")
+        async def export_traces() -> dict:
+            # OTLP JSON, for an OpenTelemetry collector file receiver or Jaeger's import
+            count = await asyncio.to_thread(TRACER.export, TRACE_EXPORT_PATH)
+            return {"success": True, "data": {"path": os.path.abspath(TRACE_EXPORT_PATH), "spans": count}}
+
+        @self.router.delete("/traces")
+        async def clear_traces() -> dict:
+            TRACER.clear()
+            return {"success": True}
+
+    @staticmethod
+    def authorize(request: Request, x_admin_token: Optional[str] = Header(None)):
+        # Profiles, stacks and traces expose the internals of the server, deny unless told otherwise
+        if ADMIN_TOKEN:
+            if x_admin_token is None or not secrets.compare_digest(x_admin_token, ADMIN_TOKEN):
+                raise HTTPException(status_code=403, detail="Admin token required")
+        elif request.client is None or request.client.host not in LOOPBACK_HOSTS:
+            raise HTTPException(status_code=403, detail="Set CABLEOPS_ADMIN_TOKEN to use the admin routes remotely")
@@ -1,18 +1,18 @@
+import asyncio
 import json
-from typing import Any
+from typing import Any, Union
 
-from fastapi import APIRouter, WebSocket, WebSocketDisconnect, HTTPException
-from mongoengine import DoesNotExist
+from fastapi import APIRouter, Request, WebSocket, WebSocketDisconnect, HTTPException
 
 from database import ServerMemory
 from database.base_models import ContestCarrierBase, RiderStatsBase, ScorecardBase
-from database.CWA_Events import ContestCarrier, RiderCompStats
-from database.utils import calculate_stats, replace_nan
+from database.repository import Repository
 from webserver import ResponseHandler
-
-
-def find_carrier_by_session(session_id: str):
-    return ContestCarrier.objects(session=session_id).first()
+from webserver.delta import DeltaTracker
+from webserver.ingestion import ScorecardIngestion
+from webserver.metrics import observe_websocket_message
+from webserver.response_cache import ResponseCache
+from webserver.tracing import TRACER
 
 
 class ContestRoutes:
@@ -21,6 +21,11 @@ class ContestRoutes:
         self.manager = connection_manager
         self.memory = server_memory
         self.contest_carrier_base = ContestCarrierBase
+        # Last stats broadcast per rider, for 'stats_delta' clients
+        self.stats_deltas = DeltaTracker()
+        self.cache = ResponseCache()
+        self.ingestion = ScorecardIngestion(server_memory, self.update_rider_stats)
+        self.background_tasks = set()
         self.define_routes()
 
     def define_routes(self):
@@ -32,41 +37,74 @@ class ContestRoutes:
             path = "/contest/ws"
             user_uuid = None
             is_connected = True  # Flag to keep track of connection status
+            observation = None  # Metrics of the message being handled
+
+            async def reply(payload):
+                # Error replies count as failed messages in the metrics
+                if observation is not None and isinstance(payload, dict) and payload.get("type") == "error":
+                    observation.failed = True
+                # Direct replies follow the format negotiated on connect, JSON until then
+                await self.manager.send(websocket, payload, self.manager.format_of(user_uuid))
 
             try:
                 while is_connected:
-                    message = await websocket.receive_text()
-                    message_data = json.loads(message)
-                    print(f"Received WebSocket message: {message_data.get('type')}")
+                    message_data = await self.manager.receive(websocket)
 
                     request_type = message_data.get("type")
 
-                    if request_type == "connect":
-                        user_uuid = message_data.get("data")
-                        await self.manager.register(websocket, user_uuid, path)
-                        await websocket.send_json(ResponseHandler.success("User registered"))
-
-                    elif request_type == 'carrier':
-                        update_result = await self.handle_carrier(message_data.get("data"))
-                        await websocket.send_json(update_result)
-                        # Here you would handle the 'carrier' message and send a structured response
-                    elif request_type == 'scorecard':
-                        update_result = await self.handle_scorecard(message_data.get("data"))
-                        await websocket.send_json(update_result)
-                    # elif request_type == 'session':
-                    #     print('session received')
-                    #     update_result = await self.handle_session(message_data.get("data"))
-                    #     await websocket.send_json(update_result)
-                    elif request_type == 'ping':
-                        await websocket.send_json(ResponseHandler.success("That tickles!"))
-                    else:
-                        await websocket.send_json(ResponseHandler.error("Invalid request format"))
+                    with observe_websocket_message(request_type) as observation, \
+                            TRACER.span('ws.message', message_type=request_type or ''):
+                        if request_type == "connect":
+                            connect_data = message_data.get("data")
+                            # Either the bare uuid or {"uuid": ..., "topics": [...], "features": [...], "format": ...}
+                            options = {}
+                            if isinstance(connect_data, dict):
+                                user_uuid = connect_data.get("uuid")
+                                options = {key: connect_data.get(key) for key in ("topics", "features", "format")}
+                            else:
+                                user_uuid = connect_data
+                            await self.manager.register(websocket, user_uuid, path, **options)
+                            await reply(ResponseHandler.success("User registered"))
+
+                        elif request_type in ('subscribe', 'unsubscribe'):
+                            topics = message_data.get("data") or []
+                            if isinstance(topics, str):
+                                topics = [topics]
+                            if not user_uuid:
+                                await reply(ResponseHandler.error("Connect before subscribing"))
+                            else:
+                                if request_type == 'subscribe':
+                                    subscribed = self.manager.subscribe(user_uuid, topics)
+                                else:
+                                    subscribed = self.manager.unsubscribe(user_uuid, topics)
+                                await reply(ResponseHandler.success("Subscriptions updated",
+                                                                                  sorted(subscribed)))
+
+                        elif request_type == 'carrier':
+                            update_result = await self.handle_carrier(message_data.get("data"))
+                            await reply(update_result)
+                            # Here you would handle the 'carrier' message and send a structured response
+                        elif request_type == 'scorecard':
+                            update_result = await self.handle_scorecard(message_data.get("data"))
+                            await reply(update_result)
+                        # elif request_type == 'session':
+                        #     print('session received')
+                        #     update_result = await self.handle_session(message_data.get("data"))
+                        #     await websocket.send_json(update_result)
+                        elif request_type == 'stats_snapshot':
+                            # Delta clients that just joined or missed a sequence number resync here
+                            await reply(self.stats_snapshot(message_data.get("data")))
+                        elif request_type == 'ping':
+                            await reply(ResponseHandler.success("That tickles!"))
+                        else:
+                            await reply(ResponseHandler.error("Invalid request format"))
 
             except WebSocketDisconnect:
                 print('WebSocket disconnected:', websocket.client)
                 is_connected = False
                 if user_uuid:
-                    await self.manager.disconnect(user_uuid)
+                    # The uuid may have re-registered on a new socket already, only drop this one
+                    await self.manager.disconnect(user_uuid, websocket=websocket)
             except Exception as e:
                 print(f"Error: {e}")
                 is_connected = False
@@ -74,23 +112,30 @@ class ContestRoutes:
                 if is_connected:
                     await websocket.close()
 
+        @self.router.get("/connections")
+        async def get_connection_metrics() -> dict:
+            # Fan-out health: queue depths, drops and send latency
+            return {"data": self.manager.get_metrics()}
+
+        @self.router.get("/ingestion")
+        async def get_ingestion_metrics() -> dict:
+            # Scorecard write queue depth, batches and persist lag
+            return {"data": self.ingestion.get_metrics()}
+
         @self.router.get("/carriers")
-        async def get_contest_carriers() -> dict[str, list[Any]]:
+        async def get_contest_carriers(request: Request) -> dict[str, list[Any]]:
             try:
-                return {"data": self.memory.carriers}
+                return self.cache.respond(request, self.memory.carriers.version,
+                                          lambda: {"data": self.memory.carriers.to_list()})
 
             except Exception as e:
                 raise HTTPException(status_code=400, detail=str(e))
 
-    async def handle_scorecard(self, scorecard_data: str) -> dict:
+    async def handle_scorecard(self, scorecard_data: Union[str, dict]) -> dict:
         try:
-            print("hanlde Scorecard")
-            scorecard_data = json.loads(scorecard_data)
-
-            # Process the scorecard data
-            if not scorecard_data.get('landed', True):
-                carrier = self.remove_rider_from_carrier(scorecard_data.get('session'))
-                await self.manager.broadcast(type="carrier", data=carrier)
+            # JSON clients send a string, MessagePack clients a map
+            if isinstance(scorecard_data, str):
+                scorecard_data = json.loads(scorecard_data)
 
             # Convert attributes
             scorecard_data['spin_direction'] = scorecard_data.pop('spinDirection', '').lower()
@@ -99,88 +144,98 @@ class ContestRoutes:
             # Create ScorecardBase instance
             pydantic_scorecard = ScorecardBase(**scorecard_data)
 
-            # Save scorecard
-            scorecard_id = pydantic_scorecard.save()
+            # Queue the scorecard for writing, the rider's stats follow once it is stored
+            with TRACER.span('scorecard.submit', rider_id=pydantic_scorecard.rider or ''):
+                str_scorecard_id = self.ingestion.submit(pydantic_scorecard)
 
-            # Convert ObjectId to string
-            str_scorecard_id = str(scorecard_id)
-
-            # Assign the string ID to the Pydantic model
-            pydantic_scorecard.id = str_scorecard_id
-
-
-            self.memory.add_scorecard(pydantic_scorecard)
-            pydantic_stats = await self.update_rider_stats(pydantic_scorecard.rider)
-
-            # Convert Pydantic model to dict and replace NaN values®
-            stats_dict = replace_nan(pydantic_stats.dict())
+            # A fall frees the rider's carrier without holding up the judge, once the scorecard is accepted
+            if not pydantic_scorecard.landed:
+                task = asyncio.create_task(self.release_carrier(pydantic_scorecard.session))
+                # The loop only keeps weak references to tasks
+                self.background_tasks.add(task)
+                task.add_done_callback(self.background_tasks.discard)
 
             # broadcast updates
-            await self.manager.broadcast(type="scorecard", data=pydantic_scorecard.json())
-            await self.manager.broadcast(type="stats", data=stats_dict)
+            with TRACER.span('broadcast.scorecard', rider_id=pydantic_scorecard.rider or ''):
+                await self.manager.broadcast(type="scorecard", data=pydantic_scorecard,
+                                             topics=self.manager.topics_for("scorecard", pydantic_scorecard.park,
+                                                                            pydantic_scorecard.rider))
 
-            return ResponseHandler.success("Scorecard processed")
+            return ResponseHandler.success("Scorecard processed", {"id": str_scorecard_id})
         except Exception as e:
             print(f"Error occurred: {e}")
             return ResponseHandler.error(str(e))
 
-    async def handle_carrier(self, carrier_data: str):
+    async def handle_carrier(self, carrier_data: Union[str, dict]):
         try:
-            data = json.loads(carrier_data)
-            carrier = self.find_carrier(data['number'])
+            data = json.loads(carrier_data) if isinstance(carrier_data, str) else carrier_data
+            # Without a rider_id the carrier is cleared
+            carrier = await Repository.assign_carrier(data['number'], data.get('rider_id'), data.get('bib_color'),
+                                                      data.get('session'))
             if not carrier:
                 return ResponseHandler.error(f"Carrier with number {data['number']} not found")
 
-            if not data.get('rider_id'):
-                print("removing rider")
-                carrier.rider_id = None
-                carrier.bib_color = None
-                carrier.session = None
-                print('removed')
-            else:
-
-                carrier.rider_id = data.get('rider_id')
-                carrier.bib_color = data.get('bib_color')
-                carrier.session = data.get('session')
-
-            carrier.save()
-
             pydantic_carrier = self.memory.update_carriers(carrier)
 
-            await self.manager.broadcast(type="carrier", data=pydantic_carrier)
+            await self.manager.broadcast(type="carrier", data=pydantic_carrier, key=pydantic_carrier['number'],
+                                         topics=self.manager.topics_for("carrier", pydantic_carrier['number']))
 
             return ResponseHandler.success("Carrier updated successfully")
         except Exception as e:
             return ResponseHandler.error(str(e))
 
-    def find_carrier(self, carrier_number):
-        return ContestCarrier.objects(number=carrier_number).first()
-
-    async def update_rider_stats(self, rider_id: str):
-        new_stats = calculate_stats(rider_id)
-
+    async def update_rider_stats(self, rider_id: str, new_stats: dict):
+        # Called by the ingestion pipeline with the rider's stats folded over the newly stored scorecards
         # Update MongoDB document
-        try:
-            mongo_stats = RiderCompStats.objects.get(rider=rider_id)
-        except DoesNotExist:
-            mongo_stats = RiderCompStats(rider=rider_id)
-
-        for key, value in new_stats.items():
-            setattr(mongo_stats, key, value)
-        mongo_stats.save()
-
-        # Create a new Pydantic model instance with updated data
-        pydantic_stats = RiderStatsBase.from_orm(mongo_stats)
-
-        await self.memory.update_stats(pydantic_stats)
+        with TRACER.span('stats.save', rider_id=rider_id):
+            pydantic_stats = await Repository.save_rider_stats(rider_id, new_stats)
+
+        # Clients already hold the stats in memory, diff the first delta against them
+        previous_stats = self.memory.stats.get_by('rider', rider_id)
+        if previous_stats is not None:
+            self.stats_deltas.seed(rider_id, previous_stats.dict())
+
+        # Includes the profile rebuild and the Mongo reads it needs
+        with TRACER.span('memory.update_stats', rider_id=rider_id):
+            await self.memory.update_stats(pydantic_stats)
+        with TRACER.span('broadcast.stats', rider_id=rider_id):
+            await self.broadcast_stats(pydantic_stats)
         return pydantic_stats
 
-    def remove_rider_from_carrier(self, session_id):
-        carrier = find_carrier_by_session(session_id)
+    async def broadcast_stats(self, pydantic_stats: RiderStatsBase):
+        # NaN is encoded as null by the serialization layer, no need to walk the dict first
+        stats_dict = pydantic_stats.dict()
+        topics = self.manager.topics_for("stats", pydantic_stats.rider)
+
+        # Legacy clients keep getting the full stats, 'stats_delta' clients only what changed
+        sequence, patch = self.stats_deltas.update(pydantic_stats.rider, stats_dict)
+        # Full stats supersede each other within a tick, deltas build on each other and are all sent
+        await self.manager.broadcast(type="stats", data=stats_dict, topics=topics, excludes="stats_delta",
+                                     key=pydantic_stats.rider)
+        await self.manager.broadcast(type="stats_delta", topics=topics, requires="stats_delta",
+                                     data={"rider": pydantic_stats.rider, "seq": sequence, "patch": patch})
+
+    def stats_snapshot(self, rider_id: str) -> dict:
+        snapshot = self.stats_deltas.snapshot(rider_id)
+        if snapshot is None:
+            stats = self.memory.stats.get_by('rider', rider_id)
+            if stats is None:
+                return ResponseHandler.error(f"No stats for rider {rider_id}")
+            snapshot = self.stats_deltas.seed(rider_id, stats.dict())
+        sequence, state = snapshot
+        return {"type": "stats_snapshot", "data": {"rider": rider_id, "seq": sequence, "stats": state}}
+
+    async def release_carrier(self, session_id):
+        try:
+            carrier = await self.remove_rider_from_carrier(session_id)
+            carrier_number = carrier.get('number') if carrier else None
+            await self.manager.broadcast(type="carrier", data=carrier, key=carrier_number,
+                                         topics=self.manager.topics_for("carrier", carrier_number))
+        except Exception as e:
+            print(f"Error releasing carrier of session {session_id}: {e}")
+
+    async def remove_rider_from_carrier(self, session_id):
+        carrier = await Repository.clear_carrier_session(session_id)
         if carrier:
-            carrier.rider_id = None
-            carrier.bib_color = None
-            carrier.session = None
-            carrier.save()
             return self.memory.update_carriers(carrier)
 
@@ -1,11 +1,12 @@
 from typing import Any
 
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, HTTPException, Request
 from pydantic import json
 from starlette.websockets import WebSocket, WebSocketDisconnect
 
 from database.base_models import ParkBase
 from webserver import ResponseHandler
+from webserver.response_cache import ResponseCache
 
 
 class ParkRoutes:
@@ -13,6 +14,7 @@ class ParkRoutes:
         self.router = APIRouter(tags=["Cable"])
         self.manager = connection_manager
         self.memory = server_memory
+        self.cache = ResponseCache()
         self.define_routes()
 
     def define_routes(self):
@@ -36,9 +38,10 @@ class ParkRoutes:
                     pass
 
         @self.router.get("")
-        async def get_parks() -> dict[str, Any]:
+        async def get_parks(request: Request) -> dict[str, Any]:
             try:
-                return {'data': self.memory.parks}
+                return self.cache.respond(request, self.memory.parks.version,
+                                          lambda: {'data': self.memory.parks.to_list()})
             except Exception as e:
                 return ResponseHandler.error('Failed to delivery parks')
 
@@ -48,7 +51,7 @@ class ParkRoutes:
 
             try:
                 # Find the park in memory
-                park = next((p for p in self.memory.parks if p.id == park_id), None)
+                park = self.memory.parks.get(park_id)
                 if not park:
                     raise HTTPException(status_code=404, detail="Park not found")
 
@@ -63,6 +66,7 @@ class ParkRoutes:
                 park.maintenance = park_data.maintenance
                 park.contacts = park_data.contacts
                 park.cables = park_data.cables
+                self.memory.parks.touch(park)
 
                 # Save to the database (mock this for now)
                 # If you use MongoDB or SQL, this would be the place to save the park.
@@ -75,5 +79,5 @@ class ParkRoutes:
                 raise HTTPException(status_code=500, detail="Failed to update park")
 
     async def handle_request(self, websocket, request_type, message_data):
-        print('websocket', 'request_type', 'message_data')
-        print(websocket, request_type, message_data)
+        # No park requests are handled yet
+        pass
@@ -1,10 +1,12 @@
 from typing import Any
 
-from fastapi import APIRouter, HTTPException, status
+from fastapi import APIRouter, HTTPException, Request, status
 
 from database import ServerMemory
 from database.base_models import RiderBase, RiderProfileBase
-from database.CWA_Events import Rider
+from database.repository import Repository
+from webserver.response_cache import ResponseCache
+from webserver.serialization import FastJSONResponse
 
 
 
@@ -14,17 +16,19 @@ class RiderRoutes:
         self.manager = connection_manager
         self.memory = server_memory
         self.rider_base = RiderBase
+        self.cache = ResponseCache()
         self.define_routes()
 
     def define_routes(self):
 
         @self.router.get("")
-        async def get_riders() -> dict[str, list[Any] | str]:
+        async def get_riders(request: Request) -> dict[str, list[Any] | str]:
             try:
                 # print(f"Sending batch of {len(self.pydantic_riders)} riders")
                 # rider_data = [rider.serialize() for rider in self.pydantic_riders]
 
-                return {"data": self.memory.riders}
+                return self.cache.respond(request, self.memory.riders.version,
+                                          lambda: {"data": self.memory.riders.to_list()})
 
             except Exception as e:
                 raise HTTPException(status_code=400, detail=str(e))
@@ -32,11 +36,8 @@ class RiderRoutes:
         @self.router.post("/update")
         async def update_rider(rider_data: dict) -> dict:
             try:
-                # Update MongoDB database and retrieve the updated rider
-                updated_rider_mongo = RiderBase.update_or_create_rider(rider_data)
-
-                # Convert the updated MongoDB document to a Pydantic model
-                updated_rider_pydantic = RiderBase.from_orm(updated_rider_mongo)
+                # Update MongoDB database and retrieve the updated rider as a Pydantic model
+                updated_rider_pydantic = await Repository.update_or_create_rider(rider_data)
                 self.update_pydantic_list(updated_rider_pydantic)
 
                 return {"success": True, "rider_id": str(updated_rider_pydantic.id)}
@@ -48,14 +49,13 @@ class RiderRoutes:
             try:
                 # Here, add your logic to create a new rider in the database.
                 # For now, I'm just generating a mock UUID.
-                new_rider = Rider()
-                new_rider.save()
+                new_rider_id = await Repository.create_rider()
 
                 # Save the new rider in the database and get the rider ID
                 # rider = YourDatabaseModel.create(...)
                 # new_rider_id = str(rider.id)
 
-                return {"success": True, "rider_id": str(new_rider.id)}
+                return {"success": True, "rider_id": new_rider_id}
             except Exception as e:
                 raise HTTPException(status_code=500, detail=str(e))
 
@@ -69,7 +69,7 @@ class RiderRoutes:
                         status_code=status.HTTP_404_NOT_FOUND,
                         detail="Rider profile not found."
                     )
-                return profile
+                return FastJSONResponse(profile)
             except Exception as e:
                 # For other exceptions, return a 500 status code with the error message
                 raise HTTPException(
@@ -78,10 +78,5 @@ class RiderRoutes:
                 )
 
     def update_pydantic_list(self, updated_rider_pydantic):
-        # Find and update or add the Pydantic rider in the list
-        for i, pydantic_rider in enumerate(self.memory.riders):
-            if pydantic_rider.id == updated_rider_pydantic.id:
-                self.memory.riders[i] = updated_rider_pydantic
-                break
-        else:
-            self.memory.riders.append(updated_rider_pydantic)
+        # Update or add the Pydantic rider, keyed by its id
+        self.memory.update_rider(updated_rider_pydantic)
@@ -4,7 +4,10 @@ from typing import Optional, List
 from fastapi import APIRouter, HTTPException, Query
 
 from database.base_models.scorecard_base import ScorecardBase
-from database.CWA_Events import Scorecard
+from database.repository import Repository
+from database.scorecard_cursor import encode_cursor
+from database.scorecard_store import CODED_COLUMNS
+from webserver.serialization import FastJSONResponse
 
 
 class ScorecardRoutes:
@@ -22,23 +25,34 @@ class ScorecardRoutes:
                                  rider_ids: Optional[List[str]] = Query(None)):
 
             try:
-                # Decide the source of scorecards based on the presence of rider_ids
-                if rider_ids:
-                    scorecards = Scorecard.get_scorecards(rider_ids=rider_ids, sort_by=sort_by, cursor=cursor)
+                if self.memory.synced_at is not None:
+                    # Served from the columnar store once memory has loaded
+                    pydantic_scorecards = self.memory_scorecards(rider_ids, sort_by, cursor)
                 else:
-                    scorecards = Scorecard.get_scorecards(sort_by=sort_by, cursor=cursor)
+                    # Until then from Mongo, on the database pool
+                    pydantic_scorecards = await Repository.get_scorecards(rider_ids=rider_ids, sort_by=sort_by,
+                                                                          cursor=cursor)
 
-                pydantic_scorecards = [ScorecardBase.from_orm(scorecard) for scorecard in scorecards]
+                # The next page starts after the last scorecard of this one
+                next_cursor = encode_cursor(pydantic_scorecards[-1], sort_by) if pydantic_scorecards else None
 
-                if pydantic_scorecards:
-                    # Sort by date assuming the date field is available in the Pydantic model
-                    oldest_scorecard = sorted(pydantic_scorecards, key=lambda x: x.date)[0]
-                    next_cursor = oldest_scorecard.id
-                else:
-                    next_cursor = None
-
-                return {'data': pydantic_scorecards, "cursor": next_cursor}
+                return FastJSONResponse({'data': pydantic_scorecards, "cursor": next_cursor})
             except Exception as e:
                 raise HTTPException(status_code=400, detail=str(e))
 
 
+
+        @self.router.get("/summary")
+        async def get_scorecard_summary(by: str = Query('trick'),
+                                        rider_ids: Optional[List[str]] = Query(None),
+                                        park_id: Optional[str] = Query(None),
+                                        section: Optional[str] = Query(None),
+                                        landed: Optional[bool] = Query(None)):
+            if by not in CODED_COLUMNS:
+                raise HTTPException(status_code=400, detail=f"Cannot group scorecards by {by}")
+            summary = self.memory.scorecards.aggregate(by=by, rider_ids=rider_ids, park_id=park_id,
+                                                       section=section, landed=landed)
+            return {'data': [{by: value, **values} for value, values in summary.items()]}
+
+    def memory_scorecards(self, rider_ids, sort_by, cursor) -> List[ScorecardBase]:
+        return self.memory.scorecards.query(rider_ids=rider_ids, sort_by=sort_by, cursor=cursor)
@@ -1,14 +1,18 @@
 import json
+import os
 from typing import Optional, List
 
-from fastapi import APIRouter, WebSocket, HTTPException
+from fastapi import APIRouter, Request, WebSocket, HTTPException
 from starlette.websockets import WebSocketDisconnect
 
 from database.base_models import RiderStatsBase
+from webserver.response_cache import ResponseCache
 
 
 # Will print all messages from debug and above
 
+# Largest page of stats served at once, also the page size when none is asked for
+STATS_BATCH_SIZE = int(os.getenv('CABLEOPS_STATS_BATCH_SIZE', 500))
 
 
 class StatsRoute:
@@ -16,6 +20,7 @@ class StatsRoute:
         self.router = APIRouter(tags=["Cable"])
         self.manager = connection_manager
         self.memory = server_memory
+        self.cache = ResponseCache()
         self.define_routes()
 
     def define_routes(self):
@@ -39,34 +44,45 @@ class StatsRoute:
                     pass
 
         @self.router.get("/riders")
-        async def get_stats(cursor: Optional[str] = None,
+        async def get_stats(request: Request,
+                            cursor: Optional[str] = None,
                             stat_id: Optional[str] = None,
                             rider_id: Optional[str] = None,
                             year: Optional[int] = None,
                             batch_size: Optional[int] = None) -> dict[str, List[RiderStatsBase] | str | None]:
             try:
-                # Filter the stats from memory based on query parameters
-                filtered_stats = [stat for stat in self.memory.stats if
-                                  (not stat_id or str(stat.id) == stat_id) and
-                                  (not rider_id or stat.rider == rider_id) and
-                                  (not year or stat.year == year)]
+                return self.cache.respond(request, self.memory.stats.version,
+                                          lambda: self.select_stats(cursor, stat_id, rider_id, year, batch_size))
 
-                # Apply pagination if needed
-                if cursor:
-                    cursor_index = next((index for index, stat in enumerate(filtered_stats) if str(stat.id) == cursor),
-                                        -1)
-                    filtered_stats = filtered_stats[cursor_index + 1:]  # Skip past the cursor
-                if batch_size:
-                    filtered_stats = filtered_stats[:batch_size]
+            except Exception as e:
+                raise HTTPException(status_code=400, detail=str(e))
 
-                # Prepare next cursor
-                next_cursor = str(filtered_stats[-1].id) if filtered_stats else None
+    def select_stats(self, cursor, stat_id, rider_id, year, batch_size) -> dict:
+        # Keyset pagination: pages are id ordered and resume after the cursor id, O(log n + page)
+        batch_size = STATS_BATCH_SIZE if batch_size is None else batch_size
+        if batch_size < 1:
+            raise ValueError("batch_size must be at least 1")
+        # Larger batches are served in pages of the maximum, the cursor fetches the rest
+        batch_size = min(batch_size, STATS_BATCH_SIZE)
 
-                return {'data': filtered_stats, 'cursor': next_cursor}
+        if stat_id:
+            stat = self.memory.stats.get(stat_id)
+            matches = (stat and (not rider_id or stat.rider == rider_id) and (not year or stat.year == year)
+                       and (not cursor or stat.id > cursor))
+            filtered_stats = [stat] if matches else []
+        elif rider_id and year:
+            filtered_stats = self.memory.stats.page(cursor, batch_size, 'rider_year', (rider_id, year))
+        elif rider_id:
+            filtered_stats = self.memory.stats.page(cursor, batch_size, 'rider', rider_id)
+        elif year:
+            filtered_stats = self.memory.stats.page(cursor, batch_size, 'year', year)
+        else:
+            filtered_stats = self.memory.stats.page(cursor, batch_size)
 
-            except Exception as e:
-                raise HTTPException(status_code=400, detail=str(e))
+        # Prepare next cursor
+        next_cursor = str(filtered_stats[-1].id) if filtered_stats else None
 
+        return {'data': filtered_stats, 'cursor': next_cursor}
 
     def handle_request(self, websocket, request_type, message_data):
         pass
@@ -0,0 +1,26 @@
+from typing import Optional
+
+from fastapi import APIRouter, HTTPException
+
+from webserver.serialization import FastJSONResponse
+
+
+class SyncRoute:
+    def __init__(self, connection_manager, server_memory):
+        self.router = APIRouter(tags=["Sync"])
+        self.manager = connection_manager
+        self.memory = server_memory
+        self.define_routes()
+
+    def define_routes(self):
+        @self.router.get("")
+        async def sync(since: Optional[str] = None):
+            """
+            Riders, stats, profiles, carriers and parks changed since the version ``since``.
+
+            Clients keep the returned ``version`` and send it back on the next
+            call; ``full`` tells them to drop their copy and load every document.
+            """
+            if self.memory.synced_at is None:
+                raise HTTPException(status_code=503, detail="Server memory is still loading")
+            return FastJSONResponse(self.memory.changes_since(since))
@@ -0,0 +1,91 @@
+from datetime import date, datetime
+from decimal import Decimal
+from typing import Any, Union
+
+import msgpack
+import orjson
+from bson import ObjectId
+from fastapi.responses import JSONResponse
+from pydantic import BaseModel
+
+# NaN and infinities become null, datetimes keep the "%Y-%m-%dT%H:%M:%S" format of the pydantic encoders
+OPTIONS = orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_OMIT_MICROSECONDS
+
+# Per-connection message formats: 'legacy' nests ``data`` as a JSON string, 'json' embeds it directly,
+# 'msgpack' sends binary MessagePack frames
+FORMATS = ('legacy', 'json', 'msgpack')
+DEFAULT_FORMAT = 'legacy'
+
+
+def _default(obj):
+    if isinstance(obj, BaseModel):
+        return obj.model_dump()
+    if isinstance(obj, ObjectId):
+        return str(obj)
+    if isinstance(obj, (set, frozenset)):
+        return list(obj)
+    if isinstance(obj, Decimal):
+        return float(obj)
+    if hasattr(obj, 'item'):
+        # NumPy/pandas scalars orjson does not know
+        return obj.item()
+    raise TypeError(f"Type is not JSON serializable: {type(obj).__name__}")
+
+
+def dumps(obj: Any) -> bytes:
+    """Encode pydantic models, ObjectIds, datetimes and NaN in one pass."""
+    return orjson.dumps(obj, default=_default, option=OPTIONS)
+
+
+def dumps_text(obj: Any) -> str:
+    return dumps(obj).decode()
+
+
+loads = orjson.loads
+
+
+def _msgpack_default(obj):
+    if isinstance(obj, datetime):
+        # Same text as the JSON formats
+        return obj.isoformat(timespec='seconds')
+    if isinstance(obj, date):
+        return obj.isoformat()
+    return _default(obj)
+
+
+def pack(obj: Any) -> bytes:
+    """MessagePack counterpart of ``dumps``; NaN stays a float NaN rather than null."""
+    return msgpack.packb(obj, default=_msgpack_default, use_bin_type=True)
+
+
+def unpack(data: bytes) -> Any:
+    return msgpack.unpackb(data, raw=False)
+
+
+def encode(payload: Any, format: str = DEFAULT_FORMAT) -> Union[str, bytes]:
+    """A text frame for the JSON formats, a binary frame for msgpack."""
+    if format == 'msgpack':
+        return pack(payload)
+    return dumps_text(payload)
+
+
+def decode(frame: Union[str, bytes]) -> Any:
+    """Incoming frames: binary ones are MessagePack, text ones JSON."""
+    if isinstance(frame, (bytes, bytearray)):
+        return unpack(frame)
+    return loads(frame)
+
+
+def encode_message(type: str, data: Any, format: str = DEFAULT_FORMAT) -> Union[str, bytes]:
+    """The ``{"type": ..., "data": ...}`` WebSocket envelope in ``format``."""
+    if format == 'legacy':
+        # Apps from before the serialization layer parse ``data`` a second time
+        data = data if isinstance(data, str) else dumps_text(data)
+    return encode({'type': type, 'data': data}, format)
+
+
+class FastJSONResponse(JSONResponse):
+    """JSON response rendered by ``dumps``; return it directly to skip ``jsonable_encoder`` as well."""
+
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
@@ -0,0 +1,206 @@
+import json
+import os
+import secrets
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Dict, List, Optional
+
+# Finished spans kept in memory, the oldest are dropped first
+TRACE_BUFFER_SIZE = int(os.getenv('CABLEOPS_TRACE_BUFFER_SIZE', 10000))
+# Durations kept per span name for the stage percentiles
+STAGE_WINDOW = 1000
+# Where /api/admin/traces/export writes the buffer
+TRACE_EXPORT_PATH = os.getenv('CABLEOPS_TRACE_FILE', 'traces.json')
+SERVICE_NAME = 'cableops'
+
+# OTLP status codes
+STATUS_OK = 1
+STATUS_ERROR = 2
+
+
+class SpanContext:
+    """What a child span needs from its parent, also carried across the ingestion queue."""
+    __slots__ = ('trace_id', 'span_id')
+
+    def __init__(self, trace_id: str, span_id: str):
+        self.trace_id = trace_id
+        self.span_id = span_id
+
+
+class Span:
+    __slots__ = ('name', 'context', 'parent_id', 'start_ns', 'end_ns', 'attributes', 'status', 'message')
+
+    def __init__(self, name: str, parent: Optional[SpanContext], attributes: Dict[str, Any],
+                 start_ns: Optional[int] = None):
+        trace_id = parent.trace_id if parent is not None else secrets.token_hex(16)
+        self.name = name
+        self.context = SpanContext(trace_id, secrets.token_hex(8))
+        self.parent_id = parent.span_id if parent is not None else None
+        self.start_ns = start_ns if start_ns is not None else time.time_ns()
+        self.end_ns: Optional[int] = None
+        self.attributes = attributes
+        self.status = STATUS_OK
+        self.message = ''
+
+    def set_attribute(self, key: str, value: Any):
+        self.attributes[key] = value
+
+    def fail(self, message: str):
+        self.status = STATUS_ERROR
+        self.message = message
+
+    @property
+    def duration(self) -> float:
+        return (self.end_ns - self.start_ns) / 1e9
+
+    def to_otlp(self) -> dict:
+        span = {
+            'traceId': self.context.trace_id,
+            'spanId': self.context.span_id,
+            'name': self.name,
+            # SPAN_KIND_INTERNAL
+            'kind': 1,
+            'startTimeUnixNano': str(self.start_ns),
+            'endTimeUnixNano': str(self.end_ns),
+            'attributes': [{'key': key, 'value': _otlp_value(value)} for key, value in self.attributes.items()],
+            'status': {'code': self.status, 'message': self.message} if self.message else {'code': self.status},
+        }
+        if self.parent_id:
+            span['parentSpanId'] = self.parent_id
+        return span
+
+
+def _otlp_value(value: Any) -> dict:
+    if isinstance(value, bool):
+        return {'boolValue': value}
+    if isinstance(value, int):
+        # OTLP JSON carries 64 bit integers as strings
+        return {'intValue': str(value)}
+    if isinstance(value, float):
+        return {'doubleValue': value}
+    return {'stringValue': str(value)}
+
+
+_current_span: ContextVar[Optional[Span]] = ContextVar('cableops_current_span', default=None)
+
+
+class Tracer:
+    """
+    In-process tracer for the scorecard pipeline.
+
+    ``span`` opens a child of the current span, which follows the code
+    through awaits and the tasks it creates by way of a context variable.
+    Work that continues in another task, such as the ingestion writer,
+    passes the ``SpanContext`` along and records its spans with ``record``.
+    Finished spans go to a ring buffer, exportable as OTLP JSON, and their
+    durations to a window per span name for the p50 and p99 of each stage.
+    """
+
+    def __init__(self, size: int = TRACE_BUFFER_SIZE, window: int = STAGE_WINDOW):
+        self.spans: deque = deque(maxlen=size)
+        self.window = window
+        self.stages: Dict[str, deque] = {}
+        # Spans finish on the loop and in database pool threads
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def current() -> Optional[SpanContext]:
+        span = _current_span.get()
+        return span.context if span is not None else None
+
+    @contextmanager
+    def span(self, name: str, parent: Optional[SpanContext] = None, **attributes):
+        """Time the block as ``name``, under ``parent`` or else the current span."""
+        span = Span(name, parent if parent is not None else self.current(), attributes)
+        token = _current_span.set(span)
+        try:
+            yield span
+        except BaseException as e:
+            span.fail(f"{type(e).__name__}: {e}")
+            raise
+        finally:
+            _current_span.reset(token)
+            self._finish(span)
+
+    def record(self, name: str, start_ns: int, parent: Optional[SpanContext] = None, **attributes) -> Span:
+        """Add a span that started at ``start_ns`` and ends now, e.g. the time a scorecard spent queued."""
+        span = Span(name, parent, attributes, start_ns)
+        self._finish(span)
+        return span
+
+    def _finish(self, span: Span):
+        span.end_ns = time.time_ns()
+        with self._lock:
+            self.spans.append(span)
+            durations = self.stages.get(span.name)
+            if durations is None:
+                durations = self.stages[span.name] = deque(maxlen=self.window)
+            durations.append(span.duration)
+
+    def stage_summary(self) -> Dict[str, dict]:
+        """Count, p50, p99 and max duration in milliseconds of every span name."""
+        with self._lock:
+            stages = {name: sorted(durations) for name, durations in self.stages.items()}
+
+        def millis(ordered: List[float], q: float) -> float:
+            return round(ordered[min(len(ordered) - 1, int(q * len(ordered)))] * 1000, 3)
+
+        return {
+            name: {'count': len(ordered), 'p50_ms': millis(ordered, 0.5), 'p99_ms': millis(ordered, 0.99),
+                   'max_ms': round(ordered[-1] * 1000, 3)}
+            for name, ordered in stages.items() if ordered
+        }
+
+    def traces(self, limit: int = 20) -> List[dict]:
+        """The ``limit`` most recent traces, each with its spans in start order."""
+        with self._lock:
+            spans = list(self.spans)
+        traces: Dict[str, List[Span]] = {}
+        for span in reversed(spans):
+            if span.context.trace_id not in traces:
+                if len(traces) == limit:
+                    continue
+                traces[span.context.trace_id] = []
+            traces[span.context.trace_id].append(span)
+        return [{
+            'trace_id': trace_id,
+            'spans': [{
+                'name': span.name,
+                'span_id': span.context.span_id,
+                'parent_id': span.parent_id,
+                'offset_ms': round((span.start_ns - min(s.start_ns for s in trace)) / 1e6, 3),
+                'duration_ms': round(span.duration * 1000, 3),
+                'attributes': span.attributes,
+                'error': span.message or None,
+            } for span in sorted(trace, key=lambda span: span.start_ns)],
+        } for trace_id, trace in traces.items()]
+
+    def to_otlp(self) -> dict:
+        """The buffered spans as an OTLP/JSON ``ExportTraceServiceRequest``."""
+        with self._lock:
+            spans = list(self.spans)
+        return {'resourceSpans': [{
+            'resource': {'attributes': [{'key': 'service.name', 'value': {'stringValue': SERVICE_NAME}}]},
+            'scopeSpans': [{
+                'scope': {'name': 'webserver.tracing'},
+                'spans': [span.to_otlp() for span in spans],
+            }],
+        }]}
+
+    def export(self, path: str = TRACE_EXPORT_PATH) -> int:
+        """Write the buffered spans to ``path`` as OTLP JSON, blocking; returns the number written."""
+        payload = self.to_otlp()
+        with open(path, 'w') as f:
+            json.dump(payload, f)
+        return len(payload['resourceSpans'][0]['scopeSpans'][0]['spans'])
+
+    def clear(self):
+        with self._lock:
+            self.spans.clear()
+            self.stages.clear()
+
+
+TRACER = Tracer()
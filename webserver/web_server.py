@@ -4,7 +4,7 @@ import threading
 
 import uvicorn
 from fastapi import FastAPI, Request, HTTPException
-from fastapi.responses import FileResponse
+from fastapi.responses import FileResponse, Response
 from starlette.middleware.base import BaseHTTPMiddleware
 from starlette.staticfiles import StaticFiles
 
@@ -13,10 +13,15 @@ from database.NoteBot.route import NoteBotRoute
 
 from database.utils import custom_json_encoder
 from .connection_manager import ConnectionManager
+from .loop_monitor import LoopMonitor
+from .metrics import CONTENT_TYPE, REGISTRY, Gauge, MetricsMiddleware
 from .routes import StatsRoute, ScorecardRoutes, RiderRoutes
 from .routes.contest_routes import ContestRoutes
 from .routes.parks_route import ParkRoutes
+from .routes.sync_route import SyncRoute
+from .routes.admin_routes import AdminRoutes
 from .routes.crypto_routes import router as crypto_router
+from .serialization import FastJSONResponse
 
 # import stripe
 
@@ -40,7 +45,7 @@ class MaxSizeLimitMiddleware(BaseHTTPMiddleware):
 
 class RouteManager:
 
-    def __init__(self, connection, memory):
+    def __init__(self, connection, memory, loop_monitor):
         self.connection = connection
         self.parks_route = ParkRoutes(connection, memory)
         self.riders_route = RiderRoutes(connection, memory)
@@ -48,6 +53,8 @@ class RouteManager:
         self.contest_route = ContestRoutes(connection, memory)
         self.scorecard_route = ScorecardRoutes(connection, memory)
         self.speech2note_route = NoteBotRoute(connection, memory)
+        self.sync_route = SyncRoute(connection, memory)
+        self.admin_route = AdminRoutes(connection, memory, loop_monitor)
 
     def setup_routes(self, app):
         app.include_router(self.riders_route.router, prefix="/api/riders")
@@ -56,39 +63,76 @@ class RouteManager:
         app.include_router(self.parks_route.router, prefix="/api/parks")
         app.include_router(self.contest_route.router, prefix="/api/contest")
         app.include_router(self.speech2note_route.router, prefix="/api/notebot")
+        app.include_router(self.sync_route.router, prefix="/api/sync")
+        app.include_router(self.admin_route.router, prefix="/api/admin")
         app.include_router(crypto_router, prefix="/api/crypto")
 
 class FastAPIApp:
     def __init__(self, database):
-        self.app = FastAPI(json_encoders={type: custom_json_encoder})
+        self.app = FastAPI(json_encoders={type: custom_json_encoder}, default_response_class=FastJSONResponse)
 
         self.initialized = False
         self.database = database
         self.manager = ConnectionManager()
         self.memory = ServerMemory()
-        self.router = RouteManager(self.manager, self.memory)
+        self.loop_monitor = LoopMonitor()
+        self.router = RouteManager(self.manager, self.memory, self.loop_monitor)
         self.router.setup_routes(self.app)
 
         # Add the middleware to limit the request size to 5MB
         self.app.add_middleware(MaxSizeLimitMiddleware)
+        # Outermost, so rejected and failed requests are measured too
+        self.app.add_middleware(MetricsMiddleware)
+        self.register_metrics()
 
         self.app.mount("/static", StaticFiles(directory=os.path.join(BASE_DIR, "website", "static")), name="static")
 
+        # Keep an on-disk snapshot of the memory for fast restarts
+        # The memory loads on the server loop, the only thread that mutates it
+        self.load_task = None
+        self.app.add_event_handler("startup", self.start_loading)
+        self.snapshot_task = None
+        self.app.add_event_handler("startup", self.start_snapshots)
+        # Loop lag and stacks of slow callbacks, see /api/admin/loop
+        self.app.add_event_handler("startup", self.loop_monitor.start)
+        self.app.add_event_handler("shutdown", self.loop_monitor.stop)
+        # Queued scorecards are written before the final snapshot
+        self.app.add_event_handler("shutdown", self.router.contest_route.ingestion.drain)
+        self.app.add_event_handler("shutdown", self.memory.save_snapshot)
+
+    async def start_loading(self):
+        # Not awaited. Until the memory has synced /api/scorecards reads Mongo and /api/sync answers 503,
+        # the riders, stats, contest and parks routes serve whatever has loaded so far, possibly nothing
+        self.load_task = asyncio.create_task(self.initialize())
+
+    async def start_snapshots(self):
+        self.snapshot_task = asyncio.create_task(self.memory.snapshot_periodically())
+
+    def register_metrics(self):
+        ingestion = self.router.contest_route.ingestion
+        REGISTRY.register(Gauge('cableops_websocket_connections', 'Registered WebSocket connections.',
+                                lambda: len(self.manager.active_connections)))
+        REGISTRY.register(Gauge('cableops_ingest_queue_depth', 'Scorecards waiting to be written.',
+                                lambda: ingestion.queue.qsize()))
+        REGISTRY.register(Gauge('cableops_memory_synced', '1 once the server memory has loaded.',
+                                lambda: int(self.memory.synced_at is not None)))
+
+        @self.app.get("/metrics", include_in_schema=False)
+        async def metrics():
+            # Prometheus text exposition format
+            return Response(REGISTRY.render(), media_type=CONTENT_TYPE)
 
     async def initialize(self):
-
-        await self.memory.load_data()
-
-    def start_fastapi_initialization(self):
-        # Function to run the asyncio event loop
-        asyncio.run(self.initialize())
+        try:
+            await self.memory.load_data()
+            self.initialized = True
+        except Exception as e:
+            print(f"Error loading server memory: {e}")
 
     def start_fastapi_server(self):
+        # The server memory is loaded by the startup handler, on the server's own loop
         fastapi_thread = threading.Thread(target=self.run)
         fastapi_thread.start()
-        # Create a thread to run the asyncio initialization
-        initialization_thread = threading.Thread(target=self.start_fastapi_initialization)
-        initialization_thread.start()
 
         @self.app.get("/")
         async def read_root():
@@ -108,6 +152,8 @@ class FastAPIApp:
                 "parks": "/api/parks",
                 "contest": "/api/contest",
                 "notebot": "/api/notebot",
+                "sync": "/api/sync",
+                "admin": "/api/admin",
             }
             return {"api": endpoints}
 